@@ -1,19 +1,58 @@
 import os
+import time
+import threading
 import logging
 from datetime import datetime
-from flask import Flask, g, session, render_template, current_app, flash, redirect, url_for
+from flask import Flask, g, session, render_template, current_app, flash, redirect, url_for, request, jsonify, has_request_context
 from dotenv import load_dotenv
 import json
-from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 import db
 from extensions import csrf, mail
-from commands import crear_admin_command
+from commands import (crear_admin_command, db_maintenance_command, backup_command,
+                      email_outbox_command, ciclo_conexiones_command, metricas_diarias_command)
+from migrations import upgrade_database
+import services.maintenance_service as maintenance_s
+import services.backup_service as backup_s
+import services.email_outbox_service as email_outbox_s
+import services.event_service as event_s
+import services.dashboard_service as dashboard_s
+import services.analytics_service as analytics_s
+import services.profile_search_service as profile_search_s
+import services.main_service as main_s
+from utils import user_context
+from utils.instance_lock import InstanceLock
 
 load_dotenv()
 
+# Endpoints que no necesitan el contexto del usuario ni acceso a la base de datos.
+CONTEXT_FREE_ENDPOINTS = {'static', 'health'}
+
+
+def start_scheduler(app):
+    """
+    Arranca el scheduler de APScheduler si este proceso obtiene el cerrojo
+    'scheduler.lock' de la carpeta 'instance'. Con varios workers de gunicorn
+    o varias instancias de waitress sobre la misma base de datos, los jobs
+    programados (mantenimiento, copias, resúmenes de correo, métricas) corren
+    así en un único proceso. Devuelve True si el scheduler corre aquí.
+    """
+    if app.scheduler.running:
+        return True
+    lock = app.extensions['scheduler_lock']
+    if not lock.acquire():
+        return False
+    try:
+        app.scheduler.start()
+    except Exception as e:
+        lock.release()
+        app.logger.error(f"No se pudo iniciar el scheduler: {e}", exc_info=True)
+        return False
+    app.logger.info(f"Scheduler de APScheduler iniciado en el proceso {os.getpid()}.")
+    return True
+
 
 def create_app(test_config=None):
     """
@@ -37,6 +76,14 @@ def create_app(test_config=None):
             app.root_path,
             'uploads'),
         PER_PAGE=10,
+        SQL_PROFILING=os.environ.get(
+            'SQL_PROFILING', 'false').lower() in ['true', '1', 't'],
+        SLOW_QUERY_MS=float(os.environ.get('SLOW_QUERY_MS', 0)) or None,
+        # Cada conexión de /api/stream ocupa un hilo del servidor: el tope debe
+        # quedar por debajo de los hilos por proceso y la duración por debajo
+        # del 'timeout' del servidor. Con 0 se desactiva el canal.
+        SSE_MAX_STREAMS=int(os.environ.get('SSE_MAX_STREAMS', 8)),
+        SSE_MAX_SECONDS=float(os.environ.get('SSE_MAX_SECONDS', 90)),
     )
 
     if test_config is None:
@@ -111,9 +158,7 @@ def create_app(test_config=None):
     mail.init_app(app)
     db.init_app(app)
 
-    # Configurar un ThreadPoolExecutor para tareas asíncronas como el envío de correos
-    app.executor = ThreadPoolExecutor(max_workers=5)
-
+    auto_upgrade = False
     with app.app_context():
         db_conn = db.get_db()
         cursor = db_conn.cursor()
@@ -125,13 +170,41 @@ def create_app(test_config=None):
                     "Base de datos no inicializada. Creando tablas...")
                 db.init_db()
                 app.logger.info("Base de datos inicializada correctamente.")
+            else:
+                auto_upgrade = app.config.get('DB_AUTO_UPGRADE', True)
         except Exception as e:
             app.logger.error(f"Error al inicializar la base de datos: {e}")
         finally:
             # No es necesario cerrar el cursor aquí si get_db() gestiona el ciclo de vida
             pass
 
+    if auto_upgrade:
+        # Las migraciones pendientes se aplican antes de la primera solicitud
+        # que atiende el proceso, nunca al cargar la aplicación: los comandos
+        # de 'flask' (p. ej. 'flask db-upgrade --dry-run') no deben cambiar el
+        # esquema. Los índices nuevos se construyen en segundo plano.
+        upgrade_state = {'pending': True}
+        upgrade_lock = threading.Lock()
+
+        @app.before_request
+        def auto_upgrade_handler():
+            if not upgrade_state['pending']:
+                return
+            with upgrade_lock:
+                if not upgrade_state['pending']:
+                    return
+                try:
+                    upgrade_database(app, online='background')
+                except Exception as e:
+                    app.logger.error(f"Error al actualizar el esquema de la base de datos: {e}")
+                upgrade_state['pending'] = False
+
     app.cli.add_command(crear_admin_command)
+    app.cli.add_command(db_maintenance_command)
+    app.cli.add_command(backup_command)
+    app.cli.add_command(email_outbox_command)
+    app.cli.add_command(ciclo_conexiones_command)
+    app.cli.add_command(metricas_diarias_command)
 
     scheduler = BackgroundScheduler(
         jobstores=app.config['SCHEDULER_JOBSTORES'],
@@ -140,61 +213,75 @@ def create_app(test_config=None):
     scheduler.app = app
 
     app.scheduler = scheduler
+    app.extensions['scheduler_lock'] = InstanceLock(
+        os.path.join(app.instance_path, 'scheduler.lock'))
+
+    if not app.testing:
+        maintenance_s.schedule_maintenance_job(app)
+        backup_s.schedule_backup_job(app)
+        email_outbox_s.schedule_digest_job(app)
+        analytics_s.schedule_rollup_job(app)
+
+        # El hilo de envío de correo y el scheduler se arrancan con la primera
+        # solicitud que atiende el proceso, nunca en los comandos de 'flask'.
+        # Los procesos que no obtienen el cerrojo del scheduler lo reintentan
+        # cada minuto por si el que lo tiene termina, p. ej. al reciclar un
+        # worker de gunicorn.
+        scheduler_retry = {'at': 0.0}
+
+        @app.before_request
+        def start_background_services_handler():
+            # Los correos se envían desde la bandeja de salida, nunca en la solicitud.
+            email_outbox_s.start_sender(app)
+            now = time.monotonic()
+            if scheduler.running or now < scheduler_retry['at']:
+                return
+            if not start_scheduler(app):
+                scheduler_retry['at'] = now + app.config.get('SCHEDULER_LOCK_RETRY_SECONDS', 60)
+
+    user_context.init_app(app)
+    event_s.init_app(app)
+    dashboard_s.init_app(app)
+    analytics_s.init_app(app)
+    profile_search_s.init_app(app)
+    main_s.init_app(app)
 
     @app.before_request
     def before_request_handler():
         """
         Se ejecuta ANTES de cada solicitud.
-        Carga el usuario y sus notificaciones en el objeto global 'g' de Flask,
-        que está disponible durante el ciclo de vida de la solicitud.
+        Carga el usuario y sus roles en el objeto global 'g' de Flask desde la
+        caché de contexto de usuario, que solo consulta la base de datos cuando
+        la entrada caducó y su 'contexto_version' cambió. Los archivos
+        estáticos y el chequeo de salud no necesitan usuario y se omiten.
         """
         g.user = None
-        session.setdefault('user_roles', [])
+        if request.endpoint in CONTEXT_FREE_ENDPOINTS:
+            return
+
+        if 'user_roles' not in session:
+            session['user_roles'] = []
 
         try:
-            db_conn = db.get_db()
             if 'user_id' in session:
-                cursor = db_conn.cursor()
-
-                sql_user = "SELECT * FROM usuarios WHERE id = ?"
-                sql_roles = """
-                    SELECT r.nombre FROM roles r
-                    JOIN usuario_roles ur ON r.id = ur.rol_id
-                    WHERE ur.usuario_id = ?
-                """
-                sql_notif = """
-                    SELECT id, mensaje, url, fecha_creacion FROM notificaciones
-                    WHERE usuario_id = ? AND leida = 0 ORDER BY fecha_creacion DESC
-                """
-
-                # Obtener datos del usuario
-                cursor.execute(sql_user, (session['user_id'],))
-                user_data = cursor.fetchone()
-
-                if user_data:
-                    if not user_data['activo']:
+                context = user_context.load_user_context(session['user_id'])
+
+                if context is not None:
+                    if not context.user['activo']:
                         flash(
                             "Tu cuenta ha sido desactivada. Por favor, contacta a un administrador.",
                             "warning")
                         session.clear()
                         return redirect(url_for('auth.login'))
 
-                    g.user = dict(user_data)
-
-                    # Obtener roles del usuario
-                    cursor.execute(sql_roles, (g.user['id'],))
-                    roles_data = cursor.fetchall()
-                    user_roles_list = [row['nombre'] for row in roles_data]
-                    session['user_roles'] = user_roles_list
-                    g.user['roles'] = user_roles_list
-
-                    # Obtener notificaciones
-                    cursor.execute(sql_notif, (g.user['id'],))
-                    g.notifications = cursor.fetchall()
+                    # Copias: las vistas pueden modificar g.user sin alterar la caché.
+                    g.user = dict(context.user)
+                    g.user['roles'] = list(context.roles)
+                    g.user_context = context
+                    if session['user_roles'] != context.roles:
+                        session['user_roles'] = list(context.roles)
                 else:
                     session.clear()
-
-                cursor.close()
         except sqlite3.Error as e:
             if 'no such table' in str(e):
                 current_app.logger.warning(
@@ -209,7 +296,8 @@ def create_app(test_config=None):
         Inyecta variables globales en el contexto de TODAS las plantillas Jinja2.
         Esto evita tener que pasar estas variables en cada `render_template`.
         """
-        theme = session.get('theme', 'dark')
+        # Los correos se generan también fuera de una solicitud (bandeja de salida).
+        theme = session.get('theme', 'dark') if has_request_context() else 'dark'
 
         return {
             'g': g,
@@ -217,7 +305,8 @@ def create_app(test_config=None):
             'nombre_empresa': "Hepta Proyectos SAS",
             'creador': "Yimmy Moreno",
             'datetime': datetime,
-            'theme': theme
+            'theme': theme,
+            'unread_notifications': user_context.get_unread_notification_count
         }
 
     @app.template_filter('format_datetime')
@@ -254,6 +343,11 @@ def create_app(test_config=None):
     app.register_blueprint(admin.admin_bp)
     app.register_blueprint(api.api_bp)
 
+    @app.route('/health')
+    def health():
+        """Chequeo de salud para el balanceador; no toca la base de datos."""
+        return jsonify({'status': 'ok'})
+
     @app.errorhandler(403)
     def forbidden_error(error):
         return render_template('errors/403.html'), 403
@@ -285,10 +379,7 @@ def create_app(test_config=None):
 app = create_app()
 
 if __name__ == '__main__':
-    if os.environ.get(
-            'WERKZEUG_RUN_MAIN') == 'true' and app.scheduler and not app.scheduler.running:
-        app.scheduler.start()
-        app.logger.info(
-            "Scheduler de APScheduler iniciado en el proceso principal.")
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_scheduler(app)
 
     app.run(debug=True, host='0.0.0.0', port=5000)
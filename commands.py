@@ -2,6 +2,10 @@ import click
 from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash
 from db import get_db
+from services.maintenance_service import run_maintenance, convert_to_incremental_vacuum
+from services import backup_service, email_outbox_service
+from services.system_service import rebuild_connection_cycles
+from services.analytics_service import rebuild_daily_metrics
 
 
 @click.command('crear-admin')
@@ -58,3 +62,94 @@ def crear_admin_command(username, password, email, nombre_completo):
     finally:
         if cursor:
             cursor.close()
+
+
+@click.command('db-maintenance')
+@with_appcontext
+@click.option('--convert-vacuum', is_flag=True,
+              help='Activa auto_vacuum=INCREMENTAL con un VACUUM completo (bloquea las escrituras).')
+def db_maintenance_command(convert_vacuum):
+    """Ejecuta el mantenimiento de la base de datos (optimize, checkpoint, incremental_vacuum)."""
+    if convert_vacuum:
+        click.echo("Ejecutando VACUUM completo para activar auto_vacuum=INCREMENTAL...")
+        if convert_to_incremental_vacuum():
+            click.echo("auto_vacuum=INCREMENTAL activado.")
+        else:
+            click.echo("La base de datos ya usa auto_vacuum=INCREMENTAL.")
+
+    registro = run_maintenance()
+    if registro['error']:
+        click.echo(f"Mantenimiento con errores: {registro['error']}")
+    else:
+        click.echo(
+            f"Mantenimiento completado en {registro['duracion_ms']} ms. "
+            f"Tamaño: {registro['tamano_antes']} -> {registro['tamano_despues']} bytes; "
+            f"WAL: {registro['wal_antes']} -> {registro['wal_despues']} bytes.")
+
+
+@click.command('backup')
+@with_appcontext
+@click.option('--verify', 'verify_path', type=click.Path(exists=True, dir_okay=False),
+              help='Verifica una instantánea existente en lugar de crear una nueva.')
+@click.option('--no-prune', is_flag=True, help='No aplica la política de retención.')
+def backup_command(verify_path, no_prune):
+    """Crea una copia de seguridad en caliente, comprimida y verificada."""
+    if verify_path:
+        ok, error = backup_service.verify_backup(verify_path)
+        click.echo("Instantánea verificada correctamente." if ok else f"Error: {error}")
+        return
+
+    path, error = backup_service.create_backup()
+    if error:
+        click.echo(f"Error: {error}")
+        return
+    click.echo(f"Copia de seguridad creada y verificada: {path}")
+
+    if not no_prune:
+        removed = backup_service.prune_backups()
+        click.echo(f"{len(removed)} instantánea(s) antigua(s) eliminada(s).")
+
+
+@click.command('email-outbox')
+@with_appcontext
+@click.option('--max-batches', type=int, default=None,
+              help='Número máximo de lotes a enviar en esta pasada.')
+@click.option('--release-digests', is_flag=True,
+              help='Libera antes los resúmenes retenidos (para lanzarlo desde cron).')
+def email_outbox_command(max_batches, release_digests):
+    """Envía los correos pendientes de la bandeja de salida y muestra su estado."""
+    if release_digests:
+        liberados = email_outbox_service.release_digests()
+        click.echo(f"Correos de resumen liberados: {liberados}.")
+    enviados = email_outbox_service.drain_outbox(max_batches=max_batches)
+    click.echo(f"Correos enviados en esta pasada: {enviados}.")
+    stats, error = email_outbox_service.get_outbox_stats()
+    if error:
+        click.echo(f"Error: {error}")
+        return
+    for estado, total in sorted(stats['estados'].items()):
+        click.echo(f"  {estado}: {total}")
+
+
+@click.command('ciclo-conexiones')
+@with_appcontext
+def ciclo_conexiones_command():
+    """Reconstruye la tabla 'conexion_ciclo' a partir de 'historial_estados'."""
+    count, error = rebuild_connection_cycles()
+    if error:
+        click.echo(f"Error: {error}")
+        return
+    click.echo(f"Ciclo de vida reconstruido para {count} conexión(es).")
+
+
+@click.command('metricas-diarias')
+@with_appcontext
+@click.option('--dias', type=int, default=None,
+              help='Días a recalcular (0 = toda la tabla). Por defecto, METRICAS_DIARIAS_DIAS.')
+def metricas_diarias_command(dias):
+    """Recalcula la tabla 'metricas_diarias' a partir de 'historial_estados'."""
+    count, error = rebuild_daily_metrics(dias)
+    if error:
+        click.echo(f"Error: {error}")
+        return
+    click.echo(f"Métricas diarias recalculadas: {count} fila(s).")
@@ -3,6 +3,10 @@ from abc import ABC, abstractmethod
 
 class BaseDAL(ABC):
 
+    @abstractmethod
+    def transaction(self):
+        pass
+
     @abstractmethod
     def get_conexion(self, conexion_id):
         pass
@@ -71,6 +75,18 @@ class BaseDAL(ABC):
     def add_historial_estado(self, conexion_id, usuario_id, estado, detalles=None):
         pass
 
+    @abstractmethod
+    def registrar_ciclo_estado(self, conexion_id, estado, usuario_id=None):
+        pass
+
+    @abstractmethod
+    def rebuild_conexion_ciclo(self):
+        pass
+
+    @abstractmethod
+    def rebuild_metricas_diarias(self, desde):
+        pass
+
     @abstractmethod
     def create_archivo(self, conexion_id, usuario_id, tipo_archivo, filename):
         pass
@@ -96,9 +112,81 @@ class BaseDAL(ABC):
         pass
 
     @abstractmethod
-    def get_users_for_notification(self, proyecto_id, roles_to_notify):
+    def get_users_for_notification(self, proyecto_id, roles_to_notify, exclude_user_id=None):
         pass
 
     @abstractmethod
     def create_notification(self, usuario_id, mensaje, url, conexion_id):
         pass
+
+    @abstractmethod
+    def create_notifications(self, rows):
+        pass
+
+    @abstractmethod
+    def coalesce_notifications(self, usuario_ids, conexion_id, mensaje, url, window_seconds):
+        pass
+
+    @abstractmethod
+    def get_notifications_page(self, usuario_id, before_id=None, limit=20, unread_only=True):
+        pass
+
+    @abstractmethod
+    def get_unread_notification_count(self, usuario_id):
+        pass
+
+    @abstractmethod
+    def mark_notifications_read(self, usuario_id, notification_ids=None):
+        pass
+
+    @abstractmethod
+    def enqueue_emails(self, rows):
+        pass
+
+    @abstractmethod
+    def get_email_outbox_counts(self):
+        pass
+
+    @abstractmethod
+    def release_email_digests(self):
+        pass
+
+    @abstractmethod
+    def purge_sent_emails(self, keep_days):
+        pass
+
+    @abstractmethod
+    def publish_events(self, rows):
+        pass
+
+    @abstractmethod
+    def publish_connection_event(self, conexion_id, datos):
+        pass
+
+    @abstractmethod
+    def get_events_since(self, last_id, usuario_id, proyecto_ids=None, limit=100):
+        pass
+
+    @abstractmethod
+    def get_last_event_id(self):
+        pass
+
+    @abstractmethod
+    def get_user_project_ids(self, user_id):
+        pass
+
+    @abstractmethod
+    def prune_events(self, keep_seconds):
+        pass
+
+    @abstractmethod
+    def get_slow_queries(self, limit=100):
+        pass
+
+    @abstractmethod
+    def clear_slow_queries(self):
+        pass
+
+    @abstractmethod
+    def get_maintenance_runs(self, limit=10):
+        pass
@@ -1,12 +1,65 @@
-from db import get_db
+from contextlib import contextmanager
+from flask import g
+from db import get_db, get_read_db
 from .base_dal import BaseDAL
 import json
 
+# Índices FTS5 de conexiones: tabla, pesos bm25 por columna y columna de la
+# que se extrae el fragmento (-1: la que más coincide).
+SEARCH_INDEXES = {
+    # unicode61: palabras del código y de la descripción.
+    'palabras': ('conexiones_fts', '10.0, 1.0', 1),
+    # trigram: subcadenas del código, tipo, subtipo, tipología y perfiles.
+    'trigramas': ('conexiones_trigram_fts', '10.0, 1.0, 1.0, 1.0, 5.0', -1),
+}
+
 
 class SQLiteDAL(BaseDAL):
 
-    def get_conexion(self, conexion_id):
+    @contextmanager
+    def transaction(self):
+        """
+        Agrupa varias escrituras de la DAL en una unidad de trabajo.
+
+        Dentro del bloque los métodos de escritura no confirman por su cuenta;
+        el bloque más externo hace un único commit al salir (o rollback si hay
+        una excepción). Los bloques anidados usan SAVEPOINTs, de modo que un
+        error interno solo deshace su propia parte si se captura fuera de él.
+        El estado se guarda en 'g', así que es compartido por todas las
+        instancias de SQLiteDAL de la solicitud.
+        """
         db = get_db()
+        depth = g.get('dal_tx_depth', 0)
+        savepoint = f"dal_sp_{depth}"
+        if depth == 0:
+            if not db.in_transaction:
+                db.execute("BEGIN IMMEDIATE")
+        else:
+            db.execute(f"SAVEPOINT {savepoint}")
+        g.dal_tx_depth = depth + 1
+        try:
+            yield db
+        except BaseException:
+            g.dal_tx_depth = depth
+            if depth == 0:
+                db.rollback()
+            else:
+                db.execute(f"ROLLBACK TO {savepoint}")
+                db.execute(f"RELEASE {savepoint}")
+            raise
+        g.dal_tx_depth = depth
+        if depth == 0:
+            db.commit()
+        else:
+            db.execute(f"RELEASE {savepoint}")
+
+    def _commit(self, db):
+        """Confirma la escritura salvo que forme parte de una transacción de la DAL."""
+        if not g.get('dal_tx_depth'):
+            db.commit()
+
+    def get_conexion(self, conexion_id):
+        db = get_read_db()
         sql = """
             SELECT c.*, p.nombre as proyecto_nombre,
                    sol.nombre_completo as solicitante_nombre,
@@ -24,7 +77,7 @@ class SQLiteDAL(BaseDAL):
         return cursor.fetchone()
 
     def get_conexiones_by_proyecto(self, proyecto_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT * FROM conexiones WHERE proyecto_id = ? ORDER BY fecha_creacion DESC"
         cursor = db.cursor()
         cursor.execute(sql, (proyecto_id,))
@@ -48,7 +101,7 @@ class SQLiteDAL(BaseDAL):
             conexion_data['solicitante_id']
         ))
         new_id = cursor.lastrowid
-        db.commit()
+        self._commit(db)
         return new_id
 
     def update_conexion(self, conexion_id, conexion_data):
@@ -65,17 +118,17 @@ class SQLiteDAL(BaseDAL):
             json.dumps(conexion_data['detalles_json']),
             conexion_id
         ))
-        db.commit()
+        self._commit(db)
 
     def delete_conexion(self, conexion_id):
         db = get_db()
         sql = 'DELETE FROM conexiones WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id,))
-        db.commit()
+        self._commit(db)
 
     def search_conexiones(self, query):
-        db = get_db()
+        db = get_read_db()
         # Simple search for SQLite, using LIKE
         term = f"%{query}%"
         sql = """
@@ -91,29 +144,97 @@ class SQLiteDAL(BaseDAL):
         cursor.execute(sql, params)
         return cursor.fetchall()
 
-    def search_conexiones_fts(self, query):
-        db = get_db()
-        cursor = db.cursor()
+    def _search_filters(self, filtros, usuario_id=None):
+        clauses, params = [], []
+        for column in ('estado', 'tipo', 'proyecto_id'):
+            if filtros and filtros.get(column) not in (None, ''):
+                clauses.append(f"c.{column} = ?")
+                params.append(filtros[column])
+        if usuario_id is not None:
+            # Solo los proyectos del usuario; usa idx_proyecto_usuarios_usuario_id.
+            clauses.append(
+                "c.proyecto_id IN (SELECT proyecto_id FROM proyecto_usuarios WHERE usuario_id = ?)")
+            params.append(usuario_id)
+        return clauses, params
+
+    def search_conexiones_fts(self, term, limit=20, after=None, filtros=None, marcas=('[', ']'),
+                              indice='palabras', usuario_id=None):
+        """
+        Página de resultados del índice 'indice' (ver 'SEARCH_INDEXES') para
+        la expresión FTS5 'term', ordenada por relevancia (bm25, con el código
+        como columna más pesada) y por id para desempatar. 'after' es el par
+        (puntuación, id) de la última fila de la página anterior. Con
+        'usuario_id' solo se devuelven conexiones de sus proyectos. Solo se
+        calculan los fragmentos de las filas que se devuelven.
+        """
+        tabla, pesos, columna_fragmento = SEARCH_INDEXES[indice]
+        clauses, params = self._search_filters(filtros, usuario_id)
+        if after is not None:
+            clauses.append("(hits.score, hits.id) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        abre, cierra = marcas
+        sql = f"""
+            SELECT c.id, c.codigo_conexion, c.proyecto_id, c.tipo, c.subtipo, c.tipologia,
+                   c.estado, c.fecha_creacion, p.nombre as proyecto_nombre,
+                   sol.nombre_completo as solicitante_nombre, hits.score,
+                   hits.codigo_resaltado, hits.fragmento
+            FROM (
+                SELECT rowid AS id, bm25({tabla}, {pesos}) AS score,
+                       highlight({tabla}, 0, ?, ?) AS codigo_resaltado,
+                       snippet({tabla}, {columna_fragmento}, ?, ?, '…', 16) AS fragmento
+                FROM {tabla}
+                WHERE {tabla} MATCH ?
+            ) hits
+            JOIN conexiones c ON c.id = hits.id
+            JOIN proyectos p ON c.proyecto_id = p.id
+            LEFT JOIN usuarios sol ON c.solicitante_id = sol.id
+            {where}
+            ORDER BY hits.score, hits.id
+            LIMIT ?
+        """
+        cursor = get_read_db().cursor()
         try:
-            # Sanitize for FTS by escaping double quotes, then wrap in quotes for phrase search
-            # and add asterisk for prefix matching.
-            term = f'"{query.replace("\"", "\"\"")}"*'
-            sql = """
-                SELECT c.*, p.nombre as proyecto_nombre, sol.nombre_completo as solicitante_nombre
-                FROM conexiones_fts fts
-                JOIN conexiones c ON fts.rowid = c.id
-                JOIN proyectos p ON c.proyecto_id = p.id
-                LEFT JOIN usuarios sol ON c.solicitante_id = sol.id
-                WHERE fts.conexiones_fts MATCH ?
-                ORDER BY c.fecha_creacion DESC
-            """
-            cursor.execute(sql, (term,))
+            cursor.execute(sql, [abre, cierra, abre, cierra, term, *params, limit])
+            return cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def get_search_facets(self, term, filtros=None, indice='palabras', usuario_id=None):
+        """
+        Recuentos por estado, tipo y proyecto de todas las coincidencias de
+        'term', en una sola pasada por el índice FTS: las coincidencias se
+        materializan una vez y cada faceta agrupa sobre ellas.
+        """
+        tabla = SEARCH_INDEXES[indice][0]
+        clauses, params = self._search_filters(filtros, usuario_id)
+        where = f"AND {' AND '.join(clauses)}" if clauses else ""
+        sql = f"""
+            WITH hits AS MATERIALIZED (
+                SELECT c.estado, c.tipo, c.proyecto_id
+                FROM {tabla}
+                JOIN conexiones c ON c.id = {tabla}.rowid
+                WHERE {tabla} MATCH ? {where}
+            )
+            SELECT 'estado' AS faceta, estado AS valor, NULL AS nombre, COUNT(*) AS total
+            FROM hits GROUP BY estado
+            UNION ALL
+            SELECT 'tipo', tipo, NULL, COUNT(*) FROM hits GROUP BY tipo
+            UNION ALL
+            SELECT 'proyecto', hits.proyecto_id, p.nombre, COUNT(*)
+            FROM hits JOIN proyectos p ON p.id = hits.proyecto_id
+            GROUP BY hits.proyecto_id
+            ORDER BY faceta, total DESC, valor
+        """
+        cursor = get_read_db().cursor()
+        try:
+            cursor.execute(sql, [term, *params])
             return cursor.fetchall()
         finally:
             cursor.close()
 
     def get_proyectos_for_user(self, user_id, is_admin):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         if is_admin:
             cursor.execute("SELECT id, nombre FROM proyectos ORDER BY nombre")
@@ -127,55 +248,89 @@ class SQLiteDAL(BaseDAL):
         return cursor.fetchall()
 
     def get_proyecto(self, proyecto_id):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT * FROM proyectos WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (proyecto_id,))
         return cursor.fetchone()
 
     def get_alias(self, nombre_perfil):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT alias FROM alias_perfiles WHERE nombre_perfil = ?'
         cursor = db.cursor()
         cursor.execute(sql, (nombre_perfil,))
         return cursor.fetchone()
 
     def get_all_aliases(self):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             "SELECT alias, nombre_perfil FROM alias_perfiles ORDER BY nombre_perfil")
         return cursor.fetchall()
 
-    def get_all_conexiones_codes(self):
+    def get_data_version(self, tabla):
+        """Contador de escrituras de 'tabla' en 'versiones_datos' (0 si no se registra)."""
+        cursor = get_read_db().cursor()
+        cursor.execute("SELECT version FROM versiones_datos WHERE tabla = ?", (tabla,))
+        row = cursor.fetchone()
+        return row['version'] if row else 0
+
+    def get_dashboard_version(self, user_id):
+        """
+        Versión de las secciones del dashboard de 'user_id' (las comunes si es
+        None): la de 'versiones_dashboard' o 'versiones_datos', junto con la
+        época 'dashboard_epoch' que sube 'bump_dashboard_versions'.
+        """
+        if user_id is None:
+            sql = "SELECT version FROM versiones_datos WHERE tabla = 'dashboard'"
+            params = ()
+        else:
+            sql = "SELECT version FROM versiones_dashboard WHERE usuario_id = ?"
+            params = (user_id,)
+        cursor = get_read_db().cursor()
+        cursor.execute(f"""
+            SELECT COALESCE((SELECT version FROM versiones_datos WHERE tabla = 'dashboard_epoch'), 0),
+                   COALESCE(({sql}), 0)
+        """, params)
+        return tuple(cursor.fetchone())
+
+    def bump_dashboard_versions(self):
+        """Invalida las secciones del dashboard de todos los usuarios en todos los procesos."""
         db = get_db()
         cursor = db.cursor()
+        cursor.execute(
+            "UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard_epoch'")
+        self._commit(db)
+
+    def get_all_conexiones_codes(self):
+        db = get_read_db()
+        cursor = db.cursor()
         cursor.execute("SELECT codigo_conexion FROM conexiones")
         return set(row['codigo_conexion'] for row in cursor.fetchall())
 
     def get_archivos_by_conexion(self, conexion_id):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT a.*, u.nombre_completo as subido_por FROM archivos a JOIN usuarios u ON a.usuario_id = u.id WHERE a.conexion_id = ? ORDER BY a.fecha_subida DESC'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id,))
         return cursor.fetchall()
 
     def get_comentarios_by_conexion(self, conexion_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT c.*, u.nombre_completo FROM comentarios c JOIN usuarios u ON c.usuario_id = u.id WHERE c.conexion_id = ? ORDER BY c.fecha_creacion DESC"
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id,))
         return cursor.fetchall()
 
     def get_historial_by_conexion(self, conexion_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT h.*, u.nombre_completo FROM historial_estados h JOIN usuarios u ON h.usuario_id = u.id WHERE h.conexion_id = ? ORDER BY h.fecha DESC"
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id,))
         return cursor.fetchall()
 
     def get_usuario_a_asignar(self, username):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT id, nombre_completo FROM usuarios WHERE username = ? AND activo = 1'
         cursor = db.cursor()
         cursor.execute(sql, (username,))
@@ -190,31 +345,113 @@ class SQLiteDAL(BaseDAL):
         else:
             sql = 'UPDATE conexiones SET realizador_id = ?, fecha_modificacion = CURRENT_TIMESTAMP WHERE id = ?'
             cursor.execute(sql, (realizador_id, conexion_id))
-        db.commit()
+        self._commit(db)
 
     def add_historial_estado(self, conexion_id, usuario_id, estado, detalles=None):
         db = get_db()
         sql = 'INSERT INTO historial_estados (conexion_id, usuario_id, estado, detalles) VALUES (?, ?, ?, ?)'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id, usuario_id, estado, detalles))
-        db.commit()
+        self._commit(db)
+
+    # Actualización de 'conexion_ciclo' según el estado registrado en el
+    # historial. 'RECHAZADO' solo aparece en el historial: la conexión vuelve
+    # a EN_PROCESO pero se cuenta el rechazo.
+    _CICLO_UPDATES = {
+        'EN_PROCESO': """
+            UPDATE conexion_ciclo
+            SET fecha_en_proceso = COALESCE(fecha_en_proceso, CURRENT_TIMESTAMP),
+                dias_espera = COALESCE(dias_espera, julianday(CURRENT_TIMESTAMP) - julianday(fecha_solicitado)),
+                realizador_id = (SELECT realizador_id FROM conexiones WHERE id = :conexion_id)
+            WHERE conexion_id = :conexion_id
+        """,
+        'REALIZADO': """
+            UPDATE conexion_ciclo
+            SET fecha_realizado = CURRENT_TIMESTAMP,
+                dias_ejecucion = julianday(CURRENT_TIMESTAMP) - julianday(COALESCE(fecha_en_proceso, fecha_solicitado)),
+                realizador_id = (SELECT realizador_id FROM conexiones WHERE id = :conexion_id)
+            WHERE conexion_id = :conexion_id
+        """,
+        'APROBADO': """
+            UPDATE conexion_ciclo
+            SET fecha_aprobado = CURRENT_TIMESTAMP, aprobador_id = :usuario_id,
+                dias_aprobacion = julianday(CURRENT_TIMESTAMP) - julianday(fecha_realizado),
+                dias_ciclo = julianday(CURRENT_TIMESTAMP) - julianday(fecha_solicitado)
+            WHERE conexion_id = :conexion_id
+        """,
+        'RECHAZADO': """
+            UPDATE conexion_ciclo
+            SET num_rechazos = num_rechazos + 1, fecha_ultimo_rechazo = CURRENT_TIMESTAMP
+            WHERE conexion_id = :conexion_id
+        """,
+    }
+
+    def registrar_ciclo_estado(self, conexion_id, estado, usuario_id=None):
+        """
+        Actualiza la fila de 'conexion_ciclo' de la conexión tras un cambio de
+        estado. Debe llamarse junto a 'add_historial_estado', después de
+        actualizar la conexión. Crea la fila si aún no existe.
+        """
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            INSERT INTO conexion_ciclo (conexion_id, fecha_solicitado)
+            SELECT id, fecha_creacion FROM conexiones WHERE id = ?
+            ON CONFLICT (conexion_id) DO NOTHING
+        """, (conexion_id,))
+        sql = self._CICLO_UPDATES.get(estado)
+        if sql:
+            cursor.execute(sql, {'conexion_id': conexion_id, 'usuario_id': usuario_id})
+        self._commit(db)
+
+    def rebuild_conexion_ciclo(self):
+        """Reconstruye 'conexion_ciclo' a partir de 'historial_estados'. Devuelve las filas."""
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM conexion_ciclo")
+        cursor.execute("""
+            INSERT INTO conexion_ciclo (
+              conexion_id, realizador_id, aprobador_id, fecha_solicitado, fecha_en_proceso,
+              fecha_realizado, fecha_aprobado, fecha_ultimo_rechazo, num_rechazos,
+              dias_espera, dias_ejecucion, dias_aprobacion, dias_ciclo)
+            SELECT id, realizador_id, aprobador_id, fecha_solicitado, fecha_en_proceso,
+                   fecha_realizado, fecha_aprobado, fecha_ultimo_rechazo, num_rechazos,
+                   julianday(fecha_en_proceso) - julianday(fecha_solicitado),
+                   julianday(fecha_realizado) - julianday(COALESCE(fecha_en_proceso, fecha_solicitado)),
+                   julianday(fecha_aprobado) - julianday(fecha_realizado),
+                   julianday(fecha_aprobado) - julianday(fecha_solicitado)
+            FROM (
+              SELECT c.id, c.realizador_id, c.aprobador_id,
+                     COALESCE(MIN(CASE WHEN h.estado = 'SOLICITADO' THEN h.fecha END), c.fecha_creacion) AS fecha_solicitado,
+                     MIN(CASE WHEN h.estado = 'EN_PROCESO' THEN h.fecha END) AS fecha_en_proceso,
+                     MAX(CASE WHEN h.estado = 'REALIZADO' THEN h.fecha END) AS fecha_realizado,
+                     MAX(CASE WHEN h.estado = 'APROBADO' THEN h.fecha END) AS fecha_aprobado,
+                     MAX(CASE WHEN h.estado = 'RECHAZADO' THEN h.fecha END) AS fecha_ultimo_rechazo,
+                     COUNT(CASE WHEN h.estado = 'RECHAZADO' THEN 1 END) AS num_rechazos
+              FROM conexiones c LEFT JOIN historial_estados h ON h.conexion_id = c.id
+              GROUP BY c.id
+            )
+        """)
+        count = cursor.rowcount
+        self._commit(db)
+        return count
 
     def create_archivo(self, conexion_id, usuario_id, tipo_archivo, filename):
         db = get_db()
         sql = 'INSERT INTO archivos (conexion_id, usuario_id, tipo_archivo, nombre_archivo) VALUES (?, ?, ?, ?)'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id, usuario_id, tipo_archivo, filename))
-        db.commit()
+        self._commit(db)
 
     def get_archivo(self, archivo_id, conexion_id):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT * FROM archivos WHERE id = ? AND conexion_id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (archivo_id, conexion_id))
         return cursor.fetchone()
 
     def get_archivo_by_name(self, conexion_id, filename):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT id FROM archivos WHERE conexion_id = ? AND nombre_archivo = ?'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id, filename))
@@ -225,17 +462,17 @@ class SQLiteDAL(BaseDAL):
         sql = 'DELETE FROM archivos WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (archivo_id,))
-        db.commit()
+        self._commit(db)
 
     def create_comentario(self, conexion_id, usuario_id, contenido):
         db = get_db()
         sql = 'INSERT INTO comentarios (conexion_id, usuario_id, contenido) VALUES (?, ?, ?)'
         cursor = db.cursor()
         cursor.execute(sql, (conexion_id, usuario_id, contenido))
-        db.commit()
+        self._commit(db)
 
     def get_comentario(self, comentario_id, conexion_id):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT * FROM comentarios WHERE id = ? AND conexion_id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (comentario_id, conexion_id))
@@ -246,13 +483,14 @@ class SQLiteDAL(BaseDAL):
         sql = 'DELETE FROM comentarios WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (comentario_id,))
-        db.commit()
+        self._commit(db)
 
-    def get_users_for_notification(self, proyecto_id, roles_to_notify):
-        db = get_db()
+    def get_users_for_notification(self, proyecto_id, roles_to_notify, exclude_user_id=None):
+        db = get_read_db()
         placeholders = ', '.join(['?'] * len(roles_to_notify))
         sql = f"""
-            SELECT DISTINCT u.id, u.email, u.nombre_completo, COALESCE(pn.email_notif_estado, 1) as email_notif_estado
+            SELECT DISTINCT u.id, u.email, u.nombre_completo, COALESCE(pn.email_notif_estado, 1) as email_notif_estado,
+                   COALESCE(pn.email_resumen, 0) as email_resumen
             FROM usuarios u
             JOIN proyecto_usuarios pu ON u.id = pu.usuario_id
             JOIN usuario_roles ur ON u.id = ur.usuario_id
@@ -261,20 +499,193 @@ class SQLiteDAL(BaseDAL):
             WHERE pu.proyecto_id = ? AND r.nombre IN ({placeholders}) AND u.activo = 1
         """
 
-        params = [proyecto_id] + roles_to_notify
+        params = [proyecto_id] + list(roles_to_notify)
+        if exclude_user_id is not None:
+            sql += " AND u.id != ?"
+            params.append(exclude_user_id)
         cursor = db.cursor()
         cursor.execute(sql, params)
         return cursor.fetchall()
 
     def create_notification(self, usuario_id, mensaje, url, conexion_id):
+        self.create_notifications([(usuario_id, mensaje, url, conexion_id)])
+
+    def create_notifications(self, rows):
+        """Inserta varias notificaciones (usuario_id, mensaje, url, conexion_id) de una vez."""
         db = get_db()
-        sql = 'INSERT INTO notificaciones (usuario_id, mensaje, url, conexion_id) VALUES (?, ?, ?, ?)'
+        sql = """
+            INSERT INTO notificaciones (usuario_id, mensaje, url, conexion_id, fecha_actualizacion)
+            VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        """
         cursor = db.cursor()
-        cursor.execute(sql, (usuario_id, mensaje, url, conexion_id))
-        db.commit()
+        cursor.executemany(sql, rows)
+        self._commit(db)
 
-    def get_all_users_with_roles(self):
+    def coalesce_notifications(self, usuario_ids, conexion_id, mensaje, url, window_seconds):
+        """
+        Acumula el evento en la notificación no leída de la misma conexión que
+        cada usuario recibió hace menos de 'window_seconds' segundos. El
+        mensaje anterior pasa a 'detalles'. Devuelve los ids de los usuarios
+        cuya notificación se actualizó.
+        """
+        if not usuario_ids:
+            return set()
+        db = get_db()
+        placeholders = ', '.join(['?'] * len(usuario_ids))
+        sql = f"""
+            UPDATE notificaciones
+            SET detalles = json_insert(COALESCE(detalles, '[]'), '$[#]',
+                                       json_object('mensaje', mensaje,
+                                                   'fecha', COALESCE(fecha_actualizacion, fecha_creacion))),
+                mensaje = ?, url = ?, eventos = eventos + 1, fecha_actualizacion = CURRENT_TIMESTAMP
+            WHERE conexion_id = ? AND leida = 0 AND usuario_id IN ({placeholders})
+              AND fecha_creacion >= datetime('now', ?)
+            RETURNING usuario_id
+        """
+        cursor = db.cursor()
+        cursor.execute(sql, [mensaje, url, conexion_id, *usuario_ids, f"-{int(window_seconds)} seconds"])
+        updated = {row['usuario_id'] for row in cursor.fetchall()}
+        self._commit(db)
+        return updated
+
+    def get_notifications_page(self, usuario_id, before_id=None, limit=20, unread_only=True):
+        db = get_read_db()
+        sql = "SELECT id, mensaje, url, conexion_id, leida, eventos, detalles, fecha_creacion, fecha_actualizacion FROM notificaciones WHERE usuario_id = ?"
+        params = [usuario_id]
+        if unread_only:
+            sql += " AND leida = 0"
+        if before_id is not None:
+            sql += " AND id < ?"
+            params.append(before_id)
+        sql += " ORDER BY id DESC LIMIT ?"
+        params.append(limit)
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def get_unread_notification_count(self, usuario_id):
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT notificaciones_no_leidas FROM usuarios WHERE id = ?", (usuario_id,))
+        row = cursor.fetchone()
+        return row['notificaciones_no_leidas'] if row else 0
+
+    def mark_notifications_read(self, usuario_id, notification_ids=None):
+        db = get_db()
+        sql = "UPDATE notificaciones SET leida = 1 WHERE usuario_id = ? AND leida = 0"
+        params = [usuario_id]
+        if notification_ids:
+            sql += f" AND id IN ({', '.join(['?'] * len(notification_ids))})"
+            params.extend(notification_ids)
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        self._commit(db)
+        return cursor.rowcount
+
+    def enqueue_emails(self, rows):
+        """
+        Encola correos (destinatario, nombre, asunto, mensaje, url, resumen,
+        retraso) en la bandeja de salida; 'retraso' es un modificador de
+        datetime() como '+60 seconds'.
+        """
         db = get_db()
+        sql = """
+            INSERT INTO email_outbox (destinatario, nombre, asunto, mensaje, url, resumen, proximo_intento)
+            VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))
+        """
+        cursor = db.cursor()
+        cursor.executemany(sql, rows)
+        self._commit(db)
+
+    def get_email_outbox_counts(self):
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT estado, COUNT(*) AS total FROM email_outbox GROUP BY estado")
+        return {row['estado']: row['total'] for row in cursor.fetchall()}
+
+    def release_email_digests(self):
+        """Libera para su envío los correos retenidos para el resumen periódico."""
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "UPDATE email_outbox SET resumen = 0, proximo_intento = datetime('now') WHERE resumen = 1")
+        self._commit(db)
+        return cursor.rowcount
+
+    def purge_sent_emails(self, keep_days):
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "DELETE FROM email_outbox WHERE estado = 'ENVIADO' AND fecha_envio < datetime('now', ?)",
+            (f"-{int(keep_days)} days",))
+        self._commit(db)
+        return cursor.rowcount
+
+    def publish_events(self, rows):
+        """Registra eventos en tiempo real (tipo, usuario_id, proyecto_id, datos)."""
+        db = get_db()
+        sql = 'INSERT INTO eventos_tiempo_real (tipo, usuario_id, proyecto_id, datos) VALUES (?, ?, ?, ?)'
+        cursor = db.cursor()
+        cursor.executemany(sql, rows)
+        self._commit(db)
+
+    def publish_connection_event(self, conexion_id, datos):
+        """Registra un evento para los miembros del proyecto de la conexión."""
+        db = get_db()
+        sql = """
+            INSERT INTO eventos_tiempo_real (tipo, proyecto_id, datos)
+            SELECT 'conexion', proyecto_id, ? FROM conexiones WHERE id = ?
+        """
+        cursor = db.cursor()
+        cursor.execute(sql, (datos, conexion_id))
+        self._commit(db)
+
+    def get_events_since(self, last_id, usuario_id, proyecto_ids=None, limit=100):
+        """Eventos posteriores a 'last_id' visibles para el usuario (None = todos los proyectos)."""
+        db = get_read_db()
+        sql = """
+            SELECT id, tipo, usuario_id, proyecto_id, datos FROM eventos_tiempo_real
+            WHERE id > ? AND (usuario_id = ? OR (usuario_id IS NULL
+        """
+        params = [last_id, usuario_id]
+        if proyecto_ids is None:
+            sql += "))"
+        else:
+            sql += f" AND proyecto_id IN ({', '.join(['?'] * len(proyecto_ids)) or 'NULL'})))"
+            params.extend(proyecto_ids)
+        sql += " ORDER BY id LIMIT ?"
+        params.append(limit)
+        cursor = db.cursor()
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def get_last_event_id(self):
+        """Id del último evento en tiempo real confirmado (0 si no hay ninguno)."""
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM eventos_tiempo_real")
+        return cursor.fetchone()[0]
+
+    def get_user_project_ids(self, user_id):
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT proyecto_id FROM proyecto_usuarios WHERE usuario_id = ?", (user_id,))
+        return [row['proyecto_id'] for row in cursor.fetchall()]
+
+    def prune_events(self, keep_seconds):
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "DELETE FROM eventos_tiempo_real WHERE fecha < datetime('now', ?)",
+            (f"-{int(keep_seconds)} seconds",))
+        self._commit(db)
+        return cursor.rowcount
+
+    def get_all_users_with_roles(self):
+        db = get_read_db()
         sql = """
             SELECT
                 u.id, u.username, u.nombre_completo, u.email, u.activo,
@@ -290,7 +701,7 @@ class SQLiteDAL(BaseDAL):
         return cursor.fetchall()
 
     def get_roles(self):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute('SELECT nombre FROM roles ORDER BY nombre')
         return cursor.fetchall()
@@ -304,7 +715,7 @@ class SQLiteDAL(BaseDAL):
         return cursor.lastrowid
 
     def get_role_id_by_name(self, name):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT id FROM roles WHERE nombre = ?'
         cursor = db.cursor()
         cursor.execute(sql, (name,))
@@ -317,7 +728,7 @@ class SQLiteDAL(BaseDAL):
         cursor.execute(sql, (user_id, role_id))
 
     def get_user_by_id(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT * FROM usuarios WHERE id = ?"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
@@ -331,7 +742,7 @@ class SQLiteDAL(BaseDAL):
             sql, (username, nombre_completo, email, activo, user_id))
 
     def get_user_roles(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT r.nombre FROM roles r JOIN usuario_roles ur ON r.id = ur.rol_id WHERE ur.usuario_id = ?"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
@@ -348,38 +759,38 @@ class SQLiteDAL(BaseDAL):
         sql = 'UPDATE usuarios SET activo = ? WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (status, user_id))
-        db.commit()
+        self._commit(db)
 
     def is_user_admin(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT 1 FROM usuario_roles ur JOIN roles r ON ur.rol_id = r.id WHERE ur.usuario_id = ? AND r.nombre = 'ADMINISTRADOR'"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
         return cursor.fetchone() is not None
 
     def get_admin_count(self):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT COUNT(ur.usuario_id) as admin_count FROM usuario_roles ur JOIN roles r ON ur.rol_id = r.id WHERE r.nombre = 'ADMINISTRADOR'"
         cursor = db.cursor()
         cursor.execute(sql)
         return cursor.fetchone()['admin_count']
 
     def get_user_project_count(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT COUNT(proyecto_id) as count FROM proyecto_usuarios WHERE usuario_id = ?"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
         return cursor.fetchone()['count']
 
     def get_user_active_connection_count(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT COUNT(id) as count FROM conexiones WHERE realizador_id = ? AND estado IN ('EN_PROCESO', 'REALIZADO')"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
         return cursor.fetchone()['count']
 
     def get_user_solicited_connection_count(self, user_id):
-        db = get_db()
+        db = get_read_db()
         sql = "SELECT COUNT(id) as count FROM conexiones WHERE solicitante_id = ?"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
@@ -390,11 +801,11 @@ class SQLiteDAL(BaseDAL):
         sql = 'DELETE FROM usuarios WHERE id = ?'
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
-        db.commit()
+        self._commit(db)
 
     # Métodos para la autenticación y perfiles de usuario
     def get_user_by_username(self, username):
-        db = get_db()
+        db = get_read_db()
         sql = 'SELECT * FROM usuarios WHERE username = ?'
         cursor = db.cursor()
         cursor.execute(sql, (username,))
@@ -415,28 +826,28 @@ class SQLiteDAL(BaseDAL):
         # El commit se manejará en la ruta
 
     def get_notification_preferences(self, user_id):
-        db = get_db()
-        sql = "SELECT email_notif_estado FROM preferencias_notificaciones WHERE usuario_id = ?"
+        db = get_read_db()
+        sql = "SELECT email_notif_estado, email_resumen FROM preferencias_notificaciones WHERE usuario_id = ?"
         cursor = db.cursor()
         cursor.execute(sql, (user_id,))
         return cursor.fetchone()
 
-    def upsert_notification_preferences(self, user_id, email_notif_estado):
+    def upsert_notification_preferences(self, user_id, email_notif_estado, email_resumen=False):
         db = get_db()
-        sql = "INSERT INTO preferencias_notificaciones (usuario_id, email_notif_estado) VALUES (?, ?) ON CONFLICT (usuario_id) DO UPDATE SET email_notif_estado = excluded.email_notif_estado"
+        sql = "INSERT INTO preferencias_notificaciones (usuario_id, email_notif_estado, email_resumen) VALUES (?, ?, ?) ON CONFLICT (usuario_id) DO UPDATE SET email_notif_estado = excluded.email_notif_estado, email_resumen = excluded.email_resumen"
         cursor = db.cursor()
-        cursor.execute(sql, (user_id, email_notif_estado))
+        cursor.execute(sql, (user_id, email_notif_estado, email_resumen))
         # El commit se manejará en la ruta
 
     def get_all_reports(self):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             "SELECT r.*, u.nombre_completo as creador_nombre FROM reportes r JOIN usuarios u ON r.creador_id = u.id ORDER BY r.nombre")
         return cursor.fetchall()
 
     def get_report(self, reporte_id):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute('SELECT * FROM reportes WHERE id = ?', (reporte_id,))
         return cursor.fetchone()
@@ -450,7 +861,7 @@ class SQLiteDAL(BaseDAL):
              programado, frecuencia, destinatarios)
         )
         new_id = cursor.lastrowid
-        db.commit()
+        self._commit(db)
         return new_id
 
     def update_report(self, reporte_id, nombre, descripcion, filtros, programado, frecuencia, destinatarios):
@@ -461,16 +872,16 @@ class SQLiteDAL(BaseDAL):
             (nombre, descripcion, filtros, programado,
              frecuencia, destinatarios, reporte_id)
         )
-        db.commit()
+        self._commit(db)
 
     def delete_report(self, reporte_id):
         db = get_db()
         cursor = db.cursor()
         cursor.execute('DELETE FROM reportes WHERE id = ?', (reporte_id,))
-        db.commit()
+        self._commit(db)
 
     def get_report_data(self, filtros, columnas):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
 
         query_base = f"SELECT {', '.join(columnas)} FROM conexiones_view WHERE 1=1"
@@ -500,10 +911,10 @@ class SQLiteDAL(BaseDAL):
         cursor = db.cursor()
         cursor.execute(
             'UPDATE reportes SET ultima_ejecucion = CURRENT_TIMESTAMP WHERE id = ?', (reporte_id,))
-        db.commit()
+        self._commit(db)
 
     def get_alias_by_name_or_alias(self, nombre_perfil, alias):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             'SELECT id FROM alias_perfiles WHERE nombre_perfil = ? OR alias = ?', (nombre_perfil, alias))
@@ -515,7 +926,7 @@ class SQLiteDAL(BaseDAL):
         cursor.execute('INSERT INTO alias_perfiles (nombre_perfil, alias, norma) VALUES (?, ?, ?)',
                        (nombre_perfil, alias, norma))
         new_id = cursor.lastrowid
-        db.commit()
+        self._commit(db)
         return new_id
 
     def update_alias(self, alias_id, nombre_perfil, alias, norma):
@@ -523,85 +934,125 @@ class SQLiteDAL(BaseDAL):
         cursor = db.cursor()
         cursor.execute('UPDATE alias_perfiles SET nombre_perfil = ?, alias = ?, norma = ? WHERE id = ?',
                        (nombre_perfil, alias, norma, alias_id))
-        db.commit()
+        self._commit(db)
 
     def delete_alias(self, alias_id):
         db = get_db()
         cursor = db.cursor()
         cursor.execute('DELETE FROM alias_perfiles WHERE id = ?', (alias_id,))
-        db.commit()
+        self._commit(db)
 
     def get_alias_by_id(self, alias_id):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             'SELECT * FROM alias_perfiles WHERE id = ?', (alias_id,))
         return cursor.fetchone()
 
     def get_alias_by_name(self, nombre_perfil):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             'SELECT * FROM alias_perfiles WHERE nombre_perfil = ?', (nombre_perfil,))
         return cursor.fetchone()
 
-    def get_efficiency_kpis(self):
-        db = get_db()
+    def get_efficiency_kpis(self, start, end):
+        db = get_read_db()
         cursor = db.cursor()
 
+        # Un único agregado sobre la tabla de hechos del ciclo de vida. El
+        # tiempo medio y las aprobadas se limitan al rango; la tasa de
+        # rechazo es histórica.
         cursor.execute("""
-            SELECT AVG(julianday(h2.fecha) - julianday(h1.fecha)) as avg_days
-            FROM historial_estados h1
-            JOIN historial_estados h2 ON h1.conexion_id = h2.conexion_id
-            WHERE h1.estado = 'SOLICITADO' AND h2.estado = 'APROBADO'
-        """)
-        avg_time_query = cursor.fetchone()
-        avg_approval_time = avg_time_query['avg_days'] if avg_time_query and avg_time_query['avg_days'] is not None else 0
-
-        cursor.execute(
-            "SELECT COUNT(id) as total FROM conexiones WHERE fecha_modificacion >= date('now', '-30 days') AND estado = 'APROBADO'")
-        processed_last_30d_row = cursor.fetchone()
-        processed_last_30d = processed_last_30d_row['total'] if processed_last_30d_row else 0
-
-        cursor.execute(
-            "SELECT COUNT(id) as total FROM conexiones WHERE estado = 'APROBADO'")
-        total_approved_row = cursor.fetchone()
-        total_approved = total_approved_row['total'] if total_approved_row else 0
-
-        cursor.execute(
-            "SELECT COUNT(DISTINCT conexion_id) as total FROM historial_estados WHERE estado = 'RECHAZADO'")
-        total_rejected_history_row = cursor.fetchone()
-        total_rejected_history = total_rejected_history_row[
-            'total'] if total_rejected_history_row else 0
+            SELECT AVG(CASE WHEN fecha_aprobado >= :start AND fecha_aprobado < date(:end, '+1 day') THEN dias_ciclo END) AS avg_days,
+                   COUNT(fecha_aprobado) AS total_approved,
+                   COUNT(CASE WHEN fecha_aprobado >= :start AND fecha_aprobado < date(:end, '+1 day') THEN 1 END) AS processed_in_range,
+                   COUNT(CASE WHEN num_rechazos > 0 THEN 1 END) AS total_rejected
+            FROM conexion_ciclo
+        """, {'start': start, 'end': end})
+        row = cursor.fetchone()
+        avg_approval_time = row['avg_days'] if row['avg_days'] is not None else 0
+        processed_in_range = row['processed_in_range']
+        total_approved = row['total_approved']
+        total_rejected_history = row['total_rejected']
 
         rejection_rate = (total_rejected_history / (total_approved + total_rejected_history)
                           * 100) if (total_approved + total_rejected_history) > 0 else 0
 
         return {
-            'avg_approval_time': f"{avg_approval_time:.1f} días" if isinstance(avg_approval_time, (int, float)) else 'N/A',
-            'processed_in_range': processed_last_30d,
+            'avg_approval_time': f"{avg_approval_time:.1f} días" if avg_approval_time else 'N/A',
+            'processed_in_range': processed_in_range,
             'rejection_rate': f"{rejection_rate:.1f}%"
         }
 
-    def get_time_by_state(self):
-        # This is a placeholder. A real implementation would query the database.
-        return {'Solicitado': 8.5, 'En Proceso': 48.2, 'Realizado': 24.0}
+    def get_time_by_state(self, start, end):
+        """
+        Devuelve los intervalos cerrados entre dos cambios de estado que
+        terminaron en el rango [start, end] (fechas 'YYYY-MM-DD', ambas
+        incluidas): estado, proyecto, usuario que cerró el intervalo y
+        duración en horas. Un 'RECHAZADO' del historial devuelve la conexión a
+        EN_PROCESO, así que el tiempo posterior cuenta como EN_PROCESO.
+        """
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute("""
+            WITH intervalos AS (
+                SELECT h.conexion_id,
+                       CASE h.estado WHEN 'RECHAZADO' THEN 'EN_PROCESO' ELSE h.estado END AS estado,
+                       h.fecha AS inicio,
+                       LEAD(h.fecha) OVER w AS fin,
+                       LEAD(h.usuario_id) OVER w AS usuario_id
+                FROM historial_estados h
+                WHERE h.conexion_id IN (
+                    SELECT conexion_id FROM historial_estados
+                    WHERE fecha >= :start AND fecha < date(:end, '+1 day'))
+                WINDOW w AS (PARTITION BY h.conexion_id ORDER BY h.fecha, h.id)
+            )
+            SELECT i.estado, c.proyecto_id, p.nombre AS proyecto_nombre,
+                   i.usuario_id, u.nombre_completo AS usuario_nombre,
+                   (julianday(i.fin) - julianday(i.inicio)) * 24 AS horas
+            FROM intervalos i
+            JOIN conexiones c ON c.id = i.conexion_id
+            JOIN proyectos p ON p.id = c.proyecto_id
+            LEFT JOIN usuarios u ON u.id = i.usuario_id
+            WHERE i.fin >= :start AND i.fin < date(:end, '+1 day')
+        """, {'start': start, 'end': end})
+        return cursor.fetchall()
 
-    def get_completed_by_user(self):
-        db = get_db()
+    def get_completed_by_user(self, start, end):
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute("""
-            SELECT u.nombre_completo, COUNT(c.id) as total
-            FROM conexiones c JOIN usuarios u ON c.realizador_id = u.id
-            WHERE c.estado = 'APROBADO' AND c.fecha_modificacion >= date('now', '-30 days')
+            SELECT u.nombre_completo, SUM(m.total) as total
+            FROM metricas_diarias m JOIN usuarios u ON m.usuario_id = u.id
+            WHERE m.estado = 'REALIZADO' AND m.dia BETWEEN ? AND ?
             GROUP BY u.id
             ORDER BY total DESC
-        """)
+        """, (start, end))
         return cursor.fetchall()
 
-    def get_slow_connections(self):
+    def rebuild_metricas_diarias(self, desde):
+        """
+        Recalcula 'metricas_diarias' desde el día 'desde' ('YYYY-MM-DD')
+        a partir de 'historial_estados'. Devuelve las filas generadas.
+        """
         db = get_db()
         cursor = db.cursor()
+        cursor.execute("DELETE FROM metricas_diarias WHERE dia >= ?", (desde,))
+        cursor.execute("""
+            INSERT INTO metricas_diarias (dia, proyecto_id, usuario_id, estado, total)
+            SELECT date(h.fecha), c.proyecto_id, COALESCE(h.usuario_id, 0), h.estado, COUNT(*)
+            FROM historial_estados h JOIN conexiones c ON c.id = h.conexion_id
+            WHERE h.fecha >= ?
+            GROUP BY 1, 2, 3, 4
+        """, (desde,))
+        count = cursor.rowcount
+        self._commit(db)
+        return count
+
+    def get_slow_connections(self):
+        db = get_read_db()
+        cursor = db.cursor()
         cursor.execute("""
             SELECT c.id, c.codigo_conexion, p.nombre as proyecto_nombre,
                    u.nombre_completo as realizador_nombre,
@@ -616,7 +1067,7 @@ class SQLiteDAL(BaseDAL):
         return cursor.fetchall()
 
     def get_audit_logs(self, offset, per_page, filtro_usuario_id=None, filtro_accion=None):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
 
         query = "SELECT a.*, u.nombre_completo as usuario_nombre FROM auditoria_acciones a JOIN usuarios u ON a.usuario_id = u.id WHERE 1=1"
@@ -646,14 +1097,14 @@ class SQLiteDAL(BaseDAL):
         return acciones, total_acciones
 
     def get_distinct_audit_actions(self):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             'SELECT DISTINCT accion FROM auditoria_acciones ORDER BY accion')
         return cursor.fetchall()
 
     def get_all_config(self):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute("SELECT clave, valor FROM configuracion")
         return {row['clave']: row['valor'] for row in cursor.fetchall()}
@@ -663,17 +1114,17 @@ class SQLiteDAL(BaseDAL):
         cursor = db.cursor()
         cursor.execute(
             "INSERT INTO configuracion (clave, valor) VALUES (?, ?) ON CONFLICT (clave) DO UPDATE SET valor = excluded.valor", (key, value))
-        db.commit()
+        self._commit(db)
 
     def user_has_access_to_project(self, user_id, proyecto_id):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             "SELECT 1 FROM proyecto_usuarios WHERE proyecto_id = ? AND usuario_id = ?", (proyecto_id, user_id))
         return cursor.fetchone() is not None
 
     def get_users_for_project(self, proyecto_id):
-        db = get_db()
+        db = get_read_db()
         cursor = db.cursor()
         cursor.execute(
             "SELECT usuario_id FROM proyecto_usuarios WHERE proyecto_id = ?", (proyecto_id,))
@@ -687,4 +1138,24 @@ class SQLiteDAL(BaseDAL):
         for user_id in user_ids:
             cursor.execute(
                 "INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)", (proyecto_id, int(user_id)))
-        db.commit()
+        self._commit(db)
+
+    def get_slow_queries(self, limit=100):
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT * FROM consultas_lentas ORDER BY id DESC LIMIT ?", (limit,))
+        return cursor.fetchall()
+
+    def clear_slow_queries(self):
+        db = get_db()
+        cursor = db.cursor()
+        cursor.execute("DELETE FROM consultas_lentas")
+        self._commit(db)
+
+    def get_maintenance_runs(self, limit=10):
+        db = get_read_db()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT * FROM mantenimiento_bd ORDER BY id DESC LIMIT ?", (limit,))
+        return cursor.fetchall()
@@ -1,12 +1,19 @@
 import sqlite3
 import click
-from flask import current_app, g
+from flask import current_app, g, request, has_request_context
 from flask.cli import with_appcontext
 from werkzeug.security import generate_password_hash
+from migrations import MigrationRunner, upgrade_database
 import os
+import atexit
 import datetime
+import threading
 import secrets
 import string
+import time
+import json
+import heapq
+import re
 
 
 def adapt_datetime_iso(val):
@@ -24,35 +31,520 @@ sqlite3.register_adapter(datetime.datetime, adapt_datetime_iso)
 sqlite3.register_converter("timestamp", convert_timestamp)
 
 
-def get_db():
+# Perfil de PRAGMAs aplicado una sola vez a cada conexión nueva. Puede
+# sobrescribirse (total o parcialmente) con la clave de configuración
+# 'SQLITE_PRAGMAS'; un valor None desactiva el PRAGMA correspondiente.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -20000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+# PRAGMAs que solo tienen sentido (o solo se permiten) en la conexión de
+# lectura-escritura; se omiten en la conexión de solo lectura.
+READ_WRITE_ONLY_PRAGMAS = {'journal_mode', 'synchronous'}
+
+
+def parse_database_url(database_url):
     """
-    Obtiene una conexión a la base de datos SQLite para la solicitud actual.
-    Crea la conexión si no existe y la almacena en 'g'.
+    Convierte una URL de SQLAlchemy ('sqlite:///ruta') en la ruta del archivo
+    que espera sqlite3. 'sqlite:////abs/db.sqlite' produce una ruta absoluta y
+    'sqlite:///rel/db.sqlite' una relativa, igual que en SQLAlchemy.
     """
-    if 'db' not in g:
-        db_path = current_app.config['DATABASE_URL']
-        # Asegurarse de que el directorio de la base de datos exista
-        db_dir = os.path.dirname(db_path)
-        if db_dir:
+    prefix = 'sqlite:///'
+    if not database_url or not database_url.startswith(prefix):
+        raise ValueError(
+            f"URL de base de datos SQLite no válida: '{database_url}'.")
+    path = database_url[len(prefix):].split('?', 1)[0]
+    return path or ':memory:'
+
+
+class SQLiteConnectionManager:
+    """
+    Gestiona una conexión SQLite persistente por hilo de trabajo.
+
+    Cada hilo (de gunicorn, waitress o del scheduler) reutiliza su propia
+    conexión entre solicitudes, de modo que el coste de abrirla y de aplicar
+    el perfil de PRAGMAs se paga una sola vez. Las conexiones creadas antes
+    de un fork se descartan en el proceso hijo.
+    """
+
+    def __init__(self, database_url, pragmas=None, profiling=False):
+        self.path = parse_database_url(database_url)
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+        self.factory = ProfilingConnection if profiling else sqlite3.Connection
+        self.slow_log = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+        db_dir = os.path.dirname(self.path)
+        if db_dir and self.path != ':memory:':
             os.makedirs(db_dir, exist_ok=True)
 
-        g.db = sqlite3.connect(
-            db_path,
-            detect_types=sqlite3.PARSE_DECLTYPES
-        )
-        g.db.row_factory = sqlite3.Row
+    def set_slow_log(self, slow_log):
+        """Activa el registro de consultas lentas en las conexiones nuevas."""
+        self.slow_log = slow_log
+        self.factory = ProfilingConnection
+
+    def _connect(self, readonly=False, instrumented=True):
+        factory = self.factory if instrumented else sqlite3.Connection
+        if readonly:
+            conn = sqlite3.connect(
+                f"file:{self.path}?mode=ro",
+                uri=True,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False,
+                factory=factory
+            )
+        else:
+            conn = sqlite3.connect(
+                self.path,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                check_same_thread=False,
+                factory=factory
+            )
+        conn.row_factory = sqlite3.Row
+        if isinstance(conn, ProfilingConnection):
+            conn.slow_log = self.slow_log
+        self._apply_pragmas(conn, readonly)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _apply_pragmas(self, conn, readonly=False):
+        # Se usa el 'execute' base para que la instrumentación SQL no cuente
+        # la preparación de la conexión como consultas de la solicitud.
+        execute = sqlite3.Connection.execute
+        for name, value in self.pragmas.items():
+            if value is None or (readonly and name in READ_WRITE_ONLY_PRAGMAS):
+                continue
+            execute(conn, f"PRAGMA {name} = {value}").fetchall()
+        if readonly:
+            execute(conn, "PRAGMA query_only = ON")
+
+    def _acquire(self, slot, readonly):
+        pid = os.getpid()
+        conn = getattr(self._local, slot, None)
+        if conn is None or getattr(self._local, f'{slot}_pid', None) != pid:
+            conn = self._connect(readonly)
+            setattr(self._local, slot, conn)
+            setattr(self._local, f'{slot}_pid', pid)
+        return conn
+
+    def acquire(self):
+        """Devuelve la conexión del hilo actual, creándola si es necesario."""
+        return self._acquire('conn', readonly=False)
+
+    def acquire_readonly(self):
+        """
+        Devuelve la conexión de solo lectura del hilo actual. Con WAL, las
+        lecturas largas en esta conexión no bloquean ni esperan a los escritores.
+        Las bases de datos en memoria no admiten una segunda conexión, por lo
+        que en ese caso se devuelve la conexión de lectura-escritura.
+        """
+        if self.path == ':memory:':
+            return self.acquire()
+        return self._acquire('read_conn', readonly=True)
+
+    def release(self, conn):
+        """
+        Devuelve la conexión al gestor al terminar la solicitud. Cualquier
+        transacción pendiente se revierte, igual que ocurría al cerrarla.
+        """
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        for slot in ('conn', 'read_conn'):
+            if getattr(self._local, slot, None) is conn:
+                setattr(self._local, slot, None)
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Cierra todas las conexiones abiertas por el gestor (apagado o pruebas)."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+# --- Instrumentación de SQL por solicitud ---
+#
+# Con 'SQL_PROFILING' activado, las conexiones se crean con ProfilingConnection
+# y cada sentencia ejecutada durante una solicitud se registra (SQL, duración y
+# filas) en el RequestProfile guardado en 'g'. Al terminar la solicitud se
+# emite una cabecera 'Server-Timing', una línea de log en JSON y el resumen se
+# conserva entre las solicitudes más lentas para la página de administración.
+#
+# Con 'SLOW_QUERY_MS' configurado, las sentencias que superan ese umbral (en
+# cualquier hilo, no solo en solicitudes) se envían al SlowQueryLog junto con
+# la salida de EXPLAIN QUERY PLAN.
+
+
+def normalize_sql(sql):
+    """Colapsa los espacios de una sentencia para poder agrupar repeticiones."""
+    return ' '.join(sql.split())
+
+
+def new_statement_entry(sql, parameters, duration, rows=0):
+    return {'sql': sql, 'params': parameters, 'duration': duration,
+            'rows': rows, 'slow': False}
+
+
+def parameter_shape(parameters):
+    """
+    Describe los parámetros enlazados por su tipo y no por su valor, para no
+    guardar datos de usuarios en el registro de consultas lentas.
+    """
+    if parameters is None:
+        return None
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f"{key}: {type(value).__name__}"
+                               for key, value in parameters.items()) + '}'
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
+EXPLAINABLE_SQL = re.compile(
+    r'^\s*(SELECT|WITH|INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+
+
+def explain_query_plan(conn, sql, parameters=()):
+    """
+    Ejecuta EXPLAIN QUERY PLAN sobre la sentencia y devuelve sus pasos como
+    líneas indentadas según el árbol del plan. Devuelve None si la sentencia
+    no admite EXPLAIN (scripts, PRAGMAs, DDL).
+    """
+    if not EXPLAINABLE_SQL.match(sql):
+        return None
+    try:
+        # 'execute' base: el plan no debe medirse ni capturarse a sí mismo.
+        rows = sqlite3.Connection.execute(
+            conn, f"EXPLAIN QUERY PLAN {sql}", parameters or ()).fetchall()
+    except (sqlite3.Error, ValueError):
+        return None
+
+    levels = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        level = levels.get(parent_id, -1) + 1
+        levels[node_id] = level
+        lines.append('  ' * level + detail)
+    return lines
+
+
+def is_full_scan(plan_line):
+    """Un 'SCAN tabla' sin índice recorre la tabla completa."""
+    detail = plan_line.strip()
+    return (detail.startswith('SCAN ') and 'USING' not in detail
+            and 'VIRTUAL TABLE' not in detail and detail != 'SCAN CONSTANT ROW'
+            and not detail.startswith('SCAN ('))
+
+
+def _current_profile():
+    if not has_request_context():
+        return None
+    return g.get('sql_profile')
+
+
+class ProfilingCursor(sqlite3.Cursor):
+    """Cursor que mide el tiempo de ejecución y de lectura de cada sentencia."""
+
+    _entry = None
+
+    def _timed(self, method, *args, statement=None):
+        profile = _current_profile()
+        slow_log = self.connection.slow_log
+        if profile is None and slow_log is None:
+            return method(*args)
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            if statement is not None:
+                sql, parameters = statement
+                self._entry = new_statement_entry(
+                    sql, parameters, elapsed, max(self.rowcount, 0))
+                if profile is not None:
+                    profile.add(self._entry)
+                self._check_slow()
+            elif self._entry is not None:
+                self._entry['duration'] += elapsed
+
+    def _check_slow(self):
+        # Una sentencia se captura una sola vez, en cuanto su tiempo acumulado
+        # (ejecución más lectura de filas) supera el umbral.
+        slow_log = self.connection.slow_log
+        entry = self._entry
+        if slow_log is None or entry is None or entry['slow']:
+            return
+        if entry['duration'] * 1000 >= slow_log.threshold_ms:
+            entry['slow'] = True
+            slow_log.capture(self.connection, entry)
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters,
+                           statement=(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters,
+                           statement=(sql, None))
+
+    def executescript(self, sql_script):
+        return self._timed(super().executescript, sql_script,
+                           statement=(sql_script, None))
+
+    def _count(self, rows):
+        if self._entry is not None:
+            self._entry['rows'] += rows
+            self._check_slow()
+
+    def fetchone(self):
+        row = self._timed(super().fetchone)
+        self._count(1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(super().fetchmany, size or self.arraysize)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = self._timed(super().__next__)
+        self._count(1)
+        return row
+
+
+class ProfilingConnection(sqlite3.Connection):
+    """
+    Conexión cuyos cursores (incluidos los atajos 'execute' de la conexión)
+    son ProfilingCursor. Los COMMIT explícitos también se registran.
+    """
+
+    slow_log = None
+
+    def cursor(self, factory=ProfilingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return self.cursor().executescript(sql_script)
+
+    def commit(self):
+        profile = _current_profile()
+        if profile is None or not self.in_transaction:
+            return super().commit()
+        start = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            profile.add(new_statement_entry(
+                'COMMIT', None, time.perf_counter() - start))
+
+
+class RequestProfile:
+    """Sentencias ejecutadas durante una solicitud y su resumen."""
+
+    def __init__(self, method, path, n_plus_one_threshold=5):
+        self.method = method
+        self.path = path
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.started_at = datetime.datetime.now()
+        self._start = time.perf_counter()
+        self.queries = []
+
+    def add(self, entry):
+        self.queries.append(entry)
+
+    def summary(self, endpoint=None, status=None):
+        total = time.perf_counter() - self._start
+        grouped = {}
+        for q in self.queries:
+            key = normalize_sql(q['sql'])
+            item = grouped.setdefault(
+                key, {'sql': key, 'count': 0, 'ms': 0.0, 'rows': 0})
+            item['count'] += 1
+            item['ms'] += q['duration'] * 1000
+            item['rows'] += q['rows']
+
+        statements = sorted(
+            grouped.values(), key=lambda item: item['ms'], reverse=True)
+        for item in statements:
+            item['ms'] = round(item['ms'], 2)
+
+        return {
+            'fecha': self.started_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': self.method,
+            'path': self.path,
+            'endpoint': endpoint,
+            'status': status,
+            'total_ms': round(total * 1000, 2),
+            'db_ms': round(sum(q['duration'] for q in self.queries) * 1000, 2),
+            'queries': len(self.queries),
+            'rows': sum(q['rows'] for q in self.queries),
+            'n_plus_one': [item for item in statements
+                           if item['count'] >= self.n_plus_one_threshold
+                           and item['sql'] != 'COMMIT'],
+            'top': statements[:10],
+        }
+
+
+class SQLProfiler:
+    """Conserva en memoria los resúmenes de las solicitudes más lentas del proceso."""
+
+    def __init__(self, keep=50, n_plus_one_threshold=5):
+        self.keep = keep
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def start(self, method, path):
+        return RequestProfile(method, path, self.n_plus_one_threshold)
+
+    def add(self, summary):
+        with self._lock:
+            self._counter += 1
+            item = (summary['total_ms'], self._counter, summary)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, item)
+            elif item[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, item)
+
+    def slowest(self):
+        with self._lock:
+            return [item[2] for item in sorted(self._heap, reverse=True)]
+
+    def clear(self):
+        with self._lock:
+            self._heap = []
+
+
+def start_sql_profile():
+    """Inicia el registro de sentencias de la solicitud (before_request)."""
+    if request.endpoint == 'static':
+        return
+    g.sql_profile = current_app.extensions['sql_profiler'].start(
+        request.method, request.path)
+
+
+def finish_sql_profile(response):
+    """
+    Cierra el registro de la solicitud (after_request): añade la cabecera
+    'Server-Timing', escribe una línea de log estructurada y guarda el resumen.
+    """
+    profile = g.pop('sql_profile', None)
+    if profile is None:
+        return response
+
+    summary = profile.summary(request.endpoint, response.status_code)
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={summary["db_ms"]};desc="{summary["queries"]} consultas", '
+        f'app;dur={summary["total_ms"]}')
+
+    log_line = {key: summary[key] for key in (
+        'method', 'path', 'endpoint', 'status', 'total_ms', 'db_ms', 'queries', 'rows')}
+    log_line['n_plus_one'] = [
+        {'sql': item['sql'][:200], 'count': item['count']} for item in summary['n_plus_one']]
+    if summary['n_plus_one']:
+        current_app.logger.warning(
+            f"sql_profile {json.dumps(log_line, ensure_ascii=False)}")
+    else:
+        current_app.logger.info(
+            f"sql_profile {json.dumps(log_line, ensure_ascii=False)}")
+
+    current_app.extensions['sql_profiler'].add(summary)
+    return response
+
+
+def get_db():
+    """
+    Obtiene la conexión SQLite del hilo actual para la solicitud en curso.
+    La conexión la proporciona el gestor de la aplicación y se guarda en 'g'.
+    """
+    if 'db' not in g:
+        g.db = current_app.extensions['sqlite'].acquire()
 
     return g.db
 
 
+def get_read_db():
+    """
+    Obtiene una conexión para consultas de solo lectura.
+
+    En solicitudes GET/HEAD y fuera de una solicitud (tareas programadas,
+    comandos CLI) se usa la conexión de solo lectura ('mode=ro' y
+    'PRAGMA query_only'), de modo que los listados, el dashboard y los reportes
+    no compiten con las transiciones de estado. Si la conexión de escritura
+    tiene una transacción abierta se reutiliza esta última para que la lectura
+    vea los cambios aún no confirmados de la propia solicitud.
+    """
+    if not current_app.config.get('DATABASE_READONLY_LANE', True):
+        return get_db()
+
+    writer = g.get('db')
+    if writer is not None and writer.in_transaction:
+        return writer
+    if has_request_context() and request.method not in ('GET', 'HEAD'):
+        return get_db()
+
+    if 'read_db' not in g:
+        try:
+            g.read_db = current_app.extensions['sqlite'].acquire_readonly()
+        except sqlite3.Error as e:
+            current_app.logger.warning(
+                f"No se pudo abrir la conexión de solo lectura, se usará la de escritura: {e}")
+            return get_db()
+
+    return g.read_db
+
+
 def close_db(e=None):
     """
-    Cierra la conexión de la base de datos.
+    Devuelve las conexiones de la solicitud al gestor en lugar de cerrarlas.
     """
-    db = g.pop('db', None)
+    manager = current_app.extensions['sqlite']
+    for key in ('db', 'read_db'):
+        db = g.pop(key, None)
+        if db is not None:
+            manager.release(db)
+
 
-    if db is not None:
-        db.close()
+def close_all_connections(app):
+    """Cierra todas las conexiones persistentes de la aplicación."""
+    manager = app.extensions.get('sqlite')
+    if manager is not None:
+        manager.close_all()
 
 
 def init_db():
@@ -61,6 +553,12 @@ def init_db():
     """
     db = get_db()
 
+    # En una base vacía se activa auto_vacuum=INCREMENTAL antes de crear las
+    # tablas, para que el mantenimiento pueda liberar espacio por partes.
+    if db.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("VACUUM")
+
     with current_app.open_resource('schema.sql') as f:
         # SQLite3's `executescript` puede manejar múltiples sentencias
         db.executescript(f.read().decode('utf8'))
@@ -121,6 +619,10 @@ def init_db():
         # 5. Guardar los cambios
         db.commit()
 
+    # Llevar el esquema base a la última versión. En una base nueva las tablas
+    # están vacías, así que los índices se crean en el momento y sin pausas.
+    upgrade_database(current_app, online='inline', pause=0)
+
 
 @click.command('init-db')
 @with_appcontext
@@ -130,30 +632,307 @@ def init_db_command():
     click.echo('Base de datos SQLite inicializada.')
 
 
+@click.command('db-upgrade')
+@click.option('--dry-run', is_flag=True, help='Muestra las migraciones pendientes sin aplicarlas.')
+@click.option('--skip-online', is_flag=True, help='No construye ahora los índices en línea pendientes.')
+@click.option('--pause', default=0.5, show_default=True, help='Segundos de pausa entre índices en línea.')
+@with_appcontext
+def db_upgrade_command(dry_run, skip_online, pause):
+    """Aplica las migraciones pendientes del esquema ('flask db-upgrade')."""
+    manager = current_app.extensions['sqlite']
+    conn = manager._connect(instrumented=False)
+    try:
+        runner = MigrationRunner(conn)
+        click.echo(
+            f"Versión actual del esquema: {runner.current_version()} (última: {runner.head()}).")
+        for migration in runner.pending():
+            click.echo(f"  Pendiente: {migration.filename}")
+            if dry_run:
+                for stmt in migration.statements:
+                    click.echo(f"    {' '.join(stmt.split())[:120]}")
+                for stmt in migration.online_statements:
+                    click.echo(f"    [en línea] {' '.join(stmt.split())[:120]}")
+        for row in runner.pending_online():
+            click.echo(f"  Índice en línea pendiente: {row['sentencia']}")
+    finally:
+        manager._discard(conn)
+
+    if dry_run:
+        click.echo('Modo de prueba: no se aplicó ningún cambio.')
+        return
+
+    applied = upgrade_database(
+        current_app, online='skip' if skip_online else 'inline', pause=pause)
+    click.echo(f"{len(applied)} migración(es) aplicada(s).")
+
+
 def init_app(app):
     """
     Registra las funciones de la base de datos con la instancia de la aplicación Flask.
     """
+    profiling = app.config.get('SQL_PROFILING', False)
+    manager = SQLiteConnectionManager(
+        app.config['DATABASE_URL'], app.config.get('SQLITE_PRAGMAS'), profiling)
+    app.extensions['sqlite'] = manager
+    if profiling:
+        app.extensions['sql_profiler'] = SQLProfiler(
+            keep=app.config.get('SQL_PROFILING_KEEP', 50),
+            n_plus_one_threshold=app.config.get('SQL_PROFILING_N_PLUS_ONE', 5))
+        app.before_request(start_sql_profile)
+        app.after_request(finish_sql_profile)
+    app.extensions['audit'] = AuditSink(
+        manager,
+        app.logger,
+        batch_size=app.config.get('AUDIT_BATCH_SIZE', 100),
+        flush_interval=app.config.get('AUDIT_FLUSH_INTERVAL', 2.0),
+        synchronous=app.config.get('AUDIT_SYNC', app.testing)
+    )
+    # atexit y teardown_appcontext ejecutan en orden inverso al de registro:
+    # primero se devuelven las conexiones de la solicitud (revirtiendo una
+    # transacción abandonada que bloquearía la escritura), después se vacían
+    # los búferes y al apagar se cierran las conexiones.
+    atexit.register(close_all_connections, app)
+    atexit.register(app.extensions['audit'].flush)
+    app.teardown_appcontext(flush_audit)
+
+    slow_query_ms = app.config.get('SLOW_QUERY_MS')
+    if slow_query_ms:
+        slow_log = SlowQueryLog(
+            manager,
+            app.logger,
+            threshold_ms=float(slow_query_ms),
+            keep=app.config.get('SLOW_QUERY_KEEP', 500)
+        )
+        manager.set_slow_log(slow_log)
+        app.extensions['slow_queries'] = slow_log
+        atexit.register(slow_log.flush)
+        app.teardown_appcontext(flush_slow_queries)
+
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(db_upgrade_command)
 
 
-def log_action(accion, usuario_id, tipo_objeto, objeto_id, detalles=None):
+class AuditSink:
     """
-    Registra una acción de auditoría en la base de datos.
+    Acumula eventos de auditoría en memoria y los escribe por lotes.
+
+    Cada lote se inserta con 'executemany' dentro de una única transacción en
+    una conexión dedicada, de modo que una transición de estado con varias
+    acciones auditadas cuesta un solo commit. El búfer se vacía al terminar la
+    solicitud, al alcanzar 'batch_size' eventos o tras 'flush_interval'
+    segundos, y también al apagar el proceso. En modo síncrono (pruebas) cada
+    evento se escribe en el momento.
+
+    Si quien registra la acción tiene abierta una transacción de escritura,
+    la conexión dedicada esperaría a que la suelte; en ese caso el evento se
+    inserta en la propia transacción ('record_in'), que lo confirma o lo
+    revierte junto con el cambio auditado. Tras un lote fallido no se vuelve
+    a intentar el vaciado hasta pasados 'flush_interval' segundos, aunque el
+    búfer siga lleno.
     """
-    db = get_db()
-    sql = """
-        INSERT INTO auditoria_acciones (usuario_id, accion, tipo_objeto, objeto_id, detalles)
-        VALUES (?, ?, ?, ?, ?)
+
+    SQL = """
+        INSERT INTO auditoria_acciones (usuario_id, accion, tipo_objeto, objeto_id, detalles, fecha)
+        VALUES (?, ?, ?, ?, ?, ?)
     """
-    params = (usuario_id, accion, tipo_objeto, objeto_id, detalles)
 
+    def __init__(self, manager, logger, batch_size=100, flush_interval=2.0, synchronous=False):
+        self.manager = manager
+        self.logger = logger
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.synchronous = synchronous
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._conn = None
+        self._retry_at = 0.0
+
+    @staticmethod
+    def _event(accion, usuario_id, tipo_objeto, objeto_id, detalles):
+        # La fecha se fija al encolar para no depender del momento del vaciado.
+        fecha = datetime.datetime.now(
+            datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        return (usuario_id, accion, tipo_objeto, objeto_id, detalles, fecha)
+
+    def record(self, accion, usuario_id, tipo_objeto, objeto_id, detalles=None):
+        self._enqueue(self._event(accion, usuario_id, tipo_objeto, objeto_id, detalles))
+
+    def record_in(self, conn, accion, usuario_id, tipo_objeto, objeto_id, detalles=None):
+        """Inserta el evento en la transacción abierta de 'conn', sin confirmarla."""
+        event = self._event(accion, usuario_id, tipo_objeto, objeto_id, detalles)
+        try:
+            conn.execute(self.SQL, event)
+        except sqlite3.Error as e:
+            # El fallo de la sentencia no anula la transacción de quien llama.
+            self.logger.error(
+                f"Error al registrar acción de auditoría: {accion} por {usuario_id} - {e}")
+
+    def _enqueue(self, event):
+        if self.synchronous:
+            with self._flush_lock:
+                self._write([event])
+            return
+
+        with self._lock:
+            self._buffer.append(event)
+            full = (len(self._buffer) >= self.batch_size
+                    and time.monotonic() >= self._retry_at)
+            if not full and self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def pending(self):
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self):
+        """Escribe todos los eventos pendientes. Es seguro llamarlo desde cualquier hilo."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._buffer = self._buffer, []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if batch:
+                self._write(batch)
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = self.manager._connect(instrumented=False)
+        return self._conn
+
+    def _write(self, batch):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(self.SQL, batch)
+        except sqlite3.IntegrityError:
+            # Un solo evento inválido (p. ej. un usuario ya eliminado) no debe
+            # hacer perder el lote completo: se reintenta fila por fila.
+            self._write_one_by_one(batch)
+        except sqlite3.Error as e:
+            self.logger.error(
+                f"Error al escribir {len(batch)} acciones de auditoría: {e}")
+            self._requeue(batch)
+            return
+        self._retry_at = 0.0
+
+    def _write_one_by_one(self, batch):
+        conn = self._connection()
+        for event in batch:
+            try:
+                with conn:
+                    conn.execute(self.SQL, event)
+            except sqlite3.Error as e:
+                self.logger.error(
+                    f"Error al registrar acción de auditoría: {event[1]} por {event[0]} - {e}")
+
+    def _requeue(self, batch):
+        with self._lock:
+            self._retry_at = time.monotonic() + (self.flush_interval or 1.0)
+            if len(self._buffer) + len(batch) <= self.batch_size * 10:
+                self._buffer[:0] = batch
+            else:
+                self.logger.error(
+                    f"Búfer de auditoría lleno: se descartan {len(batch)} acciones.")
+            if self._timer is None and self.flush_interval:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+
+class SlowQueryLog(AuditSink):
+    """
+    Registro de consultas lentas. Cada sentencia que supera 'threshold_ms' se
+    guarda con la forma de sus parámetros y su EXPLAIN QUERY PLAN, marcando
+    los recorridos completos de tabla y los B-tree temporales. Las filas se
+    escriben por lotes en 'consultas_lentas', que se recorta para conservar
+    solo las 'keep' más recientes (búfer circular).
+    """
+
+    SQL = """
+        INSERT INTO consultas_lentas (fecha, sql, parametros, duracion_ms, filas, plan, full_scan, temp_btree, origen)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    TRIM_SQL = "DELETE FROM consultas_lentas WHERE id <= (SELECT MAX(id) FROM consultas_lentas) - ?"
+
+    def __init__(self, manager, logger, threshold_ms, keep=500, flush_interval=2.0):
+        # Nunca es síncrono: la consulta lenta puede ocurrir dentro de una
+        # transacción de escritura que bloquearía la conexión del registro.
+        super().__init__(manager, logger, batch_size=50,
+                         flush_interval=flush_interval, synchronous=False)
+        self.threshold_ms = threshold_ms
+        self.keep = keep
+
+    def capture(self, conn, entry):
+        plan = explain_query_plan(conn, entry['sql'], entry['params'])
+        full_scan = any(is_full_scan(line) for line in plan or [])
+        temp_btree = any('USE TEMP B-TREE' in line for line in plan or [])
+        origen = request.endpoint if has_request_context() else threading.current_thread().name
+        duration_ms = round(entry['duration'] * 1000, 2)
+        fecha = datetime.datetime.now(
+            datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+        self.logger.warning("slow_query " + json.dumps({
+            'ms': duration_ms,
+            'origen': origen,
+            'sql': normalize_sql(entry['sql'])[:500],
+            'full_scan': full_scan,
+            'temp_btree': temp_btree,
+        }, ensure_ascii=False))
+
+        self._enqueue((fecha, entry['sql'], parameter_shape(entry['params']),
+                       duration_ms, entry['rows'],
+                       '\n'.join(plan) if plan else None,
+                       int(full_scan), int(temp_btree), origen))
+
+    def _write(self, batch):
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(self.SQL, batch)
+                conn.execute(self.TRIM_SQL, (self.keep,))
+        except sqlite3.Error as e:
+            # Es información de diagnóstico: ante un error se descarta el lote.
+            self.logger.error(
+                f"No se pudieron guardar {len(batch)} consultas lentas: {e}")
+
+
+def flush_slow_queries(e=None):
+    """Vacía el búfer de consultas lentas al final de cada solicitud."""
+    slow_log = current_app.extensions.get('slow_queries')
+    if slow_log is not None:
+        slow_log.flush()
+
+
+def flush_audit(e=None):
+    """Vacía el búfer de auditoría al final de cada solicitud."""
+    sink = current_app.extensions.get('audit')
+    if sink is not None and current_app.config.get('AUDIT_FLUSH_ON_TEARDOWN', True):
+        sink.flush()
+
+
+def log_action(accion, usuario_id, tipo_objeto, objeto_id, detalles=None):
+    """
+    Registra una acción de auditoría. El evento se encola en el AuditSink de
+    la aplicación y se escribe junto con los demás eventos del lote; si la
+    conexión de la solicitud tiene una transacción de escritura abierta, se
+    inserta en esa transacción para no esperar a que termine.
+    """
     try:
-        cursor = db.cursor()
-        cursor.execute(sql, params)
-        db.commit()
+        sink = current_app.extensions['audit']
+        conn = g.get('db')
+        if conn is not None and conn.in_transaction:
+            sink.record_in(conn, accion, usuario_id, tipo_objeto, objeto_id, detalles)
+        else:
+            sink.record(accion, usuario_id, tipo_objeto, objeto_id, detalles)
     except Exception as e:
         current_app.logger.error(
             f"Error al registrar acción de auditoría: {accion} por {usuario_id} - {e}")
-        db.rollback()
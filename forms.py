@@ -154,6 +154,9 @@ class ProfileForm(FlaskForm):
     email_notif_estado = BooleanField(
         'Recibir notificaciones por email sobre cambios de estado de conexiones')
 
+    email_resumen = BooleanField(
+        'Recibir los correos agrupados en un resumen periódico')
+
     submit = SubmitField('Actualizar Perfil')
 
     def validate_email(self, email):
@@ -0,0 +1,17 @@
+-- -----------------------------------------------------
+-- Migración 0001: registro de consultas lentas
+-- Búfer circular con las sentencias que superaron SLOW_QUERY_MS, junto con la
+-- forma de sus parámetros y la salida de EXPLAIN QUERY PLAN.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS consultas_lentas (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  sql TEXT NOT NULL,
+  parametros TEXT,
+  duracion_ms REAL NOT NULL,
+  filas INTEGER NOT NULL DEFAULT 0,
+  plan TEXT,
+  full_scan INTEGER NOT NULL DEFAULT 0,
+  temp_btree INTEGER NOT NULL DEFAULT 0,
+  origen TEXT
+);
@@ -0,0 +1,15 @@
+-- -----------------------------------------------------
+-- Migración 0002: índices de rendimiento
+-- Cubren el historial y los comentarios/archivos de cada conexión, las
+-- notificaciones no leídas por usuario, el listado de auditoría por fecha y
+-- los proyectos de un usuario. Se construyen en segundo plano, uno por
+-- transacción, para no bloquear la base de datos en producción.
+-- -----------------------------------------------------
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_historial_conexion_fecha ON historial_estados (conexion_id, fecha);
+CREATE INDEX IF NOT EXISTS idx_comentarios_conexion_id ON comentarios (conexion_id);
+CREATE INDEX IF NOT EXISTS idx_archivos_conexion_id ON archivos (conexion_id);
+CREATE INDEX IF NOT EXISTS idx_notificaciones_usuario_leida ON notificaciones (usuario_id, leida, fecha_creacion);
+CREATE INDEX IF NOT EXISTS idx_auditoria_fecha ON auditoria_acciones (fecha);
+CREATE INDEX IF NOT EXISTS idx_proyecto_usuarios_usuario_id ON proyecto_usuarios (usuario_id);
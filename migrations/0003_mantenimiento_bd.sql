@@ -0,0 +1,18 @@
+-- -----------------------------------------------------
+-- Migración 0003: historial de mantenimiento de la base de datos
+-- Una fila por ejecución del job de mantenimiento, con su duración y el
+-- tamaño del archivo, del WAL y de la lista de páginas libres antes y después.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS mantenimiento_bd (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  duracion_ms REAL NOT NULL,
+  tamano_antes INTEGER,
+  tamano_despues INTEGER,
+  wal_antes INTEGER,
+  wal_despues INTEGER,
+  paginas_libres_antes INTEGER,
+  paginas_libres_despues INTEGER,
+  detalles TEXT,
+  error TEXT
+);
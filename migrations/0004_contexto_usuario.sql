@@ -0,0 +1,33 @@
+-- -----------------------------------------------------
+-- Migración 0004: versión del contexto de usuario
+-- 'contexto_version' cambia con cada escritura que afecta a lo que carga
+-- 'before_request_handler' (datos del usuario, roles y notificaciones), de
+-- modo que la caché en proceso solo tiene que comparar un entero.
+-- -----------------------------------------------------
+ALTER TABLE usuarios ADD COLUMN contexto_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS t_usuarios_contexto_update AFTER UPDATE ON usuarios
+WHEN NEW.contexto_version = OLD.contexto_version BEGIN
+  UPDATE usuarios SET contexto_version = OLD.contexto_version + 1 WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_usuario_roles_contexto_insert AFTER INSERT ON usuario_roles BEGIN
+  UPDATE usuarios SET contexto_version = contexto_version + 1 WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_usuario_roles_contexto_delete AFTER DELETE ON usuario_roles BEGIN
+  UPDATE usuarios SET contexto_version = contexto_version + 1 WHERE id = OLD.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contexto_insert AFTER INSERT ON notificaciones BEGIN
+  UPDATE usuarios SET contexto_version = contexto_version + 1 WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contexto_update AFTER UPDATE OF leida ON notificaciones
+WHEN NEW.leida != OLD.leida BEGIN
+  UPDATE usuarios SET contexto_version = contexto_version + 1 WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contexto_delete AFTER DELETE ON notificaciones BEGIN
+  UPDATE usuarios SET contexto_version = contexto_version + 1 WHERE id = OLD.usuario_id;
+END;
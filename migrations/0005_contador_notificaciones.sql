@@ -0,0 +1,41 @@
+-- -----------------------------------------------------
+-- Migración 0005: contador de notificaciones no leídas
+-- 'usuarios.notificaciones_no_leidas' se mantiene con triggers, así que el
+-- contador del menú se lee junto con la fila del usuario sin un COUNT(*).
+-- Los triggers de la migración 0004 sobre 'notificaciones' se sustituyen por
+-- otros que actualizan contador y 'contexto_version' en un único UPDATE.
+-- -----------------------------------------------------
+ALTER TABLE usuarios ADD COLUMN notificaciones_no_leidas INTEGER NOT NULL DEFAULT 0;
+
+UPDATE usuarios SET notificaciones_no_leidas = (
+  SELECT COUNT(*) FROM notificaciones n WHERE n.usuario_id = usuarios.id AND n.leida = 0
+);
+
+DROP TRIGGER IF EXISTS t_notificaciones_contexto_insert;
+DROP TRIGGER IF EXISTS t_notificaciones_contexto_update;
+DROP TRIGGER IF EXISTS t_notificaciones_contexto_delete;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contador_insert AFTER INSERT ON notificaciones BEGIN
+  UPDATE usuarios
+  SET notificaciones_no_leidas = notificaciones_no_leidas + (NEW.leida = 0),
+      contexto_version = contexto_version + 1
+  WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contador_update AFTER UPDATE OF leida ON notificaciones
+WHEN NEW.leida != OLD.leida BEGIN
+  UPDATE usuarios
+  SET notificaciones_no_leidas = MAX(notificaciones_no_leidas + (NEW.leida = 0) - (OLD.leida = 0), 0),
+      contexto_version = contexto_version + 1
+  WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_notificaciones_contador_delete AFTER DELETE ON notificaciones BEGIN
+  UPDATE usuarios
+  SET notificaciones_no_leidas = MAX(notificaciones_no_leidas - (OLD.leida = 0), 0),
+      contexto_version = contexto_version + 1
+  WHERE id = OLD.usuario_id;
+END;
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_notificaciones_usuario_leida_id ON notificaciones (usuario_id, leida, id);
@@ -0,0 +1,25 @@
+-- -----------------------------------------------------
+-- Migración 0006: bandeja de salida de correos
+-- Los correos de notificación se insertan aquí dentro de la misma
+-- transacción que los genera y un hilo de envío los despacha por lotes, de
+-- modo que ninguno se pierde si el proceso se reinicia antes de enviarlos.
+-- estado: PENDIENTE -> ENVIANDO -> ENVIADO, o ERROR tras agotar reintentos.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS email_outbox (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  destinatario TEXT NOT NULL,
+  nombre TEXT,
+  asunto TEXT NOT NULL,
+  mensaje TEXT NOT NULL,
+  url TEXT,
+  estado TEXT NOT NULL DEFAULT 'PENDIENTE'
+    CHECK(estado IN ('PENDIENTE', 'ENVIANDO', 'ENVIADO', 'ERROR')),
+  intentos INTEGER NOT NULL DEFAULT 0,
+  proximo_intento TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  reclamado_en TIMESTAMP,
+  ultimo_error TEXT,
+  fecha_creacion TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  fecha_envio TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_estado ON email_outbox (estado, proximo_intento);
@@ -0,0 +1,19 @@
+-- -----------------------------------------------------
+-- Migración 0007: agrupación de notificaciones y resumen por correo
+-- Los eventos de una misma conexión para un mismo usuario dentro de la
+-- ventana de agrupación se acumulan en una sola notificación: 'mensaje' es
+-- el último, 'detalles' guarda los anteriores (JSON) y 'eventos' el total.
+-- Los usuarios con 'email_resumen' reciben sus correos retenidos en la
+-- bandeja de salida hasta que el job de resumen los libera.
+-- -----------------------------------------------------
+ALTER TABLE notificaciones ADD COLUMN eventos INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE notificaciones ADD COLUMN detalles TEXT;
+ALTER TABLE notificaciones ADD COLUMN fecha_actualizacion TIMESTAMP;
+
+UPDATE notificaciones SET fecha_actualizacion = fecha_creacion;
+
+ALTER TABLE preferencias_notificaciones ADD COLUMN email_resumen INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE email_outbox ADD COLUMN resumen INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_email_outbox_resumen ON email_outbox (resumen) WHERE resumen = 1;
@@ -0,0 +1,18 @@
+-- -----------------------------------------------------
+-- Migración 0008: eventos en tiempo real
+-- Registro de eventos que cada proceso lee por 'id' creciente para
+-- reenviarlos a sus conexiones SSE (/api/stream). Como SQLite admite un
+-- único escritor, el orden de los ids coincide con el orden de los commits.
+-- 'usuario_id' dirige el evento a un usuario; si es NULL, el evento es para
+-- los miembros de 'proyecto_id'. Las filas antiguas se eliminan solas.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS eventos_tiempo_real (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  tipo TEXT NOT NULL,
+  usuario_id INTEGER,
+  proyecto_id INTEGER,
+  datos TEXT NOT NULL,
+  fecha TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_eventos_tiempo_real_fecha ON eventos_tiempo_real (fecha);
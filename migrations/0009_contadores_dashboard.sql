@@ -0,0 +1,98 @@
+-- -----------------------------------------------------
+-- Migración 0009: contadores del dashboard por usuario
+-- 'dashboard_counters' guarda, por usuario y métrica, los recuentos del
+-- resumen personal del dashboard. Los triggers sobre 'conexiones' restan la
+-- fila anterior y suman la nueva; los de 'proyecto_usuarios' ajustan las
+-- conexiones pendientes de aprobación al cambiar los miembros de un proyecto.
+-- Métricas:
+--   creadas                   conexiones con solicitante_id = usuario
+--   solicitadas_en_proceso    ídem en estado EN_PROCESO
+--   solicitadas_aprobadas     ídem en estado APROBADO
+--   tareas_en_proceso         conexiones con realizador_id = usuario en EN_PROCESO
+--   pendientes_aprobacion     conexiones REALIZADO de los proyectos del usuario
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS dashboard_counters (
+  usuario_id INTEGER NOT NULL,
+  metrica TEXT NOT NULL,
+  valor INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (usuario_id, metrica)
+) WITHOUT ROWID;
+
+INSERT INTO dashboard_counters (usuario_id, metrica, valor)
+SELECT usuario_id, metrica, COUNT(*) FROM (
+  SELECT solicitante_id AS usuario_id, 'creadas' AS metrica FROM conexiones
+  UNION ALL SELECT solicitante_id, 'solicitadas_en_proceso' FROM conexiones WHERE estado = 'EN_PROCESO'
+  UNION ALL SELECT solicitante_id, 'solicitadas_aprobadas' FROM conexiones WHERE estado = 'APROBADO'
+  UNION ALL SELECT realizador_id, 'tareas_en_proceso' FROM conexiones WHERE estado = 'EN_PROCESO'
+  UNION ALL SELECT pu.usuario_id, 'pendientes_aprobacion' FROM conexiones c
+    JOIN proyecto_usuarios pu ON pu.proyecto_id = c.proyecto_id WHERE c.estado = 'REALIZADO'
+)
+WHERE usuario_id IS NOT NULL
+GROUP BY usuario_id, metrica;
+
+CREATE TRIGGER IF NOT EXISTS t_dashboard_counters_insert AFTER INSERT ON conexiones BEGIN
+  INSERT INTO dashboard_counters (usuario_id, metrica, valor)
+  SELECT usuario_id, metrica, 1 FROM (
+    SELECT NEW.solicitante_id AS usuario_id, 'creadas' AS metrica
+    UNION ALL SELECT NEW.solicitante_id, 'solicitadas_en_proceso' WHERE NEW.estado = 'EN_PROCESO'
+    UNION ALL SELECT NEW.solicitante_id, 'solicitadas_aprobadas' WHERE NEW.estado = 'APROBADO'
+    UNION ALL SELECT NEW.realizador_id, 'tareas_en_proceso' WHERE NEW.estado = 'EN_PROCESO'
+    UNION ALL SELECT usuario_id, 'pendientes_aprobacion' FROM proyecto_usuarios
+      WHERE proyecto_id = NEW.proyecto_id AND NEW.estado = 'REALIZADO'
+  )
+  WHERE usuario_id IS NOT NULL
+  ON CONFLICT (usuario_id, metrica) DO UPDATE SET valor = valor + excluded.valor;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_dashboard_counters_update
+AFTER UPDATE OF estado, proyecto_id, solicitante_id, realizador_id ON conexiones
+WHEN NEW.estado IS NOT OLD.estado OR NEW.proyecto_id IS NOT OLD.proyecto_id
+  OR NEW.solicitante_id IS NOT OLD.solicitante_id OR NEW.realizador_id IS NOT OLD.realizador_id
+BEGIN
+  UPDATE dashboard_counters SET valor = valor - 1
+  WHERE (usuario_id = OLD.solicitante_id AND metrica = 'creadas')
+     OR (usuario_id = OLD.solicitante_id AND metrica = 'solicitadas_en_proceso' AND OLD.estado = 'EN_PROCESO')
+     OR (usuario_id = OLD.solicitante_id AND metrica = 'solicitadas_aprobadas' AND OLD.estado = 'APROBADO')
+     OR (usuario_id = OLD.realizador_id AND metrica = 'tareas_en_proceso' AND OLD.estado = 'EN_PROCESO')
+     OR (metrica = 'pendientes_aprobacion' AND OLD.estado = 'REALIZADO' AND usuario_id IN (
+           SELECT usuario_id FROM proyecto_usuarios WHERE proyecto_id = OLD.proyecto_id));
+
+  INSERT INTO dashboard_counters (usuario_id, metrica, valor)
+  SELECT usuario_id, metrica, 1 FROM (
+    SELECT NEW.solicitante_id AS usuario_id, 'creadas' AS metrica
+    UNION ALL SELECT NEW.solicitante_id, 'solicitadas_en_proceso' WHERE NEW.estado = 'EN_PROCESO'
+    UNION ALL SELECT NEW.solicitante_id, 'solicitadas_aprobadas' WHERE NEW.estado = 'APROBADO'
+    UNION ALL SELECT NEW.realizador_id, 'tareas_en_proceso' WHERE NEW.estado = 'EN_PROCESO'
+    UNION ALL SELECT usuario_id, 'pendientes_aprobacion' FROM proyecto_usuarios
+      WHERE proyecto_id = NEW.proyecto_id AND NEW.estado = 'REALIZADO'
+  )
+  WHERE usuario_id IS NOT NULL
+  ON CONFLICT (usuario_id, metrica) DO UPDATE SET valor = valor + excluded.valor;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_dashboard_counters_delete AFTER DELETE ON conexiones BEGIN
+  UPDATE dashboard_counters SET valor = valor - 1
+  WHERE (usuario_id = OLD.solicitante_id AND metrica = 'creadas')
+     OR (usuario_id = OLD.solicitante_id AND metrica = 'solicitadas_en_proceso' AND OLD.estado = 'EN_PROCESO')
+     OR (usuario_id = OLD.solicitante_id AND metrica = 'solicitadas_aprobadas' AND OLD.estado = 'APROBADO')
+     OR (usuario_id = OLD.realizador_id AND metrica = 'tareas_en_proceso' AND OLD.estado = 'EN_PROCESO')
+     OR (metrica = 'pendientes_aprobacion' AND OLD.estado = 'REALIZADO' AND usuario_id IN (
+           SELECT usuario_id FROM proyecto_usuarios WHERE proyecto_id = OLD.proyecto_id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_dashboard_counters_miembro_insert AFTER INSERT ON proyecto_usuarios BEGIN
+  INSERT INTO dashboard_counters (usuario_id, metrica, valor)
+  SELECT NEW.usuario_id, 'pendientes_aprobacion', COUNT(*) FROM conexiones
+  WHERE proyecto_id = NEW.proyecto_id AND estado = 'REALIZADO'
+  ON CONFLICT (usuario_id, metrica) DO UPDATE SET valor = valor + excluded.valor;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_dashboard_counters_miembro_delete AFTER DELETE ON proyecto_usuarios BEGIN
+  UPDATE dashboard_counters
+  SET valor = valor - (SELECT COUNT(*) FROM conexiones
+                       WHERE proyecto_id = OLD.proyecto_id AND estado = 'REALIZADO')
+  WHERE usuario_id = OLD.usuario_id AND metrica = 'pendientes_aprobacion';
+END;
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_conexiones_proyecto_estado ON conexiones (proyecto_id, estado);
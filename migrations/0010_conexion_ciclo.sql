@@ -0,0 +1,58 @@
+-- -----------------------------------------------------
+-- Migración 0010: ciclo de vida de cada conexión
+-- 'conexion_ciclo' guarda una fila por conexión con la fecha en que alcanzó
+-- cada estado y las duraciones entre ellos (en días), para que los KPIs de
+-- tiempos sean un agregado indexado en lugar de auto-joins de
+-- 'historial_estados'. Se mantiene en 'SQLiteDAL.registrar_ciclo_estado' y se
+-- puede reconstruir con 'flask ciclo-conexiones'.
+--   fecha_en_proceso   primera vez que se tomó o asignó
+--   fecha_realizado    última vez que se marcó como realizada
+--   dias_espera        solicitado -> en proceso
+--   dias_ejecucion     en proceso -> realizado
+--   dias_aprobacion    realizado -> aprobado
+--   dias_ciclo         solicitado -> aprobado
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS conexion_ciclo (
+  conexion_id INTEGER PRIMARY KEY,
+  realizador_id INTEGER,
+  aprobador_id INTEGER,
+  fecha_solicitado TIMESTAMP NOT NULL,
+  fecha_en_proceso TIMESTAMP,
+  fecha_realizado TIMESTAMP,
+  fecha_aprobado TIMESTAMP,
+  fecha_ultimo_rechazo TIMESTAMP,
+  num_rechazos INTEGER NOT NULL DEFAULT 0,
+  dias_espera REAL,
+  dias_ejecucion REAL,
+  dias_aprobacion REAL,
+  dias_ciclo REAL,
+  FOREIGN KEY (conexion_id) REFERENCES conexiones(id) ON DELETE CASCADE,
+  FOREIGN KEY (realizador_id) REFERENCES usuarios(id) ON DELETE SET NULL,
+  FOREIGN KEY (aprobador_id) REFERENCES usuarios(id) ON DELETE SET NULL
+);
+
+INSERT OR IGNORE INTO conexion_ciclo (
+  conexion_id, realizador_id, aprobador_id, fecha_solicitado, fecha_en_proceso,
+  fecha_realizado, fecha_aprobado, fecha_ultimo_rechazo, num_rechazos,
+  dias_espera, dias_ejecucion, dias_aprobacion, dias_ciclo)
+SELECT id, realizador_id, aprobador_id, fecha_solicitado, fecha_en_proceso,
+       fecha_realizado, fecha_aprobado, fecha_ultimo_rechazo, num_rechazos,
+       julianday(fecha_en_proceso) - julianday(fecha_solicitado),
+       julianday(fecha_realizado) - julianday(COALESCE(fecha_en_proceso, fecha_solicitado)),
+       julianday(fecha_aprobado) - julianday(fecha_realizado),
+       julianday(fecha_aprobado) - julianday(fecha_solicitado)
+FROM (
+  SELECT c.id, c.realizador_id, c.aprobador_id,
+         COALESCE(MIN(CASE WHEN h.estado = 'SOLICITADO' THEN h.fecha END), c.fecha_creacion) AS fecha_solicitado,
+         MIN(CASE WHEN h.estado = 'EN_PROCESO' THEN h.fecha END) AS fecha_en_proceso,
+         MAX(CASE WHEN h.estado = 'REALIZADO' THEN h.fecha END) AS fecha_realizado,
+         MAX(CASE WHEN h.estado = 'APROBADO' THEN h.fecha END) AS fecha_aprobado,
+         MAX(CASE WHEN h.estado = 'RECHAZADO' THEN h.fecha END) AS fecha_ultimo_rechazo,
+         COUNT(CASE WHEN h.estado = 'RECHAZADO' THEN 1 END) AS num_rechazos
+  FROM conexiones c LEFT JOIN historial_estados h ON h.conexion_id = c.id
+  GROUP BY c.id
+);
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_conexion_ciclo_realizador ON conexion_ciclo (realizador_id, fecha_realizado, dias_ejecucion);
+CREATE INDEX IF NOT EXISTS idx_conexion_ciclo_aprobado ON conexion_ciclo (fecha_aprobado, dias_ciclo);
@@ -0,0 +1,8 @@
+-- -----------------------------------------------------
+-- Migración 0011: índice del historial por fecha
+-- La analítica de tiempo por estado selecciona las conexiones con cambios
+-- de estado dentro del rango de fechas pedido.
+-- -----------------------------------------------------
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_historial_fecha ON historial_estados (fecha, conexion_id);
@@ -0,0 +1,32 @@
+-- -----------------------------------------------------
+-- Migración 0012: métricas diarias
+-- 'metricas_diarias' cuenta los cambios de estado del historial por día,
+-- proyecto, usuario que hizo el cambio y estado de destino. Las gráficas
+-- diarias y mensuales del dashboard y de eficiencia la leen en lugar de
+-- agrupar 'conexiones' por fecha. El trigger la actualiza con cada cambio de
+-- estado; el job nocturno de 'analytics_service' recalcula los últimos días
+-- a partir del historial. usuario_id = 0 si el usuario ya no existe.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS metricas_diarias (
+  dia TEXT NOT NULL,
+  proyecto_id INTEGER NOT NULL,
+  usuario_id INTEGER NOT NULL,
+  estado TEXT NOT NULL,
+  total INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (dia, proyecto_id, usuario_id, estado)
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO metricas_diarias (dia, proyecto_id, usuario_id, estado, total)
+SELECT date(h.fecha), c.proyecto_id, COALESCE(h.usuario_id, 0), h.estado, COUNT(*)
+FROM historial_estados h JOIN conexiones c ON c.id = h.conexion_id
+GROUP BY 1, 2, 3, 4;
+
+CREATE TRIGGER IF NOT EXISTS t_metricas_diarias_historial AFTER INSERT ON historial_estados BEGIN
+  INSERT INTO metricas_diarias (dia, proyecto_id, usuario_id, estado, total)
+  SELECT date(NEW.fecha), proyecto_id, COALESCE(NEW.usuario_id, 0), NEW.estado, 1
+  FROM conexiones WHERE id = NEW.conexion_id
+  ON CONFLICT (dia, proyecto_id, usuario_id, estado) DO UPDATE SET total = total + 1;
+END;
+
+-- @online
+CREATE INDEX IF NOT EXISTS idx_metricas_diarias_usuario ON metricas_diarias (usuario_id, estado, dia);
@@ -0,0 +1,53 @@
+-- -----------------------------------------------------
+-- Migración 0013: índice de búsqueda por trigramas
+-- 'conexiones_trigram_fts' indexa el código, el tipo, el subtipo, la
+-- tipología y los perfiles de cada conexión con el tokenizador 'trigram',
+-- que encuentra cualquier subcadena de tres o más caracteres (p. ej. '14X22'
+-- dentro de 'MVW14X22CFT0'). Es una tabla de contenido externo sobre la
+-- vista 'conexiones_busqueda', que extrae los perfiles de 'detalles_json'
+-- (las tipologías del catálogo tienen como mucho dos; se deja margen para
+-- una tercera). Los triggers solo reindexan cuando cambia alguna de esas
+-- columnas, no en cada cambio de estado.
+-- -----------------------------------------------------
+CREATE VIEW IF NOT EXISTS conexiones_busqueda AS
+SELECT id, codigo_conexion, tipo, subtipo, tipologia,
+       CASE WHEN json_valid(detalles_json) THEN trim(
+           coalesce(json_extract(detalles_json, '$."Perfil 1"'), '') || ' ' ||
+           coalesce(json_extract(detalles_json, '$."Perfil 2"'), '') || ' ' ||
+           coalesce(json_extract(detalles_json, '$."Perfil 3"'), '')) END AS perfiles
+FROM conexiones;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS conexiones_trigram_fts USING fts5(
+    codigo_conexion,
+    tipo,
+    subtipo,
+    tipologia,
+    perfiles,
+    content='conexiones_busqueda',
+    content_rowid='id',
+    tokenize='trigram'
+);
+
+INSERT INTO conexiones_trigram_fts(conexiones_trigram_fts) VALUES ('rebuild');
+
+CREATE TRIGGER IF NOT EXISTS t_conexiones_trigram_after_insert AFTER INSERT ON conexiones BEGIN
+  INSERT INTO conexiones_trigram_fts(rowid, codigo_conexion, tipo, subtipo, tipologia, perfiles)
+  SELECT id, codigo_conexion, tipo, subtipo, tipologia, perfiles FROM conexiones_busqueda WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_conexiones_trigram_before_delete BEFORE DELETE ON conexiones BEGIN
+  INSERT INTO conexiones_trigram_fts(conexiones_trigram_fts, rowid, codigo_conexion, tipo, subtipo, tipologia, perfiles)
+  SELECT 'delete', id, codigo_conexion, tipo, subtipo, tipologia, perfiles FROM conexiones_busqueda WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_conexiones_trigram_before_update
+BEFORE UPDATE OF codigo_conexion, tipo, subtipo, tipologia, detalles_json ON conexiones BEGIN
+  INSERT INTO conexiones_trigram_fts(conexiones_trigram_fts, rowid, codigo_conexion, tipo, subtipo, tipologia, perfiles)
+  SELECT 'delete', id, codigo_conexion, tipo, subtipo, tipologia, perfiles FROM conexiones_busqueda WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_conexiones_trigram_after_update
+AFTER UPDATE OF codigo_conexion, tipo, subtipo, tipologia, detalles_json ON conexiones BEGIN
+  INSERT INTO conexiones_trigram_fts(rowid, codigo_conexion, tipo, subtipo, tipologia, perfiles)
+  SELECT id, codigo_conexion, tipo, subtipo, tipologia, perfiles FROM conexiones_busqueda WHERE id = NEW.id;
+END;
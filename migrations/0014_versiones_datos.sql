@@ -0,0 +1,26 @@
+-- -----------------------------------------------------
+-- Migración 0014: versiones de datos
+-- 'versiones_datos' guarda un contador por tabla que los triggers
+-- incrementan con cada escritura. Las cachés en memoria de cada proceso
+-- comparan su versión con esta para saber si siguen vigentes sin releer la
+-- tabla completa. Empieza por 'alias_perfiles', que alimenta el índice de
+-- autocompletado de perfiles.
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS versiones_datos (
+  tabla TEXT PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO versiones_datos (tabla, version) VALUES ('alias_perfiles', 0);
+
+CREATE TRIGGER IF NOT EXISTS t_version_alias_perfiles_insert AFTER INSERT ON alias_perfiles BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'alias_perfiles';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_alias_perfiles_update AFTER UPDATE ON alias_perfiles BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'alias_perfiles';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_alias_perfiles_delete AFTER DELETE ON alias_perfiles BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'alias_perfiles';
+END;
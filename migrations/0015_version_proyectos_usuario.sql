@@ -0,0 +1,21 @@
+-- -----------------------------------------------------
+-- Migración 0015: versión de los proyectos de cada usuario
+-- 'proyectos_version' cambia cuando el usuario entra en un proyecto o sale
+-- de él. Se carga con la fila del usuario en el contexto de la solicitud
+-- (y, al ser un UPDATE de 'usuarios', sube también 'contexto_version'), así
+-- que las cachés por usuario pueden incluirla en la clave sin consultar
+-- 'proyecto_usuarios'.
+-- -----------------------------------------------------
+ALTER TABLE usuarios ADD COLUMN proyectos_version INTEGER NOT NULL DEFAULT 0;
+
+CREATE TRIGGER IF NOT EXISTS t_proyecto_usuarios_version_insert AFTER INSERT ON proyecto_usuarios BEGIN
+  UPDATE usuarios SET proyectos_version = proyectos_version + 1 WHERE id = NEW.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_proyecto_usuarios_version_delete AFTER DELETE ON proyecto_usuarios BEGIN
+  UPDATE usuarios SET proyectos_version = proyectos_version + 1 WHERE id = OLD.usuario_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_proyecto_usuarios_version_update AFTER UPDATE ON proyecto_usuarios BEGIN
+  UPDATE usuarios SET proyectos_version = proyectos_version + 1 WHERE id IN (OLD.usuario_id, NEW.usuario_id);
+END;
@@ -0,0 +1,44 @@
+-- -----------------------------------------------------
+-- Migración 0016: versión de datos de 'conexiones'
+-- Los triggers 't_conexiones_after_*', que mantienen 'conexiones_fts', suben
+-- además la versión 'conexiones' de 'versiones_datos' con cada escritura. La
+-- caché de resultados de búsqueda incluye esa versión en la clave, así que
+-- una búsqueda repetida no vuelve a consultar los índices FTS hasta que
+-- cambia alguna conexión. También la suben los cambios de nombre de
+-- proyectos y usuarios, que aparecen en los resultados.
+-- -----------------------------------------------------
+INSERT OR IGNORE INTO versiones_datos (tabla, version) VALUES ('conexiones', 0);
+
+DROP TRIGGER IF EXISTS t_conexiones_after_insert;
+DROP TRIGGER IF EXISTS t_conexiones_after_delete;
+DROP TRIGGER IF EXISTS t_conexiones_after_update;
+
+CREATE TRIGGER t_conexiones_after_insert AFTER INSERT ON conexiones BEGIN
+  INSERT INTO conexiones_fts(rowid, codigo_conexion, descripcion)
+  VALUES (new.id, new.codigo_conexion, new.descripcion);
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'conexiones';
+END;
+
+CREATE TRIGGER t_conexiones_after_delete AFTER DELETE ON conexiones BEGIN
+  INSERT INTO conexiones_fts(conexiones_fts, rowid, codigo_conexion, descripcion)
+  VALUES ('delete', old.id, old.codigo_conexion, old.descripcion);
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'conexiones';
+END;
+
+CREATE TRIGGER t_conexiones_after_update AFTER UPDATE ON conexiones BEGIN
+  INSERT INTO conexiones_fts(conexiones_fts, rowid, codigo_conexion, descripcion)
+  VALUES ('delete', old.id, old.codigo_conexion, old.descripcion);
+  INSERT INTO conexiones_fts(rowid, codigo_conexion, descripcion)
+  VALUES (new.id, new.codigo_conexion, new.descripcion);
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'conexiones';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_conexiones_proyecto_nombre
+AFTER UPDATE OF nombre ON proyectos WHEN NEW.nombre IS NOT OLD.nombre BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'conexiones';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_conexiones_usuario_nombre
+AFTER UPDATE OF nombre_completo ON usuarios WHEN NEW.nombre_completo IS NOT OLD.nombre_completo BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'conexiones';
+END;
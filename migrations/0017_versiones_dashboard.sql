@@ -0,0 +1,107 @@
+-- -----------------------------------------------------
+-- Migración 0017: versiones del dashboard
+-- La caché del dashboard es propia de cada proceso, así que invalidarla en
+-- el worker que atendió la escritura no basta con varios workers de
+-- gunicorn. 'versiones_dashboard' guarda una versión por usuario que los
+-- triggers suben con cada cambio en sus conexiones (como solicitante,
+-- realizador, aprobador o miembro del proyecto), en sus proyectos y en sus
+-- preferencias; la versión 'dashboard' de 'versiones_datos' cubre las
+-- secciones comunes. Ambas forman parte de la clave de la caché, de modo que
+-- todos los workers dejan de usar las secciones afectadas tras la escritura.
+-- 'dashboard_epoch' también va en todas las claves y la sube el vaciado
+-- completo de la caché (reconstrucciones, cambios de proyectos).
+-- -----------------------------------------------------
+CREATE TABLE IF NOT EXISTS versiones_dashboard (
+  usuario_id INTEGER PRIMARY KEY,
+  version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO versiones_datos (tabla, version) VALUES ('dashboard', 0), ('dashboard_epoch', 0);
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_conexion_insert AFTER INSERT ON conexiones BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version)
+  SELECT usuario_id, 1 FROM (
+    SELECT NEW.solicitante_id AS usuario_id
+    UNION SELECT NEW.realizador_id
+    UNION SELECT NEW.aprobador_id
+    UNION SELECT usuario_id FROM proyecto_usuarios WHERE proyecto_id = NEW.proyecto_id
+  )
+  WHERE usuario_id IS NOT NULL
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_conexion_update AFTER UPDATE ON conexiones BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version)
+  SELECT usuario_id, 1 FROM (
+    SELECT OLD.solicitante_id AS usuario_id
+    UNION SELECT OLD.realizador_id
+    UNION SELECT OLD.aprobador_id
+    UNION SELECT NEW.solicitante_id
+    UNION SELECT NEW.realizador_id
+    UNION SELECT NEW.aprobador_id
+    UNION SELECT usuario_id FROM proyecto_usuarios
+      WHERE proyecto_id IN (OLD.proyecto_id, NEW.proyecto_id)
+  )
+  WHERE usuario_id IS NOT NULL
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_conexion_delete AFTER DELETE ON conexiones BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version)
+  SELECT usuario_id, 1 FROM (
+    SELECT OLD.solicitante_id AS usuario_id
+    UNION SELECT OLD.realizador_id
+    UNION SELECT OLD.aprobador_id
+    UNION SELECT usuario_id FROM proyecto_usuarios WHERE proyecto_id = OLD.proyecto_id
+  )
+  WHERE usuario_id IS NOT NULL
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_miembro_insert AFTER INSERT ON proyecto_usuarios BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version) VALUES (NEW.usuario_id, 1)
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_miembro_delete AFTER DELETE ON proyecto_usuarios BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version) VALUES (OLD.usuario_id, 1)
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_proyecto_insert AFTER INSERT ON proyectos BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_proyecto_update AFTER UPDATE ON proyectos BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version)
+  SELECT usuario_id, 1 FROM proyecto_usuarios WHERE proyecto_id = NEW.id
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_proyecto_delete BEFORE DELETE ON proyectos BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version)
+  SELECT usuario_id, 1 FROM proyecto_usuarios WHERE proyecto_id = OLD.id
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_preferencias_insert
+AFTER INSERT ON user_dashboard_preferences BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version) VALUES (NEW.usuario_id, 1)
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_preferencias_update
+AFTER UPDATE ON user_dashboard_preferences BEGIN
+  INSERT INTO versiones_dashboard (usuario_id, version) VALUES (NEW.usuario_id, 1)
+  ON CONFLICT (usuario_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS t_version_dashboard_usuario_nombre
+AFTER UPDATE OF nombre_completo ON usuarios WHEN NEW.nombre_completo IS NOT OLD.nombre_completo BEGIN
+  UPDATE versiones_datos SET version = version + 1 WHERE tabla = 'dashboard';
+END;
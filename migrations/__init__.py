@@ -0,0 +1,246 @@
+"""
+Motor de migraciones del esquema SQLite.
+
+'schema.sql' es el esquema base (versión 0). Cada cambio posterior es un script
+'NNNN_descripcion.sql' de este directorio; su número es la versión que queda
+registrada en 'PRAGMA user_version' al aplicarlo. Cada migración se aplica en
+una única transacción 'BEGIN IMMEDIATE', de modo que varios procesos que
+arrancan a la vez no la ejecutan dos veces.
+
+Las sentencias situadas después de la marca '-- @online' deben ser
+'CREATE INDEX'. No se ejecutan en la transacción de la migración: se registran
+en 'migraciones_indices' y se construyen después, una por transacción y con
+pausas entre ellas, para que los escritores puedan intercalar sus commits.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+MIGRATIONS_DIR = os.path.dirname(os.path.abspath(__file__))
+FILENAME_PATTERN = re.compile(r'^(\d{4})_(\w+)\.sql$')
+ONLINE_MARKER = '-- @online'
+ONLINE_STATEMENT = re.compile(
+    r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\b', re.IGNORECASE)
+
+ONLINE_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS migraciones_indices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        version INTEGER NOT NULL,
+        sentencia TEXT NOT NULL,
+        fecha_creacion TIMESTAMP,
+        error TEXT
+    )
+"""
+
+
+def split_statements(script):
+    """Divide un script en sentencias completas (respeta los cuerpos de triggers)."""
+    statements = []
+    buffer = ''
+    for line in script.splitlines(keepends=True):
+        buffer += line
+        if sqlite3.complete_statement(buffer):
+            statements.append(buffer.strip())
+            buffer = ''
+    if _strip_comments(buffer):
+        statements.append(buffer.strip())
+    return [_strip_comments(stmt) for stmt in statements if _strip_comments(stmt)]
+
+
+def _strip_comments(sql):
+    return '\n'.join(line for line in sql.splitlines()
+                     if not line.strip().startswith('--')).strip()
+
+
+class Migration:
+    """Un script de migración versionado."""
+
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+        with open(path, encoding='utf8') as f:
+            script = f.read()
+
+        transactional, _, online = script.partition(ONLINE_MARKER)
+        self.statements = split_statements(transactional)
+        self.online_statements = split_statements(online)
+        for stmt in self.online_statements:
+            if not ONLINE_STATEMENT.match(stmt):
+                raise ValueError(
+                    f"La migración {self.filename} solo admite 'CREATE INDEX' después de '{ONLINE_MARKER}'.")
+
+    @property
+    def filename(self):
+        return os.path.basename(self.path)
+
+    def __repr__(self):
+        return f"<Migration {self.version:04d} {self.name}>"
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """Devuelve las migraciones del directorio ordenadas por versión."""
+    migrations = {}
+    for filename in sorted(os.listdir(directory)):
+        match = FILENAME_PATTERN.match(filename)
+        if not match:
+            continue
+        version = int(match.group(1))
+        if version in migrations:
+            raise ValueError(f"Versión de migración duplicada: {version:04d}.")
+        migrations[version] = Migration(
+            version, match.group(2), os.path.join(directory, filename))
+    return [migrations[v] for v in sorted(migrations)]
+
+
+class MigrationRunner:
+    """Aplica las migraciones pendientes sobre una conexión dedicada."""
+
+    def __init__(self, conn, directory=MIGRATIONS_DIR, logger=None):
+        self.conn = conn
+        self.migrations = discover_migrations(directory)
+        self.logger = logger
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.info(message)
+
+    def current_version(self):
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def head(self):
+        return self.migrations[-1].version if self.migrations else 0
+
+    def pending(self):
+        current = self.current_version()
+        return [m for m in self.migrations if m.version > current]
+
+    def pending_online(self):
+        if not self._has_online_table():
+            return []
+        return self.conn.execute(
+            "SELECT id, version, sentencia, error FROM migraciones_indices "
+            "WHERE fecha_creacion IS NULL ORDER BY id").fetchall()
+
+    def _has_online_table(self):
+        return self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'migraciones_indices'"
+        ).fetchone() is not None
+
+    def upgrade(self, dry_run=False):
+        """
+        Aplica las migraciones pendientes en orden y devuelve la lista de las
+        aplicadas (o de las que se aplicarían, en modo 'dry_run').
+        """
+        pending = self.pending()
+        if dry_run or not pending:
+            return pending
+
+        self.conn.execute(ONLINE_TABLE_SQL)
+        self.conn.commit()
+
+        applied = []
+        for migration in pending:
+            if self._apply(migration):
+                applied.append(migration)
+        return applied
+
+    def _apply(self, migration):
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Otro proceso pudo aplicarla mientras se esperaba el bloqueo.
+            if self.current_version() >= migration.version:
+                conn.rollback()
+                return False
+            for stmt in migration.statements:
+                conn.execute(stmt)
+            conn.executemany(
+                "INSERT INTO migraciones_indices (version, sentencia) VALUES (?, ?)",
+                [(migration.version, stmt) for stmt in migration.online_statements])
+            conn.execute(f"PRAGMA user_version = {migration.version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self._log(
+            f"Migración {migration.version:04d} '{migration.name}' aplicada.")
+        return True
+
+    def build_online_indexes(self, pause=0.5):
+        """
+        Construye los índices pendientes, uno por transacción. Tras cada uno
+        se hace un checkpoint pasivo del WAL y una pausa de 'pause' segundos
+        para que las escrituras de la aplicación no esperen demasiado.
+        Devuelve el número de índices creados.
+        """
+        built = 0
+        for row in self.pending_online():
+            index_id, sentencia = row[0], row[2]
+            start = time.perf_counter()
+            try:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self.conn.execute(sentencia)
+                self.conn.execute(
+                    "UPDATE migraciones_indices SET fecha_creacion = CURRENT_TIMESTAMP, error = NULL WHERE id = ?",
+                    (index_id,))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                try:
+                    self.conn.execute(
+                        "UPDATE migraciones_indices SET error = ? WHERE id = ?", (str(e), index_id))
+                    self.conn.commit()
+                except sqlite3.Error:
+                    self.conn.rollback()
+                if self.logger is not None:
+                    self.logger.error(
+                        f"Error al crear el índice en línea '{sentencia}': {e}")
+                continue
+
+            built += 1
+            self._log(
+                f"Índice creado en {time.perf_counter() - start:.2f}s: {sentencia}")
+            self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            if pause:
+                time.sleep(pause)
+        return built
+
+
+def upgrade_database(app, dry_run=False, online='inline', pause=0.5):
+    """
+    Aplica las migraciones pendientes de la aplicación con una conexión
+    dedicada. 'online' indica cómo se construyen los índices en línea:
+    'inline' (en el mismo hilo), 'background' (en un hilo demonio) o 'skip'.
+    Devuelve la lista de migraciones aplicadas (o pendientes, con 'dry_run').
+    """
+    manager = app.extensions['sqlite']
+    conn = manager._connect(instrumented=False)
+    background = False
+    try:
+        runner = MigrationRunner(conn, logger=app.logger)
+        applied = runner.upgrade(dry_run=dry_run)
+        if dry_run or online == 'skip':
+            return applied
+        if online == 'inline':
+            runner.build_online_indexes(pause=pause)
+        elif runner.pending_online():
+            threading.Thread(target=_build_in_background, args=(app, runner, pause),
+                             name='migraciones-indices', daemon=True).start()
+            background = True
+        return applied
+    finally:
+        if not background:
+            manager._discard(conn)
+
+
+def _build_in_background(app, runner, pause):
+    try:
+        runner.build_online_indexes(pause=pause)
+    except Exception as e:
+        app.logger.error(f"Error al construir los índices en línea: {e}")
+    finally:
+        app.extensions['sqlite']._discard(runner.conn)
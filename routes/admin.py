@@ -15,6 +15,10 @@ import services.user_service as user_s
 import services.report_service as report_s
 import services.alias_service as alias_s
 import services.system_service as system_s
+import services.maintenance_service as maintenance_s
+import services.email_outbox_service as email_outbox_s
+import services.dashboard_service as dashboard_s
+import services.main_service as main_s
 from . import roles_required
 from db import log_action
 
@@ -169,10 +173,13 @@ def importar_alias():
 @admin_bp.route('/eficiencia')
 @roles_required('ADMINISTRADOR')
 def eficiencia():
-    data, error = system_s.get_efficiency_data()
+    data, error = system_s.get_efficiency_data(
+        request.args.get('date_start'), request.args.get('date_end'))
     if error:
         flash(error, 'danger')
-        return render_template('admin/eficiencia.html', titulo="Análisis de Eficiencia", kpis={}, charts_data={}, slow_connections=[], filters={})
+        return render_template('admin/eficiencia.html', titulo="Análisis de Eficiencia", kpis={}, charts_data={},
+                               time_in_state={}, slow_connections=[],
+                               filters={'start': request.args.get('date_start'), 'end': request.args.get('date_end')})
     return render_template('admin/eficiencia.html', titulo="Análisis de Eficiencia", **data)
 
 
@@ -196,6 +203,44 @@ def clear_logs():
     return redirect(url_for('admin.logs'))
 
 
+@admin_bp.route('/rendimiento')
+@roles_required('ADMINISTRADOR')
+def rendimiento():
+    perfiles, error = system_s.get_request_profiles()
+    if error:
+        flash(error, 'info')
+    consultas_lentas, error = system_s.get_slow_queries()
+    if error:
+        flash(error, 'info')
+    mantenimientos, error = maintenance_s.get_maintenance_runs()
+    if error:
+        flash(error, 'danger')
+    correo, error = email_outbox_s.get_outbox_stats()
+    if error:
+        flash(error, 'danger')
+    return render_template('admin/rendimiento.html', perfiles=perfiles,
+                           consultas_lentas=consultas_lentas, mantenimientos=mantenimientos,
+                           correo=correo, cache_dashboard=dashboard_s.get_dashboard_cache_stats(),
+                           cache_busqueda=main_s.get_search_cache_stats(),
+                           titulo="Rendimiento de Solicitudes")
+
+
+@admin_bp.route('/rendimiento/clear', methods=['POST'])
+@roles_required('ADMINISTRADOR')
+def clear_rendimiento():
+    success, message = system_s.clear_request_profiles(g.user['id'])
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('admin.rendimiento'))
+
+
+@admin_bp.route('/rendimiento/consultas/clear', methods=['POST'])
+@roles_required('ADMINISTRADOR')
+def clear_consultas_lentas():
+    success, message = system_s.clear_slow_queries(g.user['id'])
+    flash(message, 'success' if success else 'danger')
+    return redirect(url_for('admin.rendimiento'))
+
+
 @admin_bp.route('/storage')
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def storage_management():
@@ -307,7 +352,11 @@ def gestionar_permisos_proyecto(proyecto_id):
     if form.validate_on_submit():
         usuarios_asignados = request.form.getlist('usuarios_asignados')
         # Here I should call a service to update the permissions
+        anteriores = dal.get_users_for_project(proyecto_id)
         dal.assign_users_to_project(proyecto_id, usuarios_asignados)
+        dashboard_s.invalidate_dashboard(
+            anteriores | {int(user_id) for user_id in usuarios_asignados},
+            dashboard_s.CONNECTION_SECTIONS)
         flash('Permisos del proyecto actualizados con éxito.', 'success')
         return redirect(url_for('admin.gestionar_permisos_proyecto', proyecto_id=proyecto_id))
 
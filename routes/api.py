@@ -1,12 +1,17 @@
 import json
-import os
-import re
-from flask import Blueprint, jsonify, request, g, current_app, session
-from db import get_db
+from flask import (Blueprint, jsonify, request, g, current_app, session, Response,
+                   render_template)
+from db import get_db, get_read_db
 from . import roles_required
 from services.connection_service import process_connection_state_transition
 from utils.config_loader import load_conexiones_config, load_perfiles_config
 from dal.sqlite_dal import SQLiteDAL
+from utils.user_context import invalidate_user_context
+import services.notification_service as notification_s
+import services.event_service as event_s
+import services.dashboard_service as dashboard_s
+import services.main_service as main_s
+import services.profile_search_service as profile_search_s
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
@@ -43,81 +48,29 @@ def get_perfiles():
 @api_bp.route('/perfiles/buscar')
 @roles_required('ADMINISTRADOR', 'REALIZADOR', 'SOLICITANTE', 'APROBADOR')
 def buscar_perfiles():
+    """Sugerencias de perfiles para el autocompletado, desde el índice en memoria."""
     query = request.args.get('q', '').strip()
     if not query:
         return jsonify([])
+    return jsonify(profile_search_s.search_profiles(query))
 
-    db = get_db()
-    cursor = db.cursor()
-
-    resultados = []
-    added_profiles = set()
-
-    # --- Hybrid Search Approach ---
-    # 1. Fast FTS search for general matching
-    try:
-        term = query.replace('"', '""')
-        fts_query = f'"{term}"*'
-        sql_fts = """
-            SELECT ap.nombre_perfil, ap.alias
-            FROM alias_perfiles_fts fts
-            JOIN alias_perfiles ap ON fts.rowid = ap.id
-            WHERE fts.alias_perfiles_fts MATCH ?
-        """
-        cursor.execute(sql_fts, (fts_query,))
-        for row in cursor.fetchall():
-            if row['nombre_perfil'] not in added_profiles:
-                label = f"{row['alias']} ({row['nombre_perfil']})" if row['alias'] else row['nombre_perfil']
-                resultados.append(
-                    {'label': label, 'value': row['nombre_perfil']})
-                added_profiles.add(row['nombre_perfil'])
-    except Exception as e:
-        current_app.logger.warning(
-            f"FTS search failed for query '{query}'. Error: {e}")
-
-    # 2. Slower, original LIKE query to catch normalization edge cases
-    try:
-        normalized_query = re.sub(r'[ -]', '', query).lower()
-        like_param = f'%{normalized_query}%'
-        sql_like = """
-            SELECT nombre_perfil, alias FROM alias_perfiles
-            WHERE REPLACE(REPLACE(nombre_perfil, ' ', ''), '-', '') LIKE ?
-               OR REPLACE(REPLACE(alias, ' ', ''), '-', '') LIKE ?
-        """
-        cursor.execute(sql_like, (like_param, like_param))
-        for row in cursor.fetchall():
-            if row['nombre_perfil'] not in added_profiles:
-                label = f"{row['alias']} ({row['nombre_perfil']})" if row['alias'] else row['nombre_perfil']
-                resultados.append(
-                    {'label': label, 'value': row['nombre_perfil']})
-                added_profiles.add(row['nombre_perfil'])
-    except Exception as e:
-        current_app.logger.error(
-            f"LIKE search failed for query '{query}'. Error: {e}")
 
-    cursor.close()
-
-    # The secondary search in the JSON file remains for now, as it's a separate issue.
-    # The primary performance bottleneck (DB query) is now fixed.
-    json_path = os.path.join(current_app.root_path,
-                             'perfiles_propiedades.json')
-    try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            perfiles_props = json.load(f)
-
-        for nombre_perfil_key in perfiles_props.keys():
-            if nombre_perfil_key not in added_profiles:
-                normalized_key_for_search = re.sub(
-                    r'[ -]', '', nombre_perfil_key).lower()
-                if normalized_query in normalized_key_for_search:
-                    resultados.append(
-                        {'label': nombre_perfil_key, 'value': nombre_perfil_key})
-                    added_profiles.add(nombre_perfil_key)
-    except (FileNotFoundError, json.JSONDecodeError):
-        current_app.logger.error(
-            "API Error: No se pudo cargar 'perfiles_propiedades.json' para sugerencias.")
-
-    return jsonify(sorted(resultados, key=lambda x: x['label'])[:10])
+@api_bp.route('/conexiones/buscar')
+@roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
+def buscar_conexiones():
+    """
+    Búsqueda de conexiones en JSON. Acepta 'q', 'cursor' ('next_cursor' de la
+    página anterior), 'limit' y los filtros 'estado', 'tipo' y 'proyecto_id'.
+    Los fragmentos vienen en HTML escapado con las coincidencias en <mark>.
+    """
+    data, error = main_s.search_conexiones(
+        request.args.get('q', ''),
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit', main_s.SEARCH_PAGE_SIZE, type=int),
+        filtros=main_s.get_search_filters(request.args))
+    if error:
+        return jsonify({'error': error}), 500
+    return jsonify(data)
 
 
 @api_bp.route('/set-theme', methods=['POST'])
@@ -131,23 +84,64 @@ def set_theme():
     return jsonify({'success': False, 'error': 'Datos de tema inválidos'}), 400
 
 
+@api_bp.route('/notificaciones')
+@roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
+def get_notificaciones():
+    """
+    Página de notificaciones del usuario para el menú de la barra superior.
+    Acepta 'cursor' (id de la última notificación recibida), 'limit' y
+    'todas=1' para incluir también las ya leídas.
+    """
+    data, error = notification_s.get_notifications(
+        g.user['id'],
+        cursor=request.args.get('cursor', type=int),
+        limit=request.args.get('limit', notification_s.DEFAULT_PAGE_SIZE, type=int),
+        unread_only=request.args.get('todas') != '1'
+    )
+    if error:
+        return jsonify({'error': error}), 500
+    return jsonify(data)
+
+
 @api_bp.route('/notificaciones/marcar-leidas', methods=['POST'])
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def marcar_notificaciones_leidas():
-    db = get_db()
-    sql = 'UPDATE notificaciones SET leida = 1 WHERE usuario_id = ? AND leida = 0'
-    cursor = db.cursor()
-    try:
-        cursor.execute(sql, (g.user['id'],))
-        db.commit()
-        return jsonify({'success': True})
-    except Exception as e:
-        db.rollback()
-        current_app.logger.error(
-            f"API Error: No se pudieron marcar las notificaciones como leídas para el usuario {g.user['id']}. Error: {e}")
-        return jsonify({'success': False, 'error': 'Error en la base de datos'}), 500
-    finally:
-        cursor.close()
+    payload = request.get_json(silent=True) or {}
+    ids = [int(i) for i in payload.get('ids', []) if str(i).isdigit()]
+    success, result = notification_s.mark_notifications_read(
+        g.user['id'], ids or None)
+    if not success:
+        return jsonify({'success': False, 'error': result}), 500
+    invalidate_user_context(g.user['id'])
+    return jsonify({'success': True, 'marcadas': result})
+
+
+@api_bp.route('/stream')
+@roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
+def stream_eventos():
+    """
+    Canal Server-Sent Events con las notificaciones del usuario y los cambios
+    de las conexiones de sus proyectos. El cliente reanuda con la cabecera
+    'Last-Event-ID' que envía EventSource al reconectar.
+    """
+    user_id = g.user['id']
+    proyecto_ids = None
+    if 'ADMINISTRADOR' not in g.user['roles']:
+        proyecto_ids = SQLiteDAL().get_user_project_ids(user_id)
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+
+    stream = event_s.open_stream(user_id, proyecto_ids, last_event_id)
+    if stream is None:
+        response = jsonify({'error': 'Demasiadas conexiones en tiempo real.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+
+    response = Response(stream, mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # Evita que un proxy (nginx, IIS ARR) acumule la respuesta.
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 
 @api_bp.route('/dashboard/project-details')
@@ -159,7 +153,7 @@ def get_project_details_for_chart():
     if not proyecto_id or not estado:
         return jsonify({'error': 'Parámetros incompletos'}), 400
 
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
 
     try:
@@ -178,6 +172,42 @@ def get_project_details_for_chart():
         cursor.close()
 
 
+@api_bp.route('/dashboard/widgets/<widget_id>')
+@roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
+def get_dashboard_widget(widget_id):
+    """
+    Calcula y renderiza un único widget del dashboard. Devuelve su HTML y los
+    datos que necesitan sus gráficos para que main.js los cargue en paralelo.
+    """
+    user_roles = session.get('user_roles', [])
+    try:
+        filters = dashboard_s.get_dashboard_filters(request.args)
+        dashboard_data, error = dashboard_s.get_widget_data(widget_id, g.user['id'], user_roles, filters)
+        if error:
+            return jsonify({'error': error}), 404
+
+        html = render_template(
+            dashboard_s.WIDGETS[widget_id]['template'],
+            dashboard_data=dashboard_data,
+            user_roles=user_roles,
+            filters=filters,
+            all_projects_for_filter=dashboard_data['all_projects_for_filter'])
+    except Exception as e:
+        current_app.logger.error(
+            f"Error al cargar el widget '{widget_id}' del dashboard para usuario {g.user['id']}: {e}")
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+    data = {}
+    if widget_id == 'my-performance-panel':
+        data['performanceChart'] = dashboard_data['my_performance_chart']
+    elif widget_id == 'my-projects-summary-panel':
+        data['projectsSummary'] = dashboard_data['my_projects_summary']
+    elif widget_id == 'admin-panel':
+        data['estados'] = dashboard_data['charts'].get('estados') or {}
+        data['meses'] = dashboard_data['charts'].get('conexiones_mes') or []
+    return jsonify({'widget': widget_id, 'html': html.strip(), 'data': data})
+
+
 @api_bp.route('/conexiones/<int:conexion_id>/cambiar_estado_rapido', methods=['POST'])
 @roles_required('ADMINISTRADOR', 'REALIZADOR', 'APROBADOR')
 def cambiar_estado_rapido(conexion_id):
@@ -219,6 +249,7 @@ def save_dashboard_preferences():
     try:
         cursor.execute(sql, (g.user['id'], widgets_config))
         db.commit()
+        dashboard_s.invalidate_dashboard([g.user['id']], ['preferencias'])
         return jsonify({'success': True, 'message': 'Preferencias del dashboard guardadas con éxito.'})
     except Exception as e:
         db.rollback()
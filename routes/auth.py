@@ -7,6 +7,7 @@ from db import get_db, log_action
 from . import roles_required
 from forms import LoginForm, ProfileForm
 from dal.sqlite_dal import SQLiteDAL
+from utils.user_context import invalidate_user_context
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 dal = SQLiteDAL()
@@ -85,13 +86,19 @@ def perfil():
             # Actualizar preferencias de notificación
             user_prefs = dal.get_notification_preferences(g.user['id'])
             initial_email_notif_estado = user_prefs['email_notif_estado'] if user_prefs else True
+            initial_email_resumen = bool(user_prefs['email_resumen']) if user_prefs else False
             if initial_email_notif_estado != form.email_notif_estado.data:
-                dal.upsert_notification_preferences(
-                    g.user['id'], form.email_notif_estado.data)
                 changes['email_notif_estado'] = {
                     'old': initial_email_notif_estado, 'new': form.email_notif_estado.data}
+            if initial_email_resumen != form.email_resumen.data:
+                changes['email_resumen'] = {
+                    'old': initial_email_resumen, 'new': form.email_resumen.data}
+            if 'email_notif_estado' in changes or 'email_resumen' in changes:
+                dal.upsert_notification_preferences(
+                    g.user['id'], form.email_notif_estado.data, form.email_resumen.data)
 
             db.commit()
+            invalidate_user_context(g.user['id'])
 
             if changes:
                 log_action('ACTUALIZAR_PERFIL', g.user['id'], 'usuarios', g.user['id'],
@@ -110,5 +117,6 @@ def perfil():
         form.email.data = g.user['email']
         user_prefs = dal.get_notification_preferences(g.user['id'])
         form.email_notif_estado.data = user_prefs['email_notif_estado'] if user_prefs else True
+        form.email_resumen.data = bool(user_prefs['email_resumen']) if user_prefs else False
 
     return render_template('perfil.html', titulo="Mi Perfil", form=form)
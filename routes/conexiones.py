@@ -4,7 +4,7 @@ from flask import (Blueprint, render_template, request, redirect, url_for, g,
                    flash, abort, send_from_directory, session, current_app)
 from . import roles_required
 from forms import ConnectionForm
-from db import get_db, log_action
+from db import get_read_db, log_action
 from dal.sqlite_dal import SQLiteDAL
 from services.computos_service import get_computos_results, calculate_and_save_computos
 import services.connection_service as cs
@@ -136,7 +136,7 @@ def eliminar_conexion(conexion_id):
 @conexiones_bp.route('/<int:proyecto_id>/importar', methods=['GET', 'POST'])
 @roles_required('ADMINISTRADOR', 'REALIZADOR')
 def importar_conexiones(proyecto_id):
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
     try:
         cursor.execute('SELECT * FROM proyectos WHERE id = ?', (proyecto_id,))
@@ -309,7 +309,7 @@ def reporte_computos(conexion_id):
 @conexiones_bp.route('/<int:conexion_id>/reporte')
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def reporte_conexion(conexion_id):
-    db = get_db()
+    db = get_read_db()
     conexion = cs.get_conexion(conexion_id)
 
     cursor = db.cursor()
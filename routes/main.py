@@ -1,9 +1,10 @@
-from datetime import datetime, timedelta
 from flask import (Blueprint, render_template, g, redirect,
                    url_for, request, session, flash)
 from . import roles_required
-from services.dashboard_service import get_dashboard_data
-from services.main_service import get_catalogo_data, search_conexiones
+from services.dashboard_service import (
+    get_dashboard_data, get_dashboard_filters, INLINE_WIDGETS)
+from services.main_service import (
+    get_catalogo_data, get_search_filters, search_conexiones)
 
 main_bp = Blueprint('main', __name__)
 
@@ -19,13 +20,11 @@ def dashboard():
     user_id = g.user['id']
     user_roles = session.get('user_roles', [])
 
-    date_start_str = request.args.get(
-        'date_start', (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'))
-    date_end_str = request.args.get(
-        'date_end', datetime.now().strftime('%Y-%m-%d'))
-    filters = {'start': date_start_str, 'end': date_end_str}
+    filters = get_dashboard_filters(request.args)
 
-    dashboard_data = get_dashboard_data(user_id, user_roles)
+    # Solo se calculan aquí los widgets ligeros; el resto los pide main.js.
+    dashboard_data = get_dashboard_data(
+        user_id, user_roles, widget_ids=INLINE_WIDGETS, filters=filters)
 
     return render_template(
         'dashboard.html',
@@ -56,10 +55,16 @@ def catalogo():
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def buscar():
     query = request.args.get('q', '')
-    resultados = search_conexiones(query) if query else []
+    filtros = get_search_filters(request.args)
+    data, error = search_conexiones(
+        query, cursor=request.args.get('cursor'), filtros=filtros)
+    if error:
+        flash(error, 'danger')
 
     return render_template(
         'buscar.html',
-        resultados=resultados,
+        busqueda=data,
+        resultados=data['resultados'],
+        filtros=filtros,
         query=query,
         titulo=f"Resultados para '{query}'" if query else "Buscar")
@@ -3,9 +3,10 @@ from flask import (
 )
 from werkzeug.exceptions import abort
 
-from db import get_db, log_action
+from db import get_db, get_read_db, log_action
 from . import roles_required
 from forms import ProjectForm
+from services.dashboard_service import clear_dashboard_cache
 
 proyectos_bp = Blueprint('proyectos', __name__, url_prefix='/proyectos')
 
@@ -13,7 +14,7 @@ proyectos_bp = Blueprint('proyectos', __name__, url_prefix='/proyectos')
 @proyectos_bp.route('/')
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def listar_proyectos():
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
     try:
         user_roles = session.get('user_roles', [])
@@ -47,7 +48,7 @@ def listar_proyectos():
 @proyectos_bp.route('/<int:proyecto_id>')
 @roles_required('ADMINISTRADOR', 'APROBADOR', 'REALIZADOR', 'SOLICITANTE')
 def detalle_proyecto(proyecto_id):
-    db = get_db()
+    db = get_read_db()
     cursor = db.cursor()
 
     try:
@@ -99,6 +100,7 @@ def nuevo_proyecto():
                     sql, (form.nombre.data, form.descripcion.data, g.user['id']))
                 new_project_id = cursor.lastrowid
                 db.commit()
+                clear_dashboard_cache()
                 log_action('CREAR_PROYECTO', g.user['id'], 'proyectos',
                            new_project_id, f"Proyecto '{form.nombre.data}' creado.")
                 flash('Proyecto creado con éxito.', 'success')
@@ -133,6 +135,7 @@ def editar_proyecto(proyecto_id):
                 cursor.execute(update_sql, (form.nombre.data,
                                form.descripcion.data, proyecto_id))
                 db.commit()
+                clear_dashboard_cache()
                 log_action('EDITAR_PROYECTO', g.user['id'], 'proyectos',
                            proyecto_id, f"Proyecto '{form.nombre.data}' actualizado.")
                 flash('Proyecto actualizado con éxito.', 'success')
@@ -161,6 +164,7 @@ def eliminar_proyecto(proyecto_id):
             cursor.execute(
                 'DELETE FROM proyectos WHERE id = ?', (proyecto_id,))
             db.commit()
+            clear_dashboard_cache()
             log_action('ELIMINAR_PROYECTO', g.user['id'], 'proyectos',
                        proyecto_id, f"Proyecto '{proyecto['nombre']}' eliminado.")
             flash(
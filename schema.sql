@@ -2,6 +2,10 @@
 -- Hepta-Conexiones - Esquema de Base de Datos para SQLite
 -- Versión: 9.0
 -- Adaptado para SQLite
+--
+-- Este archivo es el esquema base (PRAGMA user_version = 0). Los cambios
+-- posteriores se añaden como scripts versionados en 'migrations/' y se aplican
+-- con 'flask db-upgrade' (o automáticamente al iniciar la aplicación).
 -- ===================================================================================
 
 -- -----------------------------------------------------
@@ -1,6 +1,7 @@
 import pandas as pd
 from dal.sqlite_dal import SQLiteDAL
 from db import log_action
+from services.profile_search_service import invalidate_profile_index
 
 
 def get_all_aliases():
@@ -19,6 +20,7 @@ def create_alias(form, user_id):
 
     try:
         alias_id = dal.create_alias(nombre_perfil, alias, norma)
+        invalidate_profile_index()
         log_action('CREAR_ALIAS_PERFIL', user_id, 'alias_perfiles', alias_id,
                    f"Alias '{alias}' para perfil '{nombre_perfil}' (Norma: {norma}) creado.")
         return True, 'Alias guardado con éxito.'
@@ -39,6 +41,7 @@ def update_alias(alias_id, form_data, user_id):
 
     try:
         dal.update_alias(alias_id, nombre_perfil, alias, norma)
+        invalidate_profile_index()
         # log changes
         return True, 'Alias actualizado con éxito.'
     except Exception:
@@ -53,6 +56,7 @@ def delete_alias(alias_id, user_id):
 
     try:
         dal.delete_alias(alias_id)
+        invalidate_profile_index()
         log_action('ELIMINAR_ALIAS_PERFIL', user_id, 'alias_perfiles', alias_id,
                    f"Alias '{alias['alias']}' (Norma: {alias['norma']}) para perfil '{alias['nombre_perfil']}' eliminado.")
         return True, 'Alias eliminado con éxito.'
@@ -100,6 +104,8 @@ def import_aliases(file):
                 error_rows.append(
                     f"Fila {index + 2}: Error al procesar - {row_e}")
 
+        if imported_count or updated_count:
+            invalidate_profile_index()
         return imported_count, updated_count, error_rows, None
     except pd.errors.EmptyDataError:
         return 0, 0, [], 'El archivo está vacío.'
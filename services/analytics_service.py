@@ -0,0 +1,160 @@
+"""
+Analítica del tiempo que pasan las conexiones en cada estado.
+
+Los intervalos salen de 'historial_estados' (ver 'SQLiteDAL.get_time_by_state')
+y se resumen por estado, por proyecto y por usuario con la media y los
+percentiles p50/p90/p99, en horas. El usuario de un intervalo es quien sacó la
+conexión de ese estado: el realizador que la toma o la entrega, o el aprobador
+que la aprueba o la rechaza. Los resultados se guardan por rango de fechas en
+una caché LRU con caducidad, de modo que un rango que incluye el día de hoy
+puede ir hasta 'ANALYTICS_CACHE_TTL' segundos por detrás.
+
+También programa el job nocturno que recalcula 'metricas_diarias', el
+resumen por día, proyecto, usuario y estado que leen las gráficas diarias y
+mensuales.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from dal.sqlite_dal import SQLiteDAL
+from utils.lru_cache import LRUCache
+
+CACHE_TIMEOUT = 300
+PERCENTILES = (50, 90, 99)
+ROLLUP_JOB_ID = 'metricas_diarias'
+
+# Aplicación registrada al programar el job (ver 'maintenance_service').
+_app = None
+
+# Estados con permanencia medible (APROBADO es final), en orden del flujo.
+ESTADOS = {
+    'SOLICITADO': 'Solicitado',
+    'EN_PROCESO': 'En Proceso',
+    'REALIZADO': 'Realizado',
+}
+
+
+def init_app(app):
+    app.extensions['analytics_cache'] = LRUCache(
+        max_entries=app.config.get('ANALYTICS_CACHE_MAX_ENTRIES', 64),
+        ttl=app.config.get('ANALYTICS_CACHE_TTL', CACHE_TIMEOUT))
+
+
+def _get_cache():
+    return current_app.extensions['analytics_cache']
+
+
+def clear_analytics_cache():
+    _get_cache().clear()
+
+
+def percentile(sorted_values, p):
+    """Percentil 'p' (0-100) por rango más cercano de una lista ya ordenada."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    """Número de intervalos, media y percentiles (en horas, con un decimal)."""
+    values = sorted(values)
+    resumen = {'n': len(values), 'media': round(sum(values) / len(values), 1) if values else None}
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        resumen[f'p{p}'] = round(value, 1) if value is not None else None
+    return resumen
+
+
+def _group(rows, key):
+    groups = defaultdict(list)
+    for row in rows:
+        groups[key(row)].append(row['horas'])
+    return groups
+
+
+def _compute_time_in_state(start, end):
+    rows = [row for row in SQLiteDAL().get_time_by_state(start, end) if row['estado'] in ESTADOS]
+    orden = list(ESTADOS)
+
+    por_estado = _group(rows, lambda row: row['estado'])
+    por_proyecto = _group(rows, lambda row: (row['proyecto_nombre'], row['estado']))
+    por_usuario = _group(rows, lambda row: (row['usuario_nombre'] or 'Desconocido', row['estado']))
+
+    return {
+        'por_estado': [
+            {'estado': estado, 'etiqueta': ESTADOS[estado], **summarize(por_estado[estado])}
+            for estado in orden],
+        'por_proyecto': [
+            {'proyecto': proyecto, 'estado': estado, 'etiqueta': ESTADOS[estado], **summarize(values)}
+            for (proyecto, estado), values in sorted(
+                por_proyecto.items(), key=lambda item: (item[0][0], orden.index(item[0][1])))],
+        'por_usuario': [
+            {'usuario': usuario, 'estado': estado, 'etiqueta': ESTADOS[estado], **summarize(values)}
+            for (usuario, estado), values in sorted(
+                por_usuario.items(), key=lambda item: (item[0][0], orden.index(item[0][1])))],
+    }
+
+
+def get_time_in_state(start, end):
+    """
+    Tiempo en cada estado de los intervalos que terminaron entre 'start' y
+    'end' (fechas 'YYYY-MM-DD', ambas incluidas). Devuelve (datos, error).
+    """
+    try:
+        data = _get_cache().get_or_compute(
+            ('tiempo_por_estado', start, end), lambda: _compute_time_in_state(start, end))
+        return data, None
+    except Exception as e:
+        current_app.logger.error(f"Error al calcular el tiempo por estado ({start} - {end}): {e}")
+        return None, "No se pudo calcular el tiempo por estado."
+
+
+def rebuild_daily_metrics(days=None):
+    """
+    Recalcula 'metricas_diarias' para los últimos 'days' días (por defecto
+    'METRICAS_DIARIAS_DIAS', 2) desde el historial; con days=0 la reconstruye
+    entera. El trigger de 'historial_estados' la mantiene al día entre
+    ejecuciones; esta pasada corrige lo que se haya escrito por otras vías.
+    Devuelve (filas, error).
+    """
+    if days is None:
+        days = current_app.config.get('METRICAS_DIARIAS_DIAS', 2)
+    desde = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d') if days else '0000-00-00'
+    dal = SQLiteDAL()
+    try:
+        with dal.transaction():
+            count = dal.rebuild_metricas_diarias(desde)
+    except Exception as e:
+        current_app.logger.error(f"Error al recalcular las métricas diarias desde {desde}: {e}")
+        return 0, "No se pudieron recalcular las métricas diarias."
+    clear_analytics_cache()
+    return count, None
+
+
+def schedule_rollup_job(app):
+    """Registra el job nocturno de 'metricas_diarias' en el scheduler de la aplicación."""
+    global _app
+    _app = app
+    hour = app.config.get('METRICAS_DIARIAS_HORA', 2)
+    try:
+        app.scheduler.add_job(
+            id=ROLLUP_JOB_ID,
+            func='services.analytics_service:scheduled_rollup_job',
+            trigger='cron',
+            hour=hour,
+            minute=30,
+            replace_existing=True
+        )
+        app.logger.info(f"Métricas diarias programadas cada noche a las {hour}:30.")
+    except Exception as e:
+        app.logger.error(
+            f"Error al programar las métricas diarias: {e}", exc_info=True)
+
+
+def scheduled_rollup_job():
+    if _app is None:
+        return
+    with _app.app_context():
+        rebuild_daily_metrics()
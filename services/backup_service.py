@@ -0,0 +1,217 @@
+import os
+import re
+import gzip
+import time
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+from datetime import datetime, timedelta
+from flask import current_app
+
+
+BACKUP_JOB_ID = 'db_backup'
+# Las instantáneas llevan microsegundos para que dos copias del mismo segundo
+# no se pisen; se siguen reconociendo las antiguas, sin ellos.
+SNAPSHOT_PATTERN = re.compile(r'^heptaconexiones-(\d{8}-\d{6})(?:-(\d{6}))?\.db\.gz$')
+
+# Aplicación registrada al programar el job (ver maintenance_service).
+_app = None
+
+
+def get_backup_folder():
+    return current_app.config.get(
+        'BACKUP_FOLDER', os.path.join(current_app.instance_path, 'backups'))
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _integrity_check(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def create_backup(folder=None):
+    """
+    Crea una copia en caliente de la base de datos con 'VACUUM INTO' en una
+    conexión dedicada. Se hace en una única transacción de lectura: con WAL
+    los escritores no esperan y, a diferencia de la API de backup por pasos,
+    sus escrituras no obligan a reiniciar la copia.
+    El resultado se comprime con gzip, se guarda con su suma SHA-256 en un
+    archivo '.sha256' y se verifica antes de aplicar la retención.
+    Devuelve (ruta, mensaje de error).
+    """
+    folder = folder or get_backup_folder()
+    manager = current_app.extensions['sqlite']
+    if manager.path == ':memory:':
+        return None, "No se puede respaldar una base de datos en memoria."
+
+    os.makedirs(folder, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    final_path = os.path.join(folder, f"heptaconexiones-{stamp}.db.gz")
+    raw_fd, raw_path = tempfile.mkstemp(suffix='.db', dir=folder)
+    os.close(raw_fd)
+
+    start = time.perf_counter()
+    # No sirve una conexión 'mode=ro': 'VACUUM INTO' abre el destino con los
+    # mismos permisos. La base de origen solo se lee.
+    source = manager._connect(instrumented=False)
+    try:
+        source.execute("VACUUM INTO ?", (raw_path,))
+
+        resultado = _integrity_check(raw_path)
+        if resultado != 'ok':
+            return None, f"La copia no superó 'PRAGMA integrity_check': {resultado}"
+
+        # 'xb': nunca se sobrescribe una instantánea existente.
+        with open(raw_path, 'rb') as src, gzip.open(final_path, 'xb') as dst:
+            shutil.copyfileobj(src, dst)
+        with open(f"{final_path}.sha256", 'w', encoding='utf-8') as f:
+            f.write(f"{_sha256(final_path)}  {os.path.basename(final_path)}\n")
+    except (sqlite3.Error, OSError) as e:
+        current_app.logger.error(f"Error al crear la copia de seguridad: {e}")
+        return None, f"Error al crear la copia de seguridad: {e}"
+    finally:
+        manager._discard(source)
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+
+    ok, error = verify_backup(final_path)
+    if not ok:
+        return None, error
+
+    current_app.logger.info(
+        f"Copia de seguridad '{os.path.basename(final_path)}' creada y verificada "
+        f"en {time.perf_counter() - start:.2f}s.")
+    return final_path, None
+
+
+def verify_backup(path):
+    """
+    Comprueba que una instantánea sea restaurable: su suma SHA-256 coincide
+    con la registrada y, descomprimida en un archivo temporal y abierta en
+    modo solo lectura, supera 'PRAGMA integrity_check'. Devuelve (ok, error).
+    """
+    checksum_path = f"{path}.sha256"
+    try:
+        with open(checksum_path, encoding='utf-8') as f:
+            expected = f.read().split()[0]
+    except (OSError, IndexError):
+        return False, f"No se encontró la suma de verificación de '{os.path.basename(path)}'."
+
+    if _sha256(path) != expected:
+        return False, f"La suma SHA-256 de '{os.path.basename(path)}' no coincide."
+
+    fd, restored = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        with gzip.open(path, 'rb') as src, open(restored, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        resultado = _integrity_check(restored)
+    except (sqlite3.Error, OSError) as e:
+        return False, f"No se pudo restaurar '{os.path.basename(path)}': {e}"
+    finally:
+        os.remove(restored)
+
+    if resultado != 'ok':
+        return False, f"'{os.path.basename(path)}' no superó 'PRAGMA integrity_check': {resultado}"
+    return True, None
+
+
+def list_backups(folder=None):
+    """Devuelve las instantáneas del directorio, de la más reciente a la más antigua."""
+    folder = folder or get_backup_folder()
+    if not os.path.isdir(folder):
+        return []
+    snapshots = []
+    for filename in os.listdir(folder):
+        match = SNAPSHOT_PATTERN.match(filename)
+        if match:
+            fecha = datetime.strptime(match.group(1), '%Y%m%d-%H%M%S')
+            if match.group(2):
+                fecha = fecha.replace(microsecond=int(match.group(2)))
+            snapshots.append({
+                'path': os.path.join(folder, filename),
+                'fecha': fecha,
+            })
+    return sorted(snapshots, key=lambda s: s['fecha'], reverse=True)
+
+
+def prune_backups(folder=None, keep_last=None, keep_days=None, now=None):
+    """
+    Aplica la retención: se conservan las 'keep_last' instantáneas más
+    recientes y, además, la más reciente de cada día dentro de los últimos
+    'keep_days' días. Devuelve la lista de archivos eliminados.
+    """
+    config = current_app.config
+    keep_last = config.get('BACKUP_KEEP_LAST', 7) if keep_last is None else keep_last
+    keep_days = config.get('BACKUP_KEEP_DAYS', 30) if keep_days is None else keep_days
+    limit = (now or datetime.now()) - timedelta(days=keep_days)
+
+    snapshots = list_backups(folder)
+    keep = {s['path'] for s in snapshots[:keep_last]}
+    seen_days = set()
+    for snapshot in snapshots:
+        day = snapshot['fecha'].date()
+        if snapshot['fecha'] >= limit and day not in seen_days:
+            seen_days.add(day)
+            keep.add(snapshot['path'])
+
+    removed = []
+    for snapshot in snapshots:
+        if snapshot['path'] in keep:
+            continue
+        for path in (snapshot['path'], f"{snapshot['path']}.sha256"):
+            if os.path.exists(path):
+                os.remove(path)
+        removed.append(snapshot['path'])
+    return removed
+
+
+def run_backup():
+    """Crea una instantánea verificada y aplica la retención."""
+    path, error = create_backup()
+    if error:
+        current_app.logger.error(error)
+        return None, error
+    removed = prune_backups()
+    if removed:
+        current_app.logger.info(
+            f"Retención de copias: {len(removed)} instantánea(s) eliminada(s).")
+    return path, None
+
+
+def schedule_backup_job(app):
+    """Registra el job de copias de seguridad en el scheduler de la aplicación."""
+    global _app
+    _app = app
+    hours = app.config.get('BACKUP_INTERVAL_HOURS', 24)
+    try:
+        app.scheduler.add_job(
+            id=BACKUP_JOB_ID,
+            func='services.backup_service:scheduled_backup_job',
+            trigger='interval',
+            hours=hours,
+            replace_existing=True
+        )
+        app.logger.info(
+            f"Copias de seguridad programadas cada {hours} horas.")
+    except Exception as e:
+        app.logger.error(
+            f"Error al programar las copias de seguridad: {e}", exc_info=True)
+
+
+def scheduled_backup_job():
+    if _app is None:
+        return
+    with _app.app_context():
+        run_backup()
@@ -1,8 +1,8 @@
 import bleach
 from dal.sqlite_dal import SQLiteDAL
 from db import log_action
-from services.connection_service import _notify_users
-from db import get_db
+from services.notification_service import notify_users
+from services.event_service import publish_connection_event
 
 
 def add_comment(conexion_id, user_id, user_name, content):
@@ -14,19 +14,21 @@ def add_comment(conexion_id, user_id, user_name, content):
         return False, 'El comentario no puede estar vacío.'
 
     dal = SQLiteDAL()
+    conexion = dal.get_conexion(conexion_id)
+    if conexion is None:
+        return False, 'La conexión no existe.'
     try:
         sanitized_content = bleach.clean(
-            content, tags=bleach.sanitizer.ALLOWED_TAGS + ['p', 'br'], strip=True)
-        dal.create_comentario(conexion_id, user_id, sanitized_content)
+            content, tags=set(bleach.sanitizer.ALLOWED_TAGS) | {'p', 'br'}, strip=True)
+        with dal.transaction():
+            dal.create_comentario(conexion_id, user_id, sanitized_content)
+            notify_users(conexion, f"{user_name} ha comentado.", "#comentarios", [
+                         'SOLICITANTE', 'REALIZADOR', 'APROBADOR', 'ADMINISTRADOR'], exclude_user_id=user_id)
+            publish_connection_event(conexion_id, 'comentario')
 
         log_action('AGREGAR_COMENTARIO', user_id, 'conexiones',
                    conexion_id, "Comentario añadido.")
 
-        # Usamos get_db() para pasar el objeto de conexión a _notify_users
-        db = get_db()
-        _notify_users(db, conexion_id, f"{user_name} ha comentado.", "#comentarios", [
-                      'SOLICITANTE', 'REALIZADOR', 'APROBADOR', 'ADMINISTRADOR'])
-
         return True, 'Comentario añadido.'
     except Exception:
         # En un sistema real, aquí se registraría el error 'e'
@@ -45,7 +47,8 @@ def delete_comment(conexion_id, comentario_id, user_id):
         return False, 'El comentario no existe o no pertenece a esta conexión.'
 
     try:
-        dal.delete_comentario(comentario_id)
+        with dal.transaction():
+            dal.delete_comentario(comentario_id)
         log_action('ELIMINAR_COMENTARIO', user_id, 'comentarios',
                    comentario_id, f"Comentario (ID: {comentario_id}) eliminado.")
         return True, 'Comentario eliminado.'
@@ -1,10 +1,11 @@
 import json
-from flask import current_app, render_template, url_for, g, abort
-from flask_mail import Message
-from extensions import mail
-from db import get_db, log_action
+from flask import current_app, abort
+from db import log_action
 from utils.config_loader import load_conexiones_config
 from dal.sqlite_dal import SQLiteDAL
+from services.notification_service import notify_users
+from services.event_service import publish_connection_event
+from services.dashboard_service import invalidate_for_connection
 
 
 def get_tipologia_config(tipo, subtipo, tipologia_nombre):
@@ -131,16 +132,20 @@ def create_connection(form_data, user_id):
     }
 
     try:
-        new_id = dal.create_conexion(conexion_data)
-        dal.add_historial_estado(new_id, user_id, 'SOLICITADO')
-
+        with dal.transaction():
+            new_id = dal.create_conexion(conexion_data)
+            dal.add_historial_estado(new_id, user_id, 'SOLICITADO')
+            dal.registrar_ciclo_estado(new_id, 'SOLICITADO', user_id)
+            notify_users({'id': new_id, 'proyecto_id': conexion_data['proyecto_id'],
+                          'codigo_conexion': codigo_conexion_final},
+                         f"Nueva conexión '{codigo_conexion_final}' lista para ser tomada.", "",
+                         ['REALIZADOR', 'ADMINISTRADOR'], exclude_user_id=user_id)
+            publish_connection_event(new_id, 'creada', estado='SOLICITADO')
+
+        invalidate_for_connection(conexion_data)
         log_action('CREAR_CONEXION', user_id, 'conexiones', new_id,
                    f"Conexión '{codigo_conexion_final}' creada.")
 
-        db = get_db()
-        _notify_users(db, new_id, f"Nueva conexión '{codigo_conexion_final}' lista para ser tomada.", "", [
-                      'REALIZADOR', 'ADMINISTRADOR'])
-
         return new_id, f'Conexión {codigo_conexion_final} creada con éxito.'
     except Exception as e:
         current_app.logger.error(
@@ -148,61 +153,6 @@ def create_connection(form_data, user_id):
         return None, "Ocurrió un error interno al crear la conexión."
 
 
-def _send_email_notification(recipients, subject, template, **kwargs):
-    """
-    Función auxiliar para enviar notificaciones por correo electrónico de forma asíncrona.
-    """
-    if not recipients:
-        return
-
-    if not current_app.config.get('MAIL_USERNAME'):
-        current_app.logger.warning(
-            "Configuración de correo electrónico no completa. No se enviará email.")
-        return
-
-    msg = Message(subject, recipients=recipients)
-    msg.html = render_template(template, **kwargs)
-
-    def send_async_email(app, msg_obj):
-        with app.app_context():
-            try:
-                mail.send(msg_obj)
-                app.logger.info(
-                    f"Correo enviado a {', '.join(msg_obj.recipients)} con asunto: {msg_obj.subject}")
-            except Exception as e:
-                app.logger.error(
-                    f"Error al enviar correo electrónico a {msg_obj.recipients}: {e}", exc_info=True)
-
-    # Usar el ThreadPoolExecutor de la aplicación para gestionar los hilos
-    current_app.executor.submit(
-        send_async_email, current_app._get_current_object(), msg)
-
-
-def _notify_users(conexion_id, message, url_suffix, roles_to_notify):
-    """Crea notificaciones y envía correos electrónicos a usuarios con roles específicos."""
-    dal = SQLiteDAL()
-    conexion = get_conexion(conexion_id)
-
-    users_to_notify = dal.get_users_for_notification(
-        conexion['proyecto_id'], roles_to_notify)
-
-    for user in users_to_notify:
-        if user['id'] != g.user['id']:
-            full_url = url_for('conexiones.detalle_conexion',
-                               conexion_id=conexion_id, _external=True) + url_suffix
-            dal.create_notification(user['id'], message, full_url, conexion_id)
-
-            if user['email'] and user['email_notif_estado']:
-                _send_email_notification(
-                    recipients=[user['email']],
-                    subject=f"Hepta-Conexiones: Notificación sobre {conexion['codigo_conexion']}",
-                    template='email/notification.html',
-                    nombre_usuario=user['nombre_completo'],
-                    mensaje_notificacion=message,
-                    url_accion=full_url
-                )
-
-
 def update_connection(conexion_id, form, current_user, user_roles):
     """
     Procesa la actualización de una conexión existente.
@@ -249,7 +199,8 @@ def update_connection(conexion_id, form, current_user, user_roles):
     }
 
     try:
-        dal.update_conexion(conexion_id, update_data)
+        with dal.transaction():
+            dal.update_conexion(conexion_id, update_data)
         log_action('EDITAR_CONEXION', current_user['id'], 'conexiones', conexion_id,
                    f"Conexión '{conexion['codigo_conexion']}' editada a '{codigo_a_guardar}'.")
         return True, 'Conexión actualizada con éxito.', flash_message
@@ -273,24 +224,33 @@ def assign_realizador(conexion_id, username_to_assign, current_user):
     try:
         if conexion['estado'] == 'SOLICITADO':
             nuevo_estado = 'EN_PROCESO'
-            dal.update_conexion_realizador(
-                conexion_id, usuario_a_asignar['id'], nuevo_estado)
-            dal.add_historial_estado(
-                conexion_id, current_user['id'], nuevo_estado, f"Asignada a {usuario_a_asignar['nombre_completo']}")
-
-            _notify_users(conexion_id, f"La conexión {conexion['codigo_conexion']} ha sido asignada.", "", [
-                          'SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'])
-
+            with dal.transaction():
+                dal.update_conexion_realizador(
+                    conexion_id, usuario_a_asignar['id'], nuevo_estado)
+                dal.add_historial_estado(
+                    conexion_id, current_user['id'], nuevo_estado, f"Asignada a {usuario_a_asignar['nombre_completo']}")
+                dal.registrar_ciclo_estado(conexion_id, nuevo_estado, current_user['id'])
+
+                notify_users(conexion, f"La conexión {conexion['codigo_conexion']} ha sido asignada.", "", [
+                             'SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'], exclude_user_id=current_user['id'])
+                publish_connection_event(conexion_id, 'asignada', estado=nuevo_estado,
+                                         realizador=usuario_a_asignar['nombre_completo'])
+
+            invalidate_for_connection(conexion, usuario_a_asignar['id'])
             return True, f"Conexión asignada a {usuario_a_asignar['nombre_completo']}."
         else:
-            dal.update_conexion_realizador(
-                conexion_id, usuario_a_asignar['id'])
+            with dal.transaction():
+                dal.update_conexion_realizador(
+                    conexion_id, usuario_a_asignar['id'])
+                notify_users(conexion, f"La conexión {conexion['codigo_conexion']} ha sido reasignada.", "", [
+                             'SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'], exclude_user_id=current_user['id'])
+                publish_connection_event(conexion_id, 'asignada', estado=conexion['estado'],
+                                         realizador=usuario_a_asignar['nombre_completo'])
+
+            invalidate_for_connection(conexion, usuario_a_asignar['id'])
             log_action('REASIGNAR_CONEXION', current_user['id'], 'conexiones', conexion_id,
                        f"Conexión reasignada a '{usuario_a_asignar['nombre_completo']}'.")
 
-            _notify_users(conexion_id, f"La conexión {conexion['codigo_conexion']} ha sido reasignada.", "", [
-                          'SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'])
-
             return True, 'Realizador de la conexión actualizado.'
     except Exception as e:
         current_app.logger.error(
@@ -306,7 +266,9 @@ def delete_connection(conexion_id, user_id):
     # Para obtener el código antes de eliminar
     conexion = get_conexion(conexion_id)
     try:
-        dal.delete_conexion(conexion_id)
+        with dal.transaction():
+            dal.delete_conexion(conexion_id)
+        invalidate_for_connection(conexion)
         log_action('ELIMINAR_CONEXION', user_id, 'conexiones', conexion_id,
                    f"Conexión '{conexion['codigo_conexion']}' eliminada.")
         return True, f"La conexión {conexion['codigo_conexion']} ha sido eliminada."
@@ -338,55 +300,56 @@ def process_connection_state_transition(conexion_id, new_status_form, user_id, u
     if not success:
         return False, 'Acción no permitida o estado inválido.', None
 
-    db = get_db()
-    cursor = db.cursor()
+    # Roles a notificar según el nuevo estado
+    roles_map = {
+        'EN_PROCESO': ['SOLICITANTE', 'ADMINISTRADOR'],
+        'REALIZADO': ['APROBADOR', 'ADMINISTRADOR'],
+        'APROBADO': ['SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'],
+    }
+
+    dal = SQLiteDAL()
     try:
-        sql_update_parts = ["estado = ?",
-                            "fecha_modificacion = CURRENT_TIMESTAMP"]
-        params = [new_db_state]
-
-        if new_db_state == 'EN_PROCESO' and audit_action == 'TOMAR_CONEXION':
-            sql_update_parts.append("realizador_id = ?")
-            params.append(user_id)
-        elif new_db_state == 'APROBADO':
-            sql_update_parts.append("aprobador_id = ?")
-            params.append(user_id)
-        elif audit_action == 'RECHAZAR_CONEXION':
-            sql_update_parts.append("detalles_rechazo = ?")
-            params.append(details)
-
-        # Construye la consulta de forma segura
-        sql_update = "UPDATE conexiones SET " + \
-            ", ".join(sql_update_parts) + " WHERE id = ?"
-        params.append(conexion_id)
-
-        cursor.execute(sql_update, tuple(params))
-
-        sql_historial = "INSERT INTO historial_estados (conexion_id, usuario_id, estado, detalles) VALUES (?, ?, ?, ?)"
-        cursor.execute(sql_historial, (conexion_id,
-                       user_id, new_status_form, details))
-        db.commit()
+        # La actualización, el historial y las notificaciones se confirman juntos.
+        with dal.transaction() as db:
+            sql_update_parts = ["estado = ?",
+                                "fecha_modificacion = CURRENT_TIMESTAMP"]
+            params = [new_db_state]
+
+            if new_db_state == 'EN_PROCESO' and audit_action == 'TOMAR_CONEXION':
+                sql_update_parts.append("realizador_id = ?")
+                params.append(user_id)
+            elif new_db_state == 'APROBADO':
+                sql_update_parts.append("aprobador_id = ?")
+                params.append(user_id)
+            elif audit_action == 'RECHAZAR_CONEXION':
+                sql_update_parts.append("detalles_rechazo = ?")
+                params.append(details)
+
+            # Construye la consulta de forma segura
+            sql_update = "UPDATE conexiones SET " + \
+                ", ".join(sql_update_parts) + " WHERE id = ?"
+            params.append(conexion_id)
+
+            db.execute(sql_update, tuple(params))
+            dal.add_historial_estado(
+                conexion_id, user_id, new_status_form, details)
+            # Fechas y duraciones del ciclo de vida para los KPIs de tiempos.
+            dal.registrar_ciclo_estado(conexion_id, new_status_form, user_id)
+
+            if audit_action == 'RECHAZAR_CONEXION':
+                notify_users(conexion, message, "", [
+                             'REALIZADOR', 'ADMINISTRADOR'], exclude_user_id=user_id)
+            elif new_db_state in roles_map:
+                notify_users(conexion, message, "",
+                             roles_map[new_db_state], exclude_user_id=user_id)
+            publish_connection_event(conexion_id, 'estado', estado=new_db_state)
     except Exception as e:
-        db.rollback()
         current_app.logger.error(
             f"Error en transición de estado para conexión {conexion_id}: {e}", exc_info=True)
         return False, "Error interno al cambiar de estado.", None
-    finally:
-        cursor.close()
 
+    invalidate_for_connection(conexion, user_id)
     log_action(audit_action, user_id, 'conexiones', conexion_id,
                f"Estado: {estado_actual} -> {new_db_state}. Detalles: {details or 'N/A'}")
 
-    # Notificar a los usuarios relevantes
-    roles_map = {
-        'EN_PROCESO': ['SOLICITANTE', 'ADMINISTRADOR'],
-        'REALIZADO': ['APROBADOR', 'ADMINISTRADOR'],
-        'APROBADO': ['SOLICITANTE', 'REALIZADOR', 'ADMINISTRADOR'],
-    }
-    if audit_action == 'RECHAZAR_CONEXION':
-        _notify_users(conexion_id, message, "", [
-                      'REALIZADOR', 'ADMINISTRADOR'])
-    elif new_db_state in roles_map:
-        _notify_users(conexion_id, message, "", roles_map[new_db_state])
-
     return True, message, new_db_state
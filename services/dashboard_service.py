@@ -1,169 +1,408 @@
-import time
 import json
 from datetime import datetime, timedelta
-from flask import g
-from db import get_db
+from flask import current_app, g
+from db import get_read_db
+from dal.sqlite_dal import SQLiteDAL
+from utils.lru_cache import LRUCache
+from utils.user_context import get_unread_notification_count
 
-_cache = {}
 CACHE_TIMEOUT = 60  # Cache results for 60 seconds
 
+# Secciones del dashboard que dependen de las conexiones de un usuario.
+CONNECTION_SECTIONS = ('resumen', 'rendimiento', 'proyectos', 'tareas')
+# Secciones comunes a todos los usuarios ('None' en lugar del id de usuario).
+GLOBAL_CONNECTION_SECTIONS = ('kpis', 'graficas', 'disponibles', 'actividad')
+
+
+def init_app(app):
+    app.extensions['dashboard_cache'] = LRUCache(
+        max_entries=app.config.get('DASHBOARD_CACHE_MAX_ENTRIES', 2048),
+        ttl=app.config.get('DASHBOARD_CACHE_TTL', CACHE_TIMEOUT))
+
+
+def _get_cache():
+    return current_app.extensions['dashboard_cache']
+
 
 def clear_dashboard_cache():
-    """Clears the in-memory dashboard cache."""
-    _cache.clear()
+    """
+    Clears the in-memory dashboard cache and bumps 'dashboard_epoch', so the
+    other processes stop using theirs too.
+    """
+    _get_cache().clear()
+    g.pop('dashboard_versions', None)
+    SQLiteDAL().bump_dashboard_versions()
 
 
-def get_dashboard_data(user_id, user_roles):
+def invalidate_dashboard(user_ids=None, sections=None):
     """
-    Fetches and consolidates all data required for the dashboard.
-    Results are cached to improve performance.
-    This version uses multiple correct queries and ensures consistent data structure.
+    Descarta secciones cacheadas del dashboard en este proceso: las
+    'sections' (o todas) de cada id de 'user_ids' ('None' para las secciones
+    comunes). Sin 'user_ids' se vacía la caché. Los demás procesos lo notan
+    por las versiones de 'versiones_dashboard' que suben los triggers.
     """
-    cache_key = f"dashboard_{user_id}"
-    now = time.time()
+    cache = _get_cache()
+    g.pop('dashboard_versions', None)
+    if user_ids is None:
+        cache.clear()
+        return
+    for user_id in set(user_ids):
+        if sections is None:
+            cache.invalidate(user_id)
+            continue
+        for section in sections:
+            cache.invalidate(user_id, section)
 
-    if cache_key in _cache:
-        cached_data, timestamp = _cache[cache_key]
-        if now - timestamp < CACHE_TIMEOUT:
-            return cached_data.copy()
 
-    db = get_db()
-    cursor = db.cursor()
+def invalidate_for_connection(conexion, *user_ids):
+    """
+    Invalida lo que cambia cuando se crea, asigna o cambia de estado una
+    conexión: las secciones de su solicitante, realizador y aprobador, de los
+    usuarios indicados y de los miembros de su proyecto (pendientes de
+    aprobación), y las secciones comunes. Se llama después del commit.
+    """
+    affected = {conexion.get('solicitante_id'), conexion.get('realizador_id'),
+                conexion.get('aprobador_id'), *user_ids}
+    affected |= SQLiteDAL().get_users_for_project(conexion['proyecto_id'])
+    affected.discard(None)
+    invalidate_dashboard(affected, CONNECTION_SECTIONS)
+    invalidate_dashboard([None], GLOBAL_CONNECTION_SECTIONS)
 
-    # Initialize with all keys expected by the template
-    dashboard_data = {
-        'kpis': {},
-        'charts': {},
-        'tareas': {},
-        'feed_actividad': [],
-        'my_summary': {},
-        'my_performance': {},
-        'my_performance_chart': {},
-        'my_projects_summary': [],
-        'user_prefs': {},
-        'all_projects_for_filter': []
+
+def get_dashboard_cache_stats():
+    """Contadores de la caché del dashboard de este proceso."""
+    return _get_cache().stats()
+
+
+def _data_version(user_id):
+    """
+    Versión de los datos del dashboard de 'user_id' (None = secciones
+    comunes); se lee una vez por solicitud. Con varios workers, cada uno
+    guarda su propia caché: al ir la versión en la clave, una escritura hecha
+    en otro worker hace que este deje de usar las secciones afectadas.
+    """
+    versions = g.setdefault('dashboard_versions', {})
+    if user_id not in versions:
+        versions[user_id] = SQLiteDAL().get_dashboard_version(user_id)
+    return versions[user_id]
+
+
+def _cached(user_id, section, compute, *variant):
+    key = (user_id, section, _data_version(user_id), *variant)
+    return _get_cache().get_or_compute(key, compute)
+
+
+def _fetch_all(sql, params=()):
+    cursor = get_read_db().cursor()
+    try:
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def _fetch_one(sql, params=()):
+    cursor = get_read_db().cursor()
+    try:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+
+def _compute_summary(user_id):
+    # Los recuentos vienen de 'dashboard_counters', que mantienen los triggers
+    # de la migración 0009: una sola búsqueda por clave primaria.
+    counters = {row['metrica']: row['valor'] for row in _fetch_all(
+        "SELECT metrica, valor FROM dashboard_counters WHERE usuario_id = ?", (user_id,))}
+    summary = {
+        'total_conexiones_creadas': counters.get('creadas', 0),
+        'conexiones_en_proceso_solicitadas': counters.get('solicitadas_en_proceso', 0),
+        'conexiones_aprobadas_solicitadas': counters.get('solicitadas_aprobadas', 0),
+        'mis_tareas_en_proceso': counters.get('tareas_en_proceso', 0),
+        'pendientes_mi_aprobacion': counters.get('pendientes_aprobacion', 0),
+    }
+    # Las ventanas de 30 días dependen de la fecha actual y no se pueden
+    # mantener con triggers; se resuelven con los índices por usuario.
+    recientes = _fetch_one("""
+        SELECT
+          (SELECT COUNT(id) FROM conexiones WHERE realizador_id = :user_id AND estado = 'REALIZADO'
+             AND fecha_modificacion >= date('now', '-30 days')) AS realizadas,
+          (SELECT COUNT(id) FROM conexiones WHERE aprobador_id = :user_id AND estado = 'APROBADO'
+             AND fecha_modificacion >= date('now', '-30 days')) AS aprobadas
+    """, {'user_id': user_id})
+    summary['mis_tareas_realizadas_ult_30d'] = recientes['realizadas']
+    summary['aprobadas_por_mi_ult_30d'] = recientes['aprobadas']
+    return summary
+
+
+def _compute_performance(user_id):
+    # Tiempo medio desde que la conexión pasa a EN_PROCESO hasta que el
+    # realizador la marca como realizada (ver 'conexion_ciclo').
+    avg_time_sql = "SELECT AVG(dias_ejecucion) as avg_days FROM conexion_ciclo WHERE realizador_id = ? AND fecha_realizado IS NOT NULL"
+    avg_time_result = _fetch_one(avg_time_sql, (user_id,))
+    avg_days_val = avg_time_result['avg_days'] if avg_time_result and avg_time_result['avg_days'] is not None else 0
+
+    # Tareas completadas: conexiones que el usuario marcó como realizadas o
+    # aprobó, leídas de 'metricas_diarias'.
+    start_date = (datetime.now() - timedelta(days=29)).strftime('%Y-%m-%d')
+    month_start = datetime.now().strftime('%Y-%m-01')
+    sql_chart = "SELECT dia, SUM(total) as total FROM metricas_diarias WHERE usuario_id = ? AND estado IN ('REALIZADO', 'APROBADO') AND dia >= ? GROUP BY dia"
+    tasks_map = {row['dia']: row['total']
+                 for row in _fetch_all(sql_chart, (user_id, min(start_date, month_start)))}
+
+    performance = {
+        'avg_completion_time': f"{avg_days_val:.1f} días" if avg_days_val > 0 else 'N/A',
+        'tasks_completed_this_month': sum(total for dia, total in tasks_map.items() if dia >= month_start)
     }
+    chart_data = {'labels': [], 'data': []}
+    for i in range(29, -1, -1):
+        date = (datetime.now() - timedelta(days=i))
+        date_str = date.strftime('%Y-%m-%d')
+        chart_data['labels'].append(date.strftime('%d %b'))
+        chart_data['data'].append(tasks_map.get(date_str, 0))
+    return performance, chart_data
 
-    # --- Personal Summary (My Summary) ---
-    summary = {}
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE solicitante_id = ?", (user_id,))
-    summary['total_conexiones_creadas'] = cursor.fetchone()[0]
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE solicitante_id = ? AND estado = 'EN_PROCESO'", (user_id,))
-    summary['conexiones_en_proceso_solicitadas'] = cursor.fetchone()[0]
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE solicitante_id = ? AND estado = 'APROBADO'", (user_id,))
-    summary['conexiones_aprobadas_solicitadas'] = cursor.fetchone()[0]
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE realizador_id = ? AND estado = 'EN_PROCESO'", (user_id,))
-    summary['mis_tareas_en_proceso'] = cursor.fetchone()[0]
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE realizador_id = ? AND estado = 'REALIZADO' AND fecha_modificacion >= date('now', '-30 days')", (user_id,))
-    summary['mis_tareas_realizadas_ult_30d'] = cursor.fetchone()[0]
-    cursor.execute(
-        "SELECT COUNT(id) FROM conexiones WHERE aprobador_id = ? AND estado = 'APROBADO' AND fecha_modificacion >= date('now', '-30 days')", (user_id,))
-    summary['aprobadas_por_mi_ult_30d'] = cursor.fetchone()[0]
-    pendientes_query = "SELECT COUNT(c.id) as total FROM conexiones c JOIN proyecto_usuarios pu ON c.proyecto_id = pu.proyecto_id WHERE c.estado = 'REALIZADO' AND pu.usuario_id = ?"
-    cursor.execute(pendientes_query, (user_id,))
-    summary['pendientes_mi_aprobacion'] = cursor.fetchone()['total']
-    summary['notificaciones_no_leidas'] = len(g.get('notifications', []))
-    dashboard_data['my_summary'] = summary
-
-    # --- Performance Metrics for Realizador/Aprobador ---
-    if 'REALIZADOR' in user_roles or 'APROBADOR' in user_roles:
-        avg_time_sql = "SELECT AVG(julianday(h2.fecha) - julianday(h1.fecha)) as avg_days FROM historial_estados h1 JOIN historial_estados h2 ON h1.conexion_id = h2.conexion_id WHERE h1.usuario_id = ? AND h1.estado = 'EN_PROCESO' AND h2.estado IN ('REALIZADO', 'APROBADO')"
-        completed_sql = "SELECT COUNT(id) as total FROM conexiones WHERE ((realizador_id = ? AND estado = 'REALIZADO') OR (aprobador_id = ? AND estado = 'APROBADO')) AND strftime('%Y-%m', fecha_modificacion) = strftime('%Y-%m', 'now')"
-        cursor.execute(avg_time_sql, (user_id,))
-        avg_time_result = cursor.fetchone()
-        avg_days_val = avg_time_result['avg_days'] if avg_time_result and avg_time_result['avg_days'] is not None else 0
-        cursor.execute(completed_sql, (user_id, user_id))
-        completed_query = cursor.fetchone()
-        tasks_completed = completed_query['total'] if completed_query else 0
-        dashboard_data['my_performance'] = {
-            'avg_completion_time': f"{avg_days_val:.1f} días" if avg_days_val > 0 else 'N/A',
-            'tasks_completed_this_month': tasks_completed
-        }
-        sql_chart = "SELECT date(fecha_modificacion) as completion_date, COUNT(id) as total FROM conexiones WHERE ((realizador_id = ? AND estado = 'REALIZADO') OR (aprobador_id = ? AND estado = 'APROBADO')) AND fecha_modificacion >= ? GROUP BY completion_date ORDER BY completion_date"
-        params_chart = (user_id, user_id, (datetime.now() -
-                        timedelta(days=30)).strftime('%Y-%m-%d %H:%M:%S'))
-        cursor.execute(sql_chart, params_chart)
-        tasks_map = {row['completion_date']: row['total']
-                     for row in cursor.fetchall()}
-        chart_data = {'labels': [], 'data': []}
-        for i in range(29, -1, -1):
-            date = (datetime.now() - timedelta(days=i))
-            date_str = date.strftime('%Y-%m-%d')
-            chart_data['labels'].append(date.strftime('%d %b'))
-            chart_data['data'].append(tasks_map.get(date_str, 0))
-        dashboard_data['my_performance_chart'] = chart_data
-
-    # --- User's projects summary ---
+
+def _compute_projects_summary(user_id):
     query_projects = "SELECT p.id, p.nombre, COUNT(c.id) AS total_conexiones, SUM(CASE WHEN c.estado = 'SOLICITADO' THEN 1 ELSE 0 END) AS solicitadas, SUM(CASE WHEN c.estado = 'EN_PROCESO' THEN 1 ELSE 0 END) AS en_proceso, SUM(CASE WHEN c.estado = 'APROBADO' THEN 1 ELSE 0 END) AS aprobadas, SUM(CASE WHEN c.estado = 'RECHAZADO' THEN 1 ELSE 0 END) AS rechazadas FROM proyectos p JOIN proyecto_usuarios pu ON p.id = pu.proyecto_id LEFT JOIN conexiones c ON p.id = c.proyecto_id WHERE pu.usuario_id = ? GROUP BY p.id, p.nombre ORDER BY p.nombre"
-    cursor.execute(query_projects, (user_id,))
-    dashboard_data['my_projects_summary'] = [
-        dict(row) for row in cursor.fetchall()]
-
-    # --- Admin KPIs (Global Stats) ---
-    if 'ADMINISTRADOR' in user_roles:
-        kpi_counts_query = "SELECT SUM(CASE WHEN estado NOT IN ('APROBADO', 'RECHAZADO') THEN 1 ELSE 0 END) as total_activas, SUM(CASE WHEN date(fecha_creacion) = date('now') THEN 1 ELSE 0 END) as creadas_hoy FROM conexiones"
-        avg_time_sql_admin = "SELECT AVG(julianday(h2.fecha) - julianday(h1.fecha)) as avg_time FROM historial_estados h1 JOIN historial_estados h2 ON h1.conexion_id = h2.conexion_id WHERE h1.estado = 'SOLICITADO' AND h2.estado = 'APROBADO'"
-        cursor.execute(kpi_counts_query)
-        kpi_counts = cursor.fetchone()
-        cursor.execute(avg_time_sql_admin)
-        avg_time_result_admin = cursor.fetchone()
-        avg_days_admin = avg_time_result_admin['avg_time'] if avg_time_result_admin and avg_time_result_admin['avg_time'] is not None else 0
-        dashboard_data['kpis'] = {
-            'total_activas': kpi_counts['total_activas'] or 0,
-            'creadas_hoy': kpi_counts['creadas_hoy'] or 0,
-            'tiempo_aprobacion': f"{avg_days_admin:.1f} días" if avg_days_admin > 0 else "N/A"
-        }
-        # Placeholder for charts data to avoid template errors
-        dashboard_data['charts'] = {}
-
-    # --- Task lists ---
-    tasks = {'pendientes_aprobacion': [], 'mis_asignadas': [],
-             'disponibles': [], 'mis_solicitudes': []}
+    return _fetch_all(query_projects, (user_id,))
+
+
+def _compute_admin_kpis():
+    kpi_counts_query = "SELECT SUM(CASE WHEN estado NOT IN ('APROBADO', 'RECHAZADO') THEN 1 ELSE 0 END) as total_activas, SUM(CASE WHEN date(fecha_creacion) = date('now') THEN 1 ELSE 0 END) as creadas_hoy FROM conexiones"
+    avg_time_sql_admin = "SELECT AVG(dias_ciclo) as avg_time FROM conexion_ciclo WHERE fecha_aprobado IS NOT NULL"
+    kpi_counts = _fetch_one(kpi_counts_query)
+    avg_time_result_admin = _fetch_one(avg_time_sql_admin)
+    avg_days_admin = avg_time_result_admin['avg_time'] if avg_time_result_admin and avg_time_result_admin['avg_time'] is not None else 0
+    return {
+        'total_activas': kpi_counts['total_activas'] or 0,
+        'creadas_hoy': kpi_counts['creadas_hoy'] or 0,
+        'tiempo_aprobacion': f"{avg_days_admin:.1f} días" if avg_days_admin > 0 else "N/A"
+    }
+
+
+def _compute_admin_charts(start, end):
+    """Gráficas del panel de administrador para el rango [start, end], desde 'metricas_diarias'."""
+    estados = {row['estado']: row['total'] for row in _fetch_all(
+        "SELECT estado, SUM(total) as total FROM metricas_diarias WHERE dia BETWEEN ? AND ? GROUP BY estado",
+        (start, end))}
+    conexiones_mes = _fetch_all(
+        "SELECT substr(dia, 1, 7) as mes, SUM(total) as total FROM metricas_diarias WHERE estado = 'SOLICITADO' AND dia BETWEEN ? AND ? GROUP BY mes ORDER BY mes",
+        (start, end))
+    top_sql = "SELECT u.nombre_completo, SUM(m.total) as total FROM metricas_diarias m JOIN usuarios u ON u.id = m.usuario_id WHERE m.estado = ? AND m.dia BETWEEN ? AND ? GROUP BY u.id ORDER BY total DESC LIMIT 5"
+    return {
+        'estados': estados,
+        'conexiones_mes': conexiones_mes,
+        'top_solicitantes': _fetch_all(top_sql, ('SOLICITADO', start, end)),
+        'top_realizadores': _fetch_all(top_sql, ('REALIZADO', start, end)),
+    }
+
+
+def _compute_user_tasks(user_id, user_roles):
+    tasks = {'pendientes_aprobacion': [], 'mis_asignadas': [], 'mis_solicitudes': []}
     if 'APROBADOR' in user_roles:
         query_aprobador = "SELECT c.id, c.codigo_conexion, p.nombre as proyecto_nombre, c.fecha_creacion, c.tipo, c.estado, c.realizador_id FROM conexiones c JOIN proyectos p ON c.proyecto_id = p.id JOIN proyecto_usuarios pu ON c.proyecto_id = pu.proyecto_id WHERE c.estado = 'REALIZADO' AND pu.usuario_id = ? ORDER BY c.fecha_modificacion DESC LIMIT 5"
-        cursor.execute(query_aprobador, (user_id,))
-        tasks['pendientes_aprobacion'] = [
-            dict(row) for row in cursor.fetchall()]
+        tasks['pendientes_aprobacion'] = _fetch_all(query_aprobador, (user_id,))
     if 'REALIZADOR' in user_roles:
         query_realizador = "SELECT c.id, c.codigo_conexion, p.nombre as proyecto_nombre, c.fecha_creacion, c.tipo, c.estado, c.realizador_id FROM conexiones c JOIN proyectos p ON c.proyecto_id = p.id WHERE c.estado = 'EN_PROCESO' AND c.realizador_id = ? ORDER BY c.fecha_modificacion DESC LIMIT 5"
-        cursor.execute(query_realizador, (user_id,))
-        tasks['mis_asignadas'] = [dict(row) for row in cursor.fetchall()]
-        query_disponibles = "SELECT c.id, c.codigo_conexion, p.nombre as proyecto_nombre, c.fecha_creacion, c.tipo, c.estado, c.realizador_id FROM conexiones c JOIN proyectos p ON c.proyecto_id = p.id WHERE c.estado = 'SOLICITADO' ORDER BY c.fecha_creacion DESC LIMIT 5"
-        cursor.execute(query_disponibles)
-        tasks['disponibles'] = [dict(row) for row in cursor.fetchall()]
+        tasks['mis_asignadas'] = _fetch_all(query_realizador, (user_id,))
     if 'SOLICITANTE' in user_roles:
         query_solicitante = "SELECT id, codigo_conexion, estado, fecha_creacion, tipo FROM conexiones WHERE solicitante_id = ? AND estado NOT IN ('APROBADO') ORDER BY fecha_creacion DESC LIMIT 5"
-        cursor.execute(query_solicitante, (user_id,))
-        tasks['mis_solicitudes'] = [dict(row) for row in cursor.fetchall()]
-    dashboard_data['tareas'] = tasks
+        tasks['mis_solicitudes'] = _fetch_all(query_solicitante, (user_id,))
+    return tasks
+
 
-    # --- Activity Feed ---
-    cursor.execute("""
+def _compute_available_tasks():
+    query_disponibles = "SELECT c.id, c.codigo_conexion, p.nombre as proyecto_nombre, c.fecha_creacion, c.tipo, c.estado, c.realizador_id FROM conexiones c JOIN proyectos p ON c.proyecto_id = p.id WHERE c.estado = 'SOLICITADO' ORDER BY c.fecha_creacion DESC LIMIT 5"
+    return _fetch_all(query_disponibles)
+
+
+def _compute_activity_feed():
+    return _fetch_all("""
         SELECT h.objeto_id as conexion_id, h.fecha, u.nombre_completo as usuario_nombre, c.codigo_conexion, h.accion, h.detalles
         FROM auditoria_acciones h JOIN usuarios u ON h.usuario_id = u.id
         LEFT JOIN conexiones c ON h.objeto_id = c.id AND h.tipo_objeto = 'conexiones'
         WHERE h.accion IN ('CREAR_CONEXION', 'TOMAR_CONEXION', 'MARCAR_REALIZADO_CONEXION', 'APROBAR_CONEXION', 'RECHAZAR_CONEXION', 'SUBIR_ARCHIVO', 'AGREGAR_COMENTARIO')
         ORDER BY h.fecha DESC LIMIT 10
     """)
-    dashboard_data['feed_actividad'] = [dict(row) for row in cursor.fetchall()]
 
-    # --- Other data needed by template ---
-    cursor.execute(
+
+def _compute_user_prefs(user_id):
+    user_prefs_row = _fetch_one(
         'SELECT widgets_config FROM user_dashboard_preferences WHERE usuario_id = ?', (user_id,))
-    user_prefs_row = cursor.fetchone()
-    dashboard_data['user_prefs'] = json.loads(
+    return json.loads(
         user_prefs_row['widgets_config']) if user_prefs_row and user_prefs_row['widgets_config'] else {}
-    cursor.execute("SELECT id, nombre FROM proyectos ORDER BY nombre")
-    dashboard_data['all_projects_for_filter'] = [
-        dict(row) for row in cursor.fetchall()]
 
-    _cache[cache_key] = (dashboard_data, now)
 
-    cursor.close()
+def _compute_projects_for_filter():
+    return _fetch_all("SELECT id, nombre FROM proyectos ORDER BY nombre")
+
+
+def _widget_summary(user_id, user_roles, filters):
+    summary = dict(_cached(user_id, 'resumen', lambda: _compute_summary(user_id)))
+    # El contador de notificaciones viene del contexto de la solicitud.
+    summary['notificaciones_no_leidas'] = get_unread_notification_count()
+    return {'my_summary': summary}
+
+
+def _widget_performance(user_id, user_roles, filters):
+    performance, chart_data = _cached(
+        user_id, 'rendimiento', lambda: _compute_performance(user_id))
+    return {'my_performance': performance, 'my_performance_chart': chart_data}
+
+
+def _widget_projects_summary(user_id, user_roles, filters):
+    return {'my_projects_summary': _cached(
+        user_id, 'proyectos', lambda: _compute_projects_summary(user_id))}
+
+
+def _widget_admin(user_id, user_roles, filters):
+    start, end = filters['start'], filters['end']
+    return {'kpis': _cached(None, 'kpis', _compute_admin_kpis),
+            'charts': _cached(None, 'graficas', lambda: _compute_admin_charts(start, end), start, end)}
+
+
+def _widget_tasks(user_id, user_roles, filters):
+    roles_key = tuple(sorted(user_roles))
+    tasks = dict(_cached(user_id, 'tareas',
+                         lambda: _compute_user_tasks(user_id, user_roles), roles_key))
+    tasks['disponibles'] = []
+    if 'REALIZADOR' in user_roles:
+        tasks['disponibles'] = _cached(None, 'disponibles', _compute_available_tasks)
+    return {
+        'tareas': tasks,
+        'all_projects_for_filter': _cached(None, 'filtro_proyectos', _compute_projects_for_filter),
+    }
+
+
+def _widget_activity(user_id, user_roles, filters):
+    return {'feed_actividad': _cached(None, 'actividad', _compute_activity_feed)}
+
+
+# Widgets del dashboard en orden de aparición. 'roles' limita quién puede
+# verlos (None = todos), 'template' es el parcial que los renderiza y
+# 'compute(user_id, user_roles, filters)' devuelve las claves de
+# 'dashboard_data' que necesita ese parcial.
+# 'quick-actions-panel' no consulta la base de datos y se renderiza siempre.
+WIDGETS = {
+    'my-summary-panel': {
+        'roles': None, 'template': 'partials/dashboard/summary.html', 'compute': _widget_summary},
+    'my-performance-panel': {
+        'roles': ('REALIZADOR', 'APROBADOR'), 'template': 'partials/dashboard/performance.html',
+        'compute': _widget_performance},
+    'my-projects-summary-panel': {
+        'roles': None, 'template': 'partials/dashboard/projects_summary.html',
+        'compute': _widget_projects_summary},
+    'quick-actions-panel': {'roles': None, 'template': None, 'compute': None},
+    'admin-panel': {
+        'roles': ('ADMINISTRADOR',), 'template': 'partials/dashboard/admin.html', 'compute': _widget_admin},
+    'tasks-panel': {
+        'roles': None, 'template': 'partials/dashboard/tasks.html', 'compute': _widget_tasks},
+    'recent-activity-panel': {
+        'roles': None, 'template': 'partials/dashboard/activity.html', 'compute': _widget_activity},
+}
+
+# Widgets que '/dashboard' calcula y renderiza en la propia página; el resto
+# se carga en paralelo desde '/api/dashboard/widgets/<widget_id>'.
+INLINE_WIDGETS = ('my-summary-panel',)
+
+
+def _parse_date(value, default):
+    """Fecha 'YYYY-MM-DD' normalizada con ceros; 'default' si falta o no es válida."""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d') if value else default
+    except (TypeError, ValueError):
+        return default
+
+
+def get_dashboard_filters(args):
+    """
+    Rango de fechas del panel de administrador; por defecto, los últimos 30
+    días. Las fechas no válidas se sustituyen por las de por defecto y el
+    rango invertido se ordena, porque van directamente a las consultas SQL.
+    """
+    now = datetime.now()
+    start = _parse_date(args.get('date_start'), now - timedelta(days=30))
+    end = _parse_date(args.get('date_end'), now)
+    if start > end:
+        start, end = end, start
+    return {'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')}
+
+
+def get_available_widgets(user_roles):
+    """Devuelve los identificadores de los widgets permitidos para los roles dados."""
+    return [widget_id for widget_id, widget in WIDGETS.items()
+            if widget['roles'] is None or any(role in user_roles for role in widget['roles'])]
+
+
+def get_dashboard_data(user_id, user_roles, widget_ids=None, filters=None):
+    """
+    Fetches and consolidates all data required for the dashboard.
+    Primero se leen las preferencias del usuario y solo se calculan los
+    widgets visibles incluidos en 'widget_ids' (todos si es None); los widgets
+    ocultos no ejecutan ninguna consulta. Cada sección se guarda por separado
+    en la caché LRU del proceso, de modo que una acción sobre una conexión
+    solo invalida las secciones de los usuarios afectados (ver
+    'invalidate_for_connection' y, entre procesos, '_data_version'). Las secciones que dependen de los roles
+    incluyen los roles en la clave. 'filters' es el rango de fechas de las
+    gráficas (ver 'get_dashboard_filters'; por defecto, los últimos 30 días).
+    """
+    if filters is None:
+        filters = get_dashboard_filters({})
+
+    # Initialize with all keys expected by the template
+    dashboard_data = {
+        'kpis': {},
+        'charts': {},
+        'tareas': {},
+        'feed_actividad': [],
+        'my_summary': {},
+        'my_performance': {},
+        'my_performance_chart': {},
+        'my_projects_summary': [],
+        'user_prefs': {},
+        'all_projects_for_filter': [],
+        'widgets': [],
+        'enabled_widgets': [],
+        'loaded_widgets': [],
+        'widget_templates': {},
+    }
+
+    user_prefs = _cached(user_id, 'preferencias', lambda: _compute_user_prefs(user_id))
+    dashboard_data['user_prefs'] = user_prefs
+
+    widgets = get_available_widgets(user_roles)
+    dashboard_data['widgets'] = widgets
+    dashboard_data['enabled_widgets'] = [
+        widget_id for widget_id in widgets if user_prefs.get(widget_id, True)]
+
+    for widget_id in dashboard_data['enabled_widgets']:
+        widget = WIDGETS[widget_id]
+        dashboard_data['widget_templates'][widget_id] = widget['template']
+        if widget['compute'] is None or (widget_ids is not None and widget_id not in widget_ids):
+            continue
+        dashboard_data.update(widget['compute'](user_id, user_roles, filters))
+        dashboard_data['loaded_widgets'].append(widget_id)
 
     return dashboard_data
+
+
+def get_widget_data(widget_id, user_id, user_roles, filters=None):
+    """
+    Calcula un único widget del dashboard, aunque esté oculto en las
+    preferencias (el usuario puede estar activándolo en ese momento).
+    Devuelve (dashboard_data, None) o (None, mensaje) si el widget no existe
+    o no está disponible para los roles del usuario.
+    """
+    widget = WIDGETS.get(widget_id)
+    if widget is None or widget['compute'] is None or widget_id not in get_available_widgets(user_roles):
+        return None, "Widget no encontrado."
+
+    if filters is None:
+        filters = get_dashboard_filters({})
+    dashboard_data = get_dashboard_data(user_id, user_roles, widget_ids=(), filters=filters)
+    dashboard_data.update(widget['compute'](user_id, user_roles, filters))
+    dashboard_data['loaded_widgets'] = [widget_id]
+    dashboard_data['widget_templates'][widget_id] = widget['template']
+    return dashboard_data, None
@@ -0,0 +1,367 @@
+import os
+import time
+import smtplib
+import threading
+from collections import OrderedDict
+from flask import current_app, render_template
+from flask_mail import Message
+from extensions import mail
+from dal.sqlite_dal import SQLiteDAL
+
+
+DIGEST_JOB_ID = 'email_digest'
+
+# Aplicación registrada al programar el job (ver maintenance_service).
+_app = None
+
+# Hilo de envío del proceso y pid que lo arrancó (ver 'start_sender').
+_sender = None
+_sender_pid = None
+_sender_lock = threading.Lock()
+
+READY_CONDITION = """
+    resumen = 0 AND (
+        (estado = 'PENDIENTE' AND proximo_intento <= datetime('now'))
+        OR (estado = 'ENVIANDO' AND reclamado_en <= datetime('now', :stale)))
+"""
+
+# Se reclaman destinatarios completos, no filas: todos los correos listos de
+# un destinatario viajan en el mismo lote y se agrupan en un único mensaje.
+CLAIM_SQL = f"""
+    UPDATE email_outbox
+    SET estado = 'ENVIANDO', reclamado_en = datetime('now')
+    WHERE {READY_CONDITION}
+      AND destinatario IN (
+        SELECT destinatario FROM email_outbox
+        WHERE {READY_CONDITION}
+        GROUP BY destinatario
+        ORDER BY MIN(id)
+        LIMIT :limit
+      )
+    RETURNING id, destinatario, nombre, asunto, mensaje, url, intentos
+"""
+
+
+class OutboxMetrics:
+    """Contadores de envío del proceso actual para la página de rendimiento."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.enviados = 0
+            self.correos = 0
+            self.reintentos = 0
+            self.fallidos = 0
+            self.lotes = 0
+            self.segundos_envio = 0.0
+            self.ultimo_lote = None
+
+    def record_batch(self, rows, emails, retried, failed, seconds):
+        with self._lock:
+            self.enviados += rows
+            self.correos += emails
+            self.reintentos += retried
+            self.fallidos += failed
+            self.lotes += 1
+            self.segundos_envio += seconds
+            self.ultimo_lote = time.time()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'enviados': self.enviados,
+                'correos': self.correos,
+                'coalescidos': self.enviados - self.correos,
+                'reintentos': self.reintentos,
+                'fallidos': self.fallidos,
+                'lotes': self.lotes,
+                'por_segundo': round(self.enviados / self.segundos_envio, 1) if self.segundos_envio else None,
+                'ultimo_lote': self.ultimo_lote,
+            }
+
+
+metrics = OutboxMetrics()
+
+
+def enqueue_emails(recipients, subject, message, url):
+    """
+    Encola un correo por destinatario ((email, nombre, resumen)) en
+    'email_outbox'. Usa la conexión de la solicitud, así que dentro de una
+    transacción de la DAL los correos solo existen si la operación que los
+    genera se confirma.
+
+    Los correos inmediatos esperan 'EMAIL_COALESCE_SECONDS' antes de poder
+    enviarse, para que una ráfaga de eventos llegue en un solo mensaje; los
+    de usuarios con resumen quedan retenidos hasta el job de resumen.
+    """
+    if not recipients:
+        return 0
+
+    if not current_app.config.get('MAIL_USERNAME'):
+        current_app.logger.warning(
+            "Configuración de correo electrónico no completa. No se enviará email.")
+        return 0
+
+    delay = f"+{int(current_app.config.get('EMAIL_COALESCE_SECONDS', 60))} seconds"
+    SQLiteDAL().enqueue_emails(
+        [(email, nombre, subject, message, url, int(resumen), delay)
+         for email, nombre, resumen in recipients])
+    return len(recipients)
+
+
+def _backoff_seconds(intentos, config):
+    base = config.get('EMAIL_OUTBOX_BACKOFF_SECONDS', 30)
+    maximo = config.get('EMAIL_OUTBOX_BACKOFF_MAX_SECONDS', 3600)
+    return min(base * (2 ** intentos), maximo)
+
+
+def _claim_batch(conn, batch_size, stale_seconds):
+    """Reclama atómicamente los correos listos de hasta 'batch_size' destinatarios."""
+    with conn:
+        rows = conn.execute(
+            CLAIM_SQL, {'stale': f"-{int(stale_seconds)} seconds", 'limit': batch_size}).fetchall()
+    return sorted(rows, key=lambda row: row['id'])
+
+
+def _build_message(destinatario, rows):
+    """Un correo por destinatario: si tiene varias notificaciones se agrupan en uno."""
+    first = rows[0]
+    msg = Message(first['asunto'] if len(rows) == 1
+                  else f"Hepta-Conexiones: {len(rows)} notificaciones nuevas",
+                  recipients=[destinatario])
+    if len(rows) == 1:
+        msg.html = render_template('email/notification.html',
+                                   nombre_usuario=first['nombre'],
+                                   mensaje_notificacion=first['mensaje'],
+                                   url_accion=first['url'])
+    else:
+        msg.html = render_template('email/notification_resumen.html',
+                                   nombre_usuario=first['nombre'],
+                                   notificaciones=rows)
+    return msg
+
+
+def _send_batch(conn, smtp, batch):
+    """
+    Envía un lote reclamado por la sesión SMTP 'smtp' y registra el
+    resultado de cada fila. Un rechazo del servidor solo afecta a su
+    destinatario; si se pierde la conexión, el resto del lote se reprograma.
+    Devuelve (filas_enviadas, error_de_conexión).
+    """
+    config = current_app.config
+    max_attempts = config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+    groups = OrderedDict()
+    for row in batch:
+        groups.setdefault(row['destinatario'], []).append(row)
+
+    sent, retry, emails = [], [], 0
+    connection_error = None
+    start = time.perf_counter()
+    for destinatario, rows in groups.items():
+        if connection_error is not None:
+            retry.extend((row, connection_error) for row in rows)
+            continue
+        try:
+            smtp.send(_build_message(destinatario, rows))
+            sent.extend(row['id'] for row in rows)
+            emails += 1
+        except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused) as e:
+            retry.extend((row, str(e)) for row in rows)
+        except (smtplib.SMTPException, OSError) as e:
+            connection_error = str(e)
+            retry.extend((row, connection_error) for row in rows)
+        except Exception as e:
+            # Un mensaje que no se puede construir no debe bloquear el lote.
+            retry.extend((row, str(e)) for row in rows)
+
+    failed = _record_results(conn, sent, retry, max_attempts, config)
+    metrics.record_batch(len(sent), emails, len(retry) - failed, failed,
+                         time.perf_counter() - start)
+    return len(sent), connection_error
+
+
+def _record_results(conn, sent, retry, max_attempts, config):
+    failed = 0
+    with conn:
+        conn.executemany(
+            "UPDATE email_outbox SET estado = 'ENVIADO', fecha_envio = datetime('now'), ultimo_error = NULL WHERE id = ?",
+            [(row_id,) for row_id in sent])
+        for row, error in retry:
+            intentos = row['intentos'] + 1
+            if intentos >= max_attempts:
+                failed += 1
+                conn.execute(
+                    "UPDATE email_outbox SET estado = 'ERROR', intentos = ?, ultimo_error = ? WHERE id = ?",
+                    (intentos, error, row['id']))
+            else:
+                conn.execute(
+                    """UPDATE email_outbox SET estado = 'PENDIENTE', intentos = ?, ultimo_error = ?,
+                              proximo_intento = datetime('now', ?) WHERE id = ?""",
+                    (intentos, error, f"+{_backoff_seconds(row['intentos'], config)} seconds", row['id']))
+    if retry:
+        current_app.logger.warning(
+            f"Bandeja de correo: {len(retry)} envío(s) reprogramados, {failed} descartado(s) tras "
+            f"{max_attempts} intentos.")
+    return failed
+
+
+def drain_outbox(max_batches=None):
+    """
+    Envía los correos pendientes por lotes de 'EMAIL_OUTBOX_BATCH_SIZE'
+    destinatarios reutilizando una única sesión SMTP mientras quede trabajo. Devuelve el
+    número de filas enviadas.
+    """
+    config = current_app.config
+    batch_size = config.get('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    stale_seconds = config.get('EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS', 300)
+    manager = current_app.extensions['sqlite']
+    conn = manager._connect(instrumented=False)
+    total = batches = 0
+    try:
+        batch = _claim_batch(conn, batch_size, stale_seconds)
+        if not batch:
+            return 0
+        with mail.connect() as smtp:
+            while batch:
+                sent, error = _send_batch(conn, smtp, batch)
+                batch = None
+                total += sent
+                batches += 1
+                if error is not None:
+                    # Sin servidor no tiene sentido seguir: las filas ya quedaron
+                    # reprogramadas y se reintentarán en la siguiente pasada.
+                    current_app.logger.error(
+                        f"Error en la sesión SMTP de la bandeja de correo: {error}")
+                    break
+                if max_batches is not None and batches >= max_batches:
+                    break
+                batch = _claim_batch(conn, batch_size, stale_seconds)
+    except (smtplib.SMTPException, OSError) as e:
+        current_app.logger.error(
+            f"No se pudo conectar con el servidor SMTP: {e}")
+        if batch:
+            # El lote reclamado no llegó a enviarse: cuenta como un intento.
+            _record_results(conn, [], [(row, str(e)) for row in batch],
+                            config.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5), config)
+    finally:
+        manager._discard(conn)
+    return total
+
+
+def release_digests():
+    """Libera los correos retenidos de los usuarios que reciben un resumen periódico."""
+    released = SQLiteDAL().release_email_digests()
+    if released:
+        current_app.logger.info(
+            f"Resumen de notificaciones: {released} correo(s) liberados para su envío.")
+    return released
+
+
+def schedule_digest_job(app):
+    """Registra el job que libera los resúmenes de correo en el scheduler."""
+    global _app
+    _app = app
+    minutes = app.config.get('EMAIL_DIGEST_INTERVAL_MINUTES', 60)
+    try:
+        app.scheduler.add_job(
+            id=DIGEST_JOB_ID,
+            func='services.email_outbox_service:scheduled_digest_job',
+            trigger='interval',
+            minutes=minutes,
+            replace_existing=True
+        )
+        app.logger.info(
+            f"Resumen de notificaciones por correo programado cada {minutes} minutos.")
+    except Exception as e:
+        app.logger.error(
+            f"Error al programar el resumen de notificaciones: {e}", exc_info=True)
+
+
+def scheduled_digest_job():
+    if _app is None:
+        return
+    with _app.app_context():
+        release_digests()
+
+
+def purge_sent_emails(keep_days=None):
+    """Elimina los correos enviados con más de 'keep_days' días."""
+    keep_days = current_app.config.get(
+        'EMAIL_OUTBOX_KEEP_DAYS', 7) if keep_days is None else keep_days
+    return SQLiteDAL().purge_sent_emails(keep_days)
+
+
+class OutboxSender:
+    """
+    Hilo demonio que vacía la bandeja de salida. Cada proceso puede tener el
+    suyo: los lotes se reclaman con un único UPDATE ... RETURNING, de modo
+    que dos procesos nunca envían la misma fila, y las filas reclamadas por
+    un proceso que murió se liberan tras 'EMAIL_OUTBOX_CLAIM_TIMEOUT_SECONDS'.
+    """
+
+    def __init__(self, app, poll_interval=2.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_purge = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='email-outbox', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    drain_outbox()
+                    if time.monotonic() - self._last_purge > 3600:
+                        purge_sent_emails()
+                        self._last_purge = time.monotonic()
+                except Exception as e:
+                    current_app.logger.error(
+                        f"Error en el envío de la bandeja de correo: {e}", exc_info=True)
+            self._stop.wait(self.poll_interval)
+
+
+def start_sender(app):
+    """
+    Arranca el hilo de envío si el correo está configurado y el proceso aún
+    no tiene uno. Es uno por proceso aunque se cree más de una aplicación
+    (wsgi.py), y el pid detecta los procesos hijos de un fork, que no heredan
+    el hilo del padre.
+    """
+    global _sender, _sender_pid
+    if not app.config.get('MAIL_USERNAME'):
+        return None
+    if _sender_pid != os.getpid():
+        with _sender_lock:
+            if _sender_pid != os.getpid():
+                _sender = OutboxSender(
+                    app, poll_interval=app.config.get('EMAIL_OUTBOX_POLL_SECONDS', 2.0))
+                _sender.start()
+                _sender_pid = os.getpid()
+    app.extensions['email_outbox'] = _sender
+    return _sender
+
+
+def get_outbox_stats():
+    """Estado de la bandeja y métricas de envío del proceso. Retorna (datos, error)."""
+    dal = SQLiteDAL()
+    try:
+        counts = dal.get_email_outbox_counts()
+    except Exception as e:
+        current_app.logger.error(
+            f"Error al leer el estado de la bandeja de correo: {e}")
+        return None, "No se pudo leer el estado de la bandeja de correo."
+    return {'estados': counts, 'proceso': metrics.snapshot()}, None
@@ -0,0 +1,218 @@
+import json
+import time
+import queue
+import sqlite3
+import threading
+from flask import current_app
+from dal.sqlite_dal import SQLiteDAL
+
+
+TAIL_SQL = """
+    SELECT id, tipo, usuario_id, proyecto_id, datos FROM eventos_tiempo_real
+    WHERE id > ? ORDER BY id LIMIT 500
+"""
+REPLAY_LIMIT = 100
+
+
+def publish(tipo, datos, usuario_ids):
+    """
+    Publica un evento dirigido a cada usuario de 'usuario_ids'. Se escribe
+    con la conexión de la solicitud, así que dentro de una transacción de la
+    DAL solo se entrega si la operación que lo genera se confirma.
+    """
+    if not usuario_ids:
+        return
+    payload = json.dumps(datos, default=str)
+    SQLiteDAL().publish_events(
+        [(tipo, usuario_id, None, payload) for usuario_id in usuario_ids])
+
+
+def publish_connection_event(conexion_id, accion, **datos):
+    """Publica un cambio de una conexión para todos los miembros de su proyecto."""
+    datos.update({'id': conexion_id, 'accion': accion})
+    SQLiteDAL().publish_connection_event(conexion_id, json.dumps(datos, default=str))
+
+
+class Subscription:
+    """Cola de eventos de una conexión SSE."""
+
+    def __init__(self, usuario_id, proyecto_ids, maxsize=200):
+        self.usuario_id = usuario_id
+        # None: el usuario ve todos los proyectos (administradores).
+        self.proyecto_ids = None if proyecto_ids is None else set(proyecto_ids)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.overflow = False
+
+    def matches(self, event):
+        if event['usuario_id'] is not None:
+            return event['usuario_id'] == self.usuario_id
+        return self.proyecto_ids is None or event['proyecto_id'] in self.proyecto_ids
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # El cliente no consume: se le pedirá que se resincronice.
+            self.overflow = True
+
+
+class EventBroker:
+    """
+    Reparte los eventos de 'eventos_tiempo_real' entre las conexiones SSE del
+    proceso. Un único hilo lee la tabla por id creciente mientras haya
+    suscriptores, de modo que el coste en la base de datos no depende del
+    número de clientes y funciona igual con varios procesos de gunicorn o
+    con los hilos de waitress.
+    """
+
+    def __init__(self, app, poll_interval=0.5, keep_seconds=3600):
+        self.app = app
+        self.poll_interval = poll_interval
+        self.keep_seconds = keep_seconds
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_prune = 0.0
+
+    def subscribe(self, usuario_id, proyecto_ids, start_id, max_streams=None):
+        """
+        Registra una suscripción o devuelve None si ya hay 'max_streams'. Si
+        no hay hilo lector, se arranca desde 'start_id', que debe leerse antes
+        de la consulta de reenvío para no perder los eventos intermedios.
+        """
+        subscription = Subscription(usuario_id, proyecto_ids)
+        with self._lock:
+            if max_streams is not None and len(self._subscribers) >= max_streams:
+                return None
+            self._subscribers.add(subscription)
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(
+                    target=self._run, args=(start_id,),
+                    name='eventos-tiempo-real', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def active(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def stop(self):
+        self._stop.set()
+
+    def dispatch(self, events):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for event in events:
+            for subscription in subscribers:
+                if subscription.matches(event):
+                    subscription.put(event)
+
+    def _run(self, last_id):
+        manager = self.app.extensions['sqlite']
+        conn = manager._connect(readonly=True, instrumented=False)
+        try:
+            while not self._stop.is_set():
+                with self._lock:
+                    # Se decide salir con el lock tomado para que 'subscribe'
+                    # no cuente con un hilo que ya está terminando.
+                    if not self._subscribers:
+                        self._thread = None
+                        break
+                try:
+                    events = conn.execute(TAIL_SQL, (last_id,)).fetchall()
+                except sqlite3.Error as e:
+                    self.app.logger.error(f"Error al leer los eventos en tiempo real: {e}")
+                    events = []
+                if events:
+                    last_id = events[-1]['id']
+                    self.dispatch(events)
+                self._maybe_prune()
+                if len(events) < 500:
+                    self._stop.wait(self.poll_interval)
+        finally:
+            manager._discard(conn)
+            with self._lock:
+                if self._thread is threading.current_thread():
+                    self._thread = None
+
+    def _maybe_prune(self):
+        if time.monotonic() - self._last_prune < 300:
+            return
+        self._last_prune = time.monotonic()
+        with self.app.app_context():
+            try:
+                SQLiteDAL().prune_events(self.keep_seconds)
+            except sqlite3.Error as e:
+                self.app.logger.error(f"Error al depurar los eventos en tiempo real: {e}")
+
+
+def init_app(app):
+    app.extensions['event_broker'] = EventBroker(
+        app,
+        poll_interval=app.config.get('SSE_POLL_SECONDS', 0.5),
+        keep_seconds=app.config.get('SSE_KEEP_SECONDS', 3600))
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['tipo']}\ndata: {event['datos']}\n\n"
+
+
+def open_stream(usuario_id, proyecto_ids, last_event_id=None):
+    """
+    Prepara el flujo SSE de un usuario. Devuelve un generador o None si el
+    proceso ya atiende 'SSE_MAX_STREAMS' conexiones (cada una ocupa un hilo
+    del servidor) o si el canal está desactivado ('SSE_MAX_STREAMS' = 0). Los eventos perdidos desde 'last_event_id' se reenvían
+    antes de empezar; si son más de los que caben en una consulta, se pide
+    al cliente que se resincronice. El generador no usa el contexto de la
+    solicitud.
+    """
+    config = current_app.config
+    broker = current_app.extensions['event_broker']
+    dal = SQLiteDAL()
+    # Se lee antes de suscribirse: lo posterior lo entrega el hilo lector y
+    # lo anterior el reenvío, de modo que no queda ningún hueco entre ambos.
+    start_id = dal.get_last_event_id()
+    subscription = broker.subscribe(usuario_id, proyecto_ids, start_id,
+                                    max_streams=config.get('SSE_MAX_STREAMS', 8))
+    if subscription is None:
+        return None
+
+    pending = []
+    if last_event_id is not None:
+        pending = dal.get_events_since(last_event_id, usuario_id, proyecto_ids,
+                                       limit=REPLAY_LIMIT)
+        subscription.overflow = len(pending) >= REPLAY_LIMIT
+    return _stream(broker, subscription, pending,
+                   heartbeat=config.get('SSE_HEARTBEAT_SECONDS', 15),
+                   max_seconds=config.get('SSE_MAX_SECONDS', 90))
+
+
+def _stream(broker, subscription, pending, heartbeat, max_seconds):
+    sent = set()
+    try:
+        yield "retry: 3000\n\n"
+        for event in pending:
+            sent.add(event['id'])
+            yield format_event(event)
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            if subscription.overflow:
+                subscription.overflow = False
+                yield "event: resync\ndata: {}\n\n"
+            try:
+                event = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                # Comentario SSE: mantiene viva la conexión y detecta clientes caídos.
+                yield ": ping\n\n"
+                continue
+            if event['id'] not in sent:
+                yield format_event(event)
+        # Al cerrar, el navegador se reconecta con 'Last-Event-ID'.
+    finally:
+        broker.unsubscribe(subscription)
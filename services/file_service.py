@@ -3,6 +3,7 @@ from werkzeug.utils import secure_filename
 from flask import current_app, abort
 from dal.sqlite_dal import SQLiteDAL
 from db import log_action
+from services.event_service import publish_connection_event
 
 ALLOWED_EXTENSIONS = {
     'j1', 'j10', 'j100', 'j100000007', 'j1001', 'j1002', 'j1003', 'j1004', 'j1006',
@@ -124,7 +125,9 @@ def upload_file(conexion_id, user_id, file, tipo_archivo):
         os.makedirs(upload_path, exist_ok=True)
         file.save(os.path.join(upload_path, filename))
 
-        dal.create_archivo(conexion_id, user_id, tipo_archivo, filename)
+        with dal.transaction():
+            dal.create_archivo(conexion_id, user_id, tipo_archivo, filename)
+            publish_connection_event(conexion_id, 'archivo', tipo_archivo=tipo_archivo)
         log_action('SUBIR_ARCHIVO', user_id, 'archivos', conexion_id,
                    f"Archivo '{filename}' ({tipo_archivo}) subido.")
         return True, f"Archivo '{tipo_archivo}' subido con éxito."
@@ -176,16 +179,16 @@ def delete_file(conexion_id, archivo_id, current_user, user_roles):
         return False, 'No tienes permiso para eliminar este archivo.'
 
     try:
-        # Eliminar de la base de datos primero
-        dal.delete_archivo(archivo_id)
+        # Si falla la eliminación del archivo en disco, se revierte el borrado en la BD.
+        with dal.transaction():
+            dal.delete_archivo(archivo_id)
 
-        # Eliminar del sistema de archivos
-        safe_filename = secure_filename(archivo['nombre_archivo'])
-        file_path = os.path.join(
-            current_app.config['UPLOAD_FOLDER'], str(conexion_id), safe_filename)
+            safe_filename = secure_filename(archivo['nombre_archivo'])
+            file_path = os.path.join(
+                current_app.config['UPLOAD_FOLDER'], str(conexion_id), safe_filename)
 
-        if os.path.exists(file_path):
-            os.remove(file_path)
+            if os.path.exists(file_path):
+                os.remove(file_path)
 
         log_action('ELIMINAR_ARCHIVO', current_user['id'], 'archivos', archivo_id,
                    f"Archivo '{archivo['nombre_archivo']}' eliminado de la conexión {conexion_id}.")
@@ -193,5 +196,4 @@ def delete_file(conexion_id, archivo_id, current_user, user_roles):
     except Exception as e:
         current_app.logger.error(
             f"Error al eliminar archivo {archivo_id}: {e}", exc_info=True)
-        # Podríamos considerar revertir la eliminación de la BD aquí si la eliminación del archivo falla.
         return False, 'Ocurrió un error interno al eliminar el archivo.'
@@ -35,6 +35,7 @@ def importar_conexiones_from_file(file, proyecto_id, user_id):
         existing_codes = {row['codigo_conexion'] for row in cursor.fetchall()}
 
         imported_count = 0
+        importadas = []
         error_rows = []
 
         for index, row in df.iterrows():
@@ -110,10 +111,12 @@ def importar_conexiones_from_file(file, proyecto_id, user_id):
                 sql_insert_historial = "INSERT INTO historial_estados (conexion_id, usuario_id, estado) VALUES (?, ?, ?)"
                 cursor.execute(sql_insert_historial,
                                (new_conexion_id, user_id, 'SOLICITADO'))
+                cursor.execute(
+                    "INSERT INTO conexion_ciclo (conexion_id, fecha_solicitado) VALUES (?, CURRENT_TIMESTAMP)",
+                    (new_conexion_id,))
 
                 existing_codes.add(codigo_conexion_final)
-                log_action('IMPORTAR_CONEXION', user_id, 'conexiones', new_conexion_id,
-                           f"Conexión '{codigo_conexion_final}' importada en proyecto '{proyecto['nombre']}'.")
+                importadas.append((new_conexion_id, codigo_conexion_final))
                 imported_count += 1
 
             except Exception as row_e:
@@ -123,6 +126,12 @@ def importar_conexiones_from_file(file, proyecto_id, user_id):
                     f"Error al importar fila {index+2}: {row_e}", exc_info=True)
 
         db.commit()
+
+        # La auditoría se registra una vez confirmada la importación, fuera de
+        # la transacción de escritura.
+        for new_conexion_id, codigo_conexion_final in importadas:
+            log_action('IMPORTAR_CONEXION', user_id, 'conexiones', new_conexion_id,
+                       f"Conexión '{codigo_conexion_final}' importada en proyecto '{proyecto['nombre']}'.")
         return imported_count, error_rows, None
 
     except pd.errors.EmptyDataError:
@@ -1,7 +1,11 @@
 import os
+import re
 import json
+import sqlite3
 from flask import current_app, g, session
-from dal.sqlite_dal import SQLiteDAL
+from markupsafe import Markup, escape
+from dal.sqlite_dal import SQLiteDAL, SEARCH_INDEXES
+from utils.lru_cache import LRUCache
 
 
 def get_catalogo_data(preselect_project_id):
@@ -32,13 +36,196 @@ def get_catalogo_data(preselect_project_id):
     }
 
 
-def search_conexiones(query):
+# Marcas de resaltado que devuelve FTS5; son caracteres de control que no
+# aparecen en el texto, de modo que se puede escapar todo y luego cambiarlas
+# por <mark>.
+_MARCAS = ('\x02', '\x03')
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_PAGE_SIZE = 100
+_MAX_SEARCH_TOKENS = 10
+SEARCH_CACHE_TIMEOUT = 300
+MIN_TRIGRAM_LENGTH = 3
+
+
+def init_app(app):
+    app.extensions['search_cache'] = LRUCache(
+        max_entries=app.config.get('SEARCH_CACHE_MAX_ENTRIES', 512),
+        ttl=app.config.get('SEARCH_CACHE_TTL', SEARCH_CACHE_TIMEOUT))
+
+
+def _get_search_cache():
+    return current_app.extensions['search_cache']
+
+
+def get_search_cache_stats():
+    """Contadores de la caché de búsqueda de este proceso."""
+    return _get_search_cache().stats()
+
+
+def normalize_search_query(query):
+    """Texto de búsqueda sin espacios repetidos y en minúsculas (los índices FTS no distinguen mayúsculas)."""
+    return ' '.join((query or '').split()).casefold()
+
+
+def build_fts_query(query):
     """
-    Realiza una búsqueda de conexiones utilizando la capa DAL.
+    Convierte el texto del usuario en una expresión FTS5: cada palabra pasa a
+    ser un prefijo entrecomillado y se exigen todas, en cualquier orden. Los
+    signos de puntuación se descartan, así que la entrada nunca produce un
+    error de sintaxis. Devuelve None si no queda ninguna palabra.
     """
-    if not query:
-        return []
+    tokens = re.findall(r'\w+', query or '')[:_MAX_SEARCH_TOKENS]
+    if not tokens:
+        return None
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def build_trigram_query(query):
+    """
+    Expresión FTS5 para el índice de trigramas: cada término separado por
+    espacios se busca como subcadena (signos incluidos) y se exigen todos.
+    Devuelve None si algún término es demasiado corto para el tokenizador.
+    """
+    terms = (query or '').split()[:_MAX_SEARCH_TOKENS]
+    if not terms or any(len(term) < MIN_TRIGRAM_LENGTH for term in terms):
+        return None
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def route_search_query(query):
+    """
+    Elige los índices de 'query' en orden de preferencia, como pares
+    (índice, expresión FTS5). Los términos con dígitos o signos (códigos y
+    perfiles como 'W14X22' o 'VIGA-COLUMNA') van primero al índice de
+    trigramas, que encuentra subcadenas; el texto normal va primero al de
+    palabras. El otro índice queda como alternativa si el primero no
+    encuentra nada: el de palabras no contiene tipos, tipologías ni perfiles
+    y el de trigramas no contiene la descripción.
+    """
+    palabras = build_fts_query(query)
+    trigramas = build_trigram_query(query)
+    if trigramas and any(not term.isalpha() for term in query.split()):
+        rutas = [('trigramas', trigramas), ('palabras', palabras)]
+    else:
+        rutas = [('palabras', palabras), ('trigramas', trigramas)]
+    return [(indice, term) for indice, term in rutas if term]
+
+
+def _resaltar(texto):
+    if not texto:
+        return Markup('')
+    abre, cierra = _MARCAS
+    return Markup(str(escape(texto)).replace(abre, '<mark>').replace(cierra, '</mark>'))
+
+
+def _encode_search_cursor(indice, row):
+    return f"{indice}:{row['score']!r}:{row['id']}"
+
+
+def _decode_search_cursor(cursor):
+    """(índice, (puntuación, id)) del cursor o None si no es válido."""
+    try:
+        indice, score, conexion_id = (cursor or '').split(':')
+        if indice not in SEARCH_INDEXES:
+            return None
+        return indice, (float(score), int(conexion_id))
+    except ValueError:
+        return None
+
+
+def get_search_filters(args):
+    """Filtros de faceta de la búsqueda a partir de los parámetros de la petición."""
+    return {
+        'estado': args.get('estado') or None,
+        'tipo': args.get('tipo') or None,
+        'proyecto_id': args.get('proyecto_id', type=int),
+    }
+
+
+def _search_scope():
+    """
+    (usuario_id, proyectos_version) del usuario actual para acotar la
+    búsqueda a sus proyectos, o (None, None) si es administrador y ve todos.
+    """
+    if 'ADMINISTRADOR' in session.get('user_roles', []):
+        return None, None
+    return g.user['id'], g.user.get('proyectos_version', 0)
+
+
+def _run_search(query, after, indice_cursor, limit, filtros, usuario_id):
+    rutas = route_search_query(query)
+    if indice_cursor:
+        rutas = [ruta for ruta in rutas if ruta[0] == indice_cursor]
+    if not rutas:
+        return {'resultados': [], 'facetas': None, 'total': 0, 'next_cursor': None, 'indice': None}
 
     dal = SQLiteDAL()
-    # La sanitización para FTS se hará en la DAL para mantener la lógica de BD encapsulada.
-    return dal.search_conexiones_fts(query)
+    for indice, term in rutas:
+        # Se pide una fila de más para saber si existe una página siguiente.
+        rows = dal.search_conexiones_fts(
+            term, limit + 1, after, filtros, marcas=_MARCAS, indice=indice, usuario_id=usuario_id)
+        if rows or after is not None:
+            break
+    facetas = None
+    if after is None:
+        facetas = {'estado': [], 'tipo': [], 'proyecto': []}
+        for row in dal.get_search_facets(term, filtros, indice=indice, usuario_id=usuario_id) if rows else []:
+            faceta = {'valor': row['valor'], 'total': row['total']}
+            if row['faceta'] == 'proyecto':
+                faceta['nombre'] = row['nombre']
+            facetas[row['faceta']].append(faceta)
+
+    resultados = []
+    for row in rows[:limit]:
+        resultado = dict(row)
+        resultado['codigo_resaltado'] = _resaltar(row['codigo_resaltado'])
+        resultado['fragmento'] = _resaltar(row['fragmento'])
+        resultados.append(resultado)
+    return {
+        'resultados': resultados,
+        'facetas': facetas,
+        'total': sum(f['total'] for f in facetas['estado']) if facetas else None,
+        'next_cursor': _encode_search_cursor(indice, rows[limit - 1]) if len(rows) > limit else None,
+        'indice': indice,
+    }
+
+
+def search_conexiones(query, cursor=None, limit=SEARCH_PAGE_SIZE, filtros=None):
+    """
+    Busca conexiones por código, descripción, tipo, tipología y perfiles, de
+    la más relevante a la menos, en el índice que elige 'route_search_query'.
+    Los usuarios que no son administradores solo ven las conexiones de sus
+    proyectos: la pertenencia se filtra en la propia consulta FTS.
+    La paginación es por cursor ('next_cursor' de la página anterior, que
+    recuerda el índice usado), así que el coste de cada página no depende de
+    cuántas haya antes. Las facetas por estado, tipo y proyecto y el total
+    solo se calculan en la primera página. 'filtros' admite 'estado', 'tipo'
+    y 'proyecto_id'.
+
+    Las páginas se guardan en caché con el texto normalizado, el usuario y
+    la versión de sus proyectos y la versión de datos de 'conexiones' en la
+    clave. Los triggers suben esa versión con cada escritura, así que una
+    búsqueda repetida no consulta los índices FTS hasta que cambia algo;
+    'SEARCH_CACHE_TTL' solo acota cuánto vive una entrada sin usar.
+    Retorna (datos, mensaje_error).
+    """
+    query = normalize_search_query(query)
+    after = indice_cursor = None
+    if cursor:
+        decoded = _decode_search_cursor(cursor)
+        if decoded:
+            indice_cursor, after = decoded
+    limit = max(1, min(limit or SEARCH_PAGE_SIZE, MAX_SEARCH_PAGE_SIZE))
+    filtros = filtros or {}
+    usuario_id, proyectos_version = _search_scope()
+
+    try:
+        key = ('conexiones', SQLiteDAL().get_data_version('conexiones'), usuario_id,
+               proyectos_version, query, indice_cursor, after, limit, tuple(sorted(filtros.items())))
+        data = _get_search_cache().get_or_compute(
+            key, lambda: _run_search(query, after, indice_cursor, limit, filtros, usuario_id))
+        return data, None
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error en la búsqueda de conexiones '{query}': {e}")
+        return {'resultados': [], 'facetas': None, 'total': 0, 'next_cursor': None, 'indice': None}, \
+            "No se pudo completar la búsqueda."
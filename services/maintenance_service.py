@@ -0,0 +1,177 @@
+import os
+import json
+import time
+import sqlite3
+from flask import current_app
+from dal.sqlite_dal import SQLiteDAL
+
+
+MAINTENANCE_JOB_ID = 'db_maintenance'
+
+# Aplicación registrada al programar el job. Los jobs de APScheduler se
+# ejecutan en hilos sin contexto de aplicación y se guardan por referencia
+# textual, así que no pueden recibir la aplicación como argumento.
+_app = None
+
+
+def _database_stats(conn, path):
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    wal_path = f"{path}-wal"
+    return {
+        'tamano': page_size * page_count,
+        'wal': os.path.getsize(wal_path) if os.path.exists(wal_path) else 0,
+        'paginas_libres': freelist,
+    }
+
+
+def run_maintenance(vacuum_pages=None, analysis_limit=None):
+    """
+    Ejecuta una pasada de mantenimiento sobre una conexión dedicada:
+
+    1. 'ANALYZE' completo si 'sqlite_stat1' aún no existe; en otro caso
+       'PRAGMA optimize', que solo reanaliza las tablas que lo necesitan.
+    2. Checkpoint PASSIVE y después TRUNCATE del WAL.
+    3. 'PRAGMA incremental_vacuum' limitado a 'vacuum_pages' páginas, si la
+       base usa auto_vacuum=INCREMENTAL.
+
+    La duración y el tamaño de la base, del WAL y de la lista de páginas
+    libres antes y después se guardan en 'mantenimiento_bd'. Devuelve el
+    registro de la ejecución como diccionario.
+    """
+    config = current_app.config
+    if vacuum_pages is None:
+        vacuum_pages = config.get('DB_MAINTENANCE_VACUUM_PAGES', 2000)
+    if analysis_limit is None:
+        analysis_limit = config.get('DB_MAINTENANCE_ANALYSIS_LIMIT', 1000)
+
+    manager = current_app.extensions['sqlite']
+    conn = manager._connect(instrumented=False)
+    start = time.perf_counter()
+    detalles = {}
+    error = None
+    antes = despues = {}
+    try:
+        antes = _database_stats(conn, manager.path)
+
+        has_stats = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+        conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}").fetchall()
+        if has_stats:
+            conn.execute("PRAGMA optimize").fetchall()
+            detalles['analisis'] = 'optimize'
+        else:
+            conn.execute("ANALYZE")
+            detalles['analisis'] = 'analyze'
+        conn.commit()
+
+        for mode in ('PASSIVE', 'TRUNCATE'):
+            busy, log_frames, checkpointed = conn.execute(
+                f"PRAGMA wal_checkpoint({mode})").fetchone()
+            detalles[f'checkpoint_{mode.lower()}'] = {
+                'busy': busy, 'log': log_frames, 'checkpointed': checkpointed}
+
+        auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        if auto_vacuum == 2:
+            conn.execute(
+                f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            detalles['incremental_vacuum'] = int(vacuum_pages)
+        else:
+            detalles['incremental_vacuum'] = None
+            if antes['paginas_libres']:
+                current_app.logger.info(
+                    "La base de datos no usa auto_vacuum=INCREMENTAL; ejecute "
+                    "'flask db-maintenance --convert-vacuum' en una ventana de mantenimiento.")
+
+        despues = _database_stats(conn, manager.path)
+    except sqlite3.Error as e:
+        error = str(e)
+        current_app.logger.error(
+            f"Error durante el mantenimiento de la base de datos: {e}")
+    finally:
+        duracion_ms = round((time.perf_counter() - start) * 1000, 2)
+
+    registro = {
+        'duracion_ms': duracion_ms,
+        'tamano_antes': antes.get('tamano'),
+        'tamano_despues': despues.get('tamano'),
+        'wal_antes': antes.get('wal'),
+        'wal_despues': despues.get('wal'),
+        'paginas_libres_antes': antes.get('paginas_libres'),
+        'paginas_libres_despues': despues.get('paginas_libres'),
+        'detalles': json.dumps(detalles),
+        'error': error,
+    }
+    try:
+        with conn:
+            conn.execute(
+                """INSERT INTO mantenimiento_bd (duracion_ms, tamano_antes, tamano_despues, wal_antes, wal_despues,
+                                                 paginas_libres_antes, paginas_libres_despues, detalles, error)
+                   VALUES (:duracion_ms, :tamano_antes, :tamano_despues, :wal_antes, :wal_despues,
+                           :paginas_libres_antes, :paginas_libres_despues, :detalles, :error)""",
+                registro)
+    except sqlite3.Error as e:
+        current_app.logger.error(
+            f"No se pudo registrar la ejecución del mantenimiento: {e}")
+    finally:
+        manager._discard(conn)
+
+    current_app.logger.info(
+        f"Mantenimiento de la base de datos completado en {duracion_ms} ms.")
+    return registro
+
+
+def convert_to_incremental_vacuum():
+    """
+    Activa auto_vacuum=INCREMENTAL en una base existente. Requiere un VACUUM
+    completo que reescribe el archivo y bloquea las escrituras mientras dura,
+    por lo que solo se ejecuta a mano desde la línea de comandos.
+    """
+    manager = current_app.extensions['sqlite']
+    conn = manager._connect(instrumented=False)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+    finally:
+        manager._discard(conn)
+
+
+def get_maintenance_runs(limit=10):
+    dal = SQLiteDAL()
+    try:
+        return dal.get_maintenance_runs(limit), None
+    except Exception as e:
+        current_app.logger.error(
+            f"Error al leer el historial de mantenimiento: {e}")
+        return [], "No se pudo leer el historial de mantenimiento."
+
+
+def schedule_maintenance_job(app):
+    """Registra el job de mantenimiento en el scheduler de la aplicación."""
+    global _app
+    _app = app
+    hours = app.config.get('DB_MAINTENANCE_INTERVAL_HOURS', 6)
+    try:
+        app.scheduler.add_job(
+            id=MAINTENANCE_JOB_ID,
+            func='services.maintenance_service:scheduled_maintenance_job',
+            trigger='interval',
+            hours=hours,
+            replace_existing=True
+        )
+        app.logger.info(
+            f"Mantenimiento de la base de datos programado cada {hours} horas.")
+    except Exception as e:
+        app.logger.error(
+            f"Error al programar el mantenimiento de la base de datos: {e}", exc_info=True)
+
+
+def scheduled_maintenance_job():
+    if _app is None:
+        return
+    with _app.app_context():
+        run_maintenance()
@@ -0,0 +1,100 @@
+import json
+from flask import current_app, url_for
+from dal.sqlite_dal import SQLiteDAL
+import services.email_outbox_service as email_outbox_s
+import services.event_service as event_s
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+
+def notify_users(conexion, message, url_suffix, roles_to_notify, exclude_user_id=None):
+    """
+    Notifica a cada miembro del proyecto de la conexión que tenga alguno de
+    los roles indicados y encola los correos correspondientes.
+
+    'conexion' es la fila (o un diccionario) con 'id', 'proyecto_id' y
+    'codigo_conexion' que el llamador ya tiene cargada. Si un destinatario
+    tiene una notificación no leída de la misma conexión creada hace menos de
+    'NOTIFICATION_COALESCE_SECONDS', el evento se acumula en ella en lugar de
+    crear otra fila. Las notificaciones nuevas, los eventos en tiempo real y
+    los correos se insertan con un 'executemany' cada uno; dentro de una transacción de la DAL se
+    confirman junto con el resto de la operación.
+    Devuelve el número de destinatarios.
+    """
+    dal = SQLiteDAL()
+    users_to_notify = dal.get_users_for_notification(
+        conexion['proyecto_id'], roles_to_notify, exclude_user_id)
+    if not users_to_notify:
+        return 0
+
+    full_url = url_for('conexiones.detalle_conexion',
+                       conexion_id=conexion['id'], _external=True) + url_suffix
+    window = current_app.config.get('NOTIFICATION_COALESCE_SECONDS', 600)
+    coalesced = set()
+    if window:
+        coalesced = dal.coalesce_notifications(
+            [user['id'] for user in users_to_notify], conexion['id'], message, full_url, window)
+    nuevas = [(user['id'], message, full_url, conexion['id'])
+              for user in users_to_notify if user['id'] not in coalesced]
+    if nuevas:
+        dal.create_notifications(nuevas)
+
+    # Aviso en tiempo real: 'nueva' indica si el contador de no leídas sube.
+    evento = {'conexion_id': conexion['id'], 'mensaje': message, 'url': full_url}
+    event_s.publish('notificacion', dict(evento, nueva=True),
+                    [user['id'] for user in users_to_notify if user['id'] not in coalesced])
+    event_s.publish('notificacion', dict(evento, nueva=False), list(coalesced))
+
+    # Cada evento conserva su correo; se agrupan por destinatario al enviarse.
+    email_recipients = [(user['email'], user['nombre_completo'], bool(user['email_resumen']))
+                        for user in users_to_notify
+                        if user['email'] and user['email_notif_estado']]
+    email_outbox_s.enqueue_emails(
+        email_recipients,
+        subject=f"Hepta-Conexiones: Notificación sobre {conexion['codigo_conexion']}",
+        message=message,
+        url=full_url
+    )
+    return len(users_to_notify)
+
+
+def get_notifications(user_id, cursor=None, limit=DEFAULT_PAGE_SIZE, unread_only=True):
+    """
+    Devuelve una página de notificaciones del usuario, de la más reciente a
+    la más antigua. La paginación es por cursor: 'cursor' es el id de la
+    última notificación de la página anterior, de modo que el coste no
+    depende de la página pedida. Retorna (datos, mensaje_error).
+    """
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    dal = SQLiteDAL()
+    try:
+        # Se pide una fila de más para saber si existe una página siguiente.
+        rows = dal.get_notifications_page(user_id, cursor, limit + 1, unread_only)
+        items = [dict(row) for row in rows[:limit]]
+        for item in items:
+            item['detalles'] = json.loads(item['detalles']) if item['detalles'] else []
+        return {
+            'items': items,
+            'next_cursor': items[-1]['id'] if len(rows) > limit else None,
+            'unread_count': dal.get_unread_notification_count(user_id),
+        }, None
+    except Exception as e:
+        current_app.logger.error(
+            f"Error al obtener las notificaciones del usuario {user_id}: {e}")
+        return None, "No se pudieron obtener las notificaciones."
+
+
+def mark_notifications_read(user_id, notification_ids=None):
+    """
+    Marca como leídas las notificaciones indicadas (o todas) del usuario.
+    Retorna (True, número_marcadas) o (False, mensaje_error).
+    """
+    dal = SQLiteDAL()
+    try:
+        return True, dal.mark_notifications_read(user_id, notification_ids)
+    except Exception as e:
+        current_app.logger.error(
+            f"Error al marcar las notificaciones del usuario {user_id} como leídas: {e}")
+        return False, "No se pudieron marcar las notificaciones como leídas."
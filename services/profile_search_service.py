@@ -0,0 +1,163 @@
+"""
+Índice en memoria para el autocompletado de perfiles ('/api/perfiles/buscar').
+
+Cada proceso construye un índice con los alias de 'alias_perfiles' y los
+perfiles del catálogo 'perfiles_propiedades.json'. Las claves se normalizan
+sin espacios ni guiones y en minúsculas, de modo que 'IPE300' encuentra
+'IPE 300' y 'W12x26' encuentra 'W-12x26'. Cada clave se indexa por todas sus
+subcadenas de hasta tres caracteres: una consulta corta se resuelve con una
+sola búsqueda en el diccionario y una larga cruza las listas de sus
+trigramas y comprueba la subcadena solo en esos candidatos.
+
+Durante 'PROFILE_INDEX_TTL' segundos el índice se usa sin tocar el disco ni
+la base de datos. Pasado ese tiempo se revalida con la fecha de modificación
+del JSON y la versión de 'alias_perfiles' en 'versiones_datos', que los
+triggers incrementan con cada escritura; solo se reconstruye si alguna cambió.
+'alias_service' lo invalida además al escribir, para que el proceso que hace
+el cambio lo vea en la siguiente petición.
+"""
+import json
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from flask import current_app
+from dal.sqlite_dal import SQLiteDAL
+
+MAX_RESULTS = 10
+GRAM_SIZE = 3
+
+
+def normalize_profile(text):
+    """Clave de búsqueda de un perfil: sin espacios ni guiones y en minúsculas."""
+    return re.sub(r'[\s-]', '', text or '').lower()
+
+
+def _grams(key, size):
+    return {key[i:i + size] for i in range(len(key) - size + 1)}
+
+
+class ProfileIndex:
+    """
+    Entradas {'label', 'value'} ordenadas por 'label' y listas de posiciones
+    por cada subcadena de 1 a GRAM_SIZE caracteres de sus claves.
+    """
+
+    def __init__(self, entries, keys):
+        self.entries = entries
+        self.keys = keys
+        self.postings = defaultdict(set)
+        for position, entry_keys in enumerate(keys):
+            for key in entry_keys:
+                for size in range(1, GRAM_SIZE + 1):
+                    for gram in _grams(key, size):
+                        self.postings[gram].add(position)
+
+    def search(self, query, limit=MAX_RESULTS):
+        normalized = normalize_profile(query)
+        if not normalized:
+            return []
+        if len(normalized) <= GRAM_SIZE:
+            positions = self.postings.get(normalized, ())
+        else:
+            grams = sorted(_grams(normalized, GRAM_SIZE),
+                           key=lambda gram: len(self.postings.get(gram, ())))
+            positions = set(self.postings.get(grams[0], ()))
+            for gram in grams[1:]:
+                positions &= self.postings.get(gram, set())
+                if not positions:
+                    break
+            positions = [p for p in positions
+                         if any(normalized in key for key in self.keys[p])]
+        # Las posiciones siguen el orden alfabético de las etiquetas.
+        return [self.entries[p] for p in sorted(positions)[:limit]]
+
+
+class ProfileIndexHolder:
+    """Índice del proceso y las versiones de los datos con que se construyó."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.index = None
+        self.version = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, current_version, build):
+        """
+        Devuelve el índice; pasado 'ttl' compara 'current_version()' con la
+        versión guardada y lo reconstruye con 'build()' si cambió.
+        """
+        now = time.monotonic()
+        if self.index is not None and now - self.checked_at < self.ttl:
+            return self.index
+        with self._lock:
+            version = current_version()
+            if self.index is None or self.version != version:
+                self.index = build()
+                self.version = version
+            self.checked_at = now
+            return self.index
+
+    def invalidate(self):
+        with self._lock:
+            self.index = None
+            self.version = None
+
+
+def init_app(app):
+    app.extensions['profile_index'] = ProfileIndexHolder(
+        ttl=app.config.get('PROFILE_INDEX_TTL', 0 if app.testing else 5.0))
+
+
+def _catalog_path():
+    return os.path.join(current_app.root_path, 'perfiles_propiedades.json')
+
+
+def _current_version():
+    try:
+        mtime = os.stat(_catalog_path()).st_mtime_ns
+    except OSError:
+        mtime = None
+    return SQLiteDAL().get_data_version('alias_perfiles'), mtime
+
+
+def _build_index():
+    entries = {}
+    for row in SQLiteDAL().get_all_aliases():
+        nombre = row['nombre_perfil']
+        label = f"{row['alias']} ({nombre})" if row['alias'] else nombre
+        entries[nombre] = ({'label': label, 'value': nombre},
+                           {normalize_profile(nombre), normalize_profile(row['alias'])} - {''})
+
+    try:
+        with open(_catalog_path(), 'r', encoding='utf-8') as f:
+            catalogo = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError) as e:
+        current_app.logger.error(
+            f"No se pudo cargar 'perfiles_propiedades.json' para el índice de perfiles: {e}")
+        catalogo = {}
+    for nombre in catalogo:
+        entries.setdefault(nombre, ({'label': nombre, 'value': nombre}, {normalize_profile(nombre)}))
+
+    ordered = sorted(entries.values(), key=lambda item: item[0]['label'])
+    return ProfileIndex([entry for entry, _ in ordered], [keys for _, keys in ordered])
+
+
+def get_profile_index():
+    """Índice vigente del proceso; se reconstruye si cambiaron los alias o el catálogo."""
+    return current_app.extensions['profile_index'].get(_current_version, _build_index)
+
+
+def invalidate_profile_index():
+    current_app.extensions['profile_index'].invalidate()
+
+
+def search_profiles(query):
+    """Hasta MAX_RESULTS perfiles cuya clave contiene 'query', por orden de etiqueta."""
+    try:
+        return get_profile_index().search(query)
+    except Exception as e:
+        current_app.logger.error(f"Error en la búsqueda de perfiles '{query}': {e}")
+        return []
@@ -2,8 +2,11 @@ import os
 import re
 from collections import defaultdict
 from datetime import datetime, timedelta
+from flask import current_app
 from dal.sqlite_dal import SQLiteDAL
 from db import log_action
+from services.dashboard_service import clear_dashboard_cache
+import services.analytics_service as analytics_s
 
 
 def get_logs():
@@ -87,6 +90,47 @@ def get_audit_data(page, per_page, filtro_usuario_id, filtro_accion):
     }
 
 
+def get_request_profiles():
+    """Devuelve las solicitudes más lentas registradas por la instrumentación SQL."""
+    profiler = current_app.extensions.get('sql_profiler')
+    if profiler is None:
+        return [], "La instrumentación SQL está desactivada. Active 'SQL_PROFILING' en la configuración para registrar solicitudes."
+    return profiler.slowest(), None
+
+
+def clear_request_profiles(user_id):
+    profiler = current_app.extensions.get('sql_profiler')
+    if profiler is None:
+        return False, "La instrumentación SQL está desactivada."
+    profiler.clear()
+    log_action('LIMPIAR_PERFILES_SQL', user_id, 'sistema',
+               None, "Limpió el registro de solicitudes lentas.")
+    return True, "Registro de solicitudes lentas limpiado."
+
+
+def get_slow_queries(limit=100):
+    """Devuelve las consultas lentas más recientes del búfer circular."""
+    if current_app.extensions.get('slow_queries') is None:
+        return [], "El registro de consultas lentas está desactivado. Configure 'SLOW_QUERY_MS' para activarlo."
+    dal = SQLiteDAL()
+    try:
+        return dal.get_slow_queries(limit), None
+    except Exception as e:
+        current_app.logger.error(f"Error al leer las consultas lentas: {e}")
+        return [], "No se pudo leer el registro de consultas lentas."
+
+
+def clear_slow_queries(user_id):
+    dal = SQLiteDAL()
+    try:
+        dal.clear_slow_queries()
+        log_action('LIMPIAR_CONSULTAS_LENTAS', user_id, 'sistema',
+                   None, "Limpió el registro de consultas lentas.")
+        return True, "Registro de consultas lentas limpiado."
+    except Exception:
+        return False, "Ocurrió un error al limpiar el registro de consultas lentas."
+
+
 def get_config_data():
     dal = SQLiteDAL()
     return dal.get_all_config()
@@ -106,29 +150,59 @@ def update_config(form_data, user_id):
         return False, "Ocurrió un error al guardar la configuración."
 
 
-def get_efficiency_data():
+def rebuild_connection_cycles():
+    """Reconstruye 'conexion_ciclo' desde el historial. Devuelve (filas, error)."""
+    dal = SQLiteDAL()
+    try:
+        with dal.transaction():
+            count = dal.rebuild_conexion_ciclo()
+    except Exception as e:
+        current_app.logger.error(f"Error al reconstruir el ciclo de las conexiones: {e}")
+        return 0, "No se pudo reconstruir el ciclo de las conexiones."
+    clear_dashboard_cache()
+    analytics_s.clear_analytics_cache()
+    return count, None
+
+
+def get_efficiency_data(date_start=None, date_end=None):
+    """
+    Datos de la página de eficiencia para el rango [date_start, date_end]
+    ('YYYY-MM-DD'; por defecto, los últimos 30 días). Devuelve (datos, error).
+    """
+    try:
+        start = datetime.strptime(date_start, '%Y-%m-%d') if date_start else datetime.now() - timedelta(days=30)
+        end = datetime.strptime(date_end, '%Y-%m-%d') if date_end else datetime.now()
+    except ValueError:
+        return None, "Rango de fechas no válido."
+    if start.date() > end.date():
+        return None, "La fecha de inicio no puede ser posterior a la fecha de fin."
+    # strptime acepta '2024-1-5'; SQLite solo entiende las fechas con ceros.
+    filters = {'start': start.strftime('%Y-%m-%d'), 'end': end.strftime('%Y-%m-%d')}
+
     dal = SQLiteDAL()
-    kpis = dal.get_efficiency_kpis()
+    kpis = dal.get_efficiency_kpis(filters['start'], filters['end'])
 
-    # This part will be fixed in a later step, as it requires a new DAL method
-    time_by_state = dal.get_time_by_state()
+    time_in_state, error = analytics_s.get_time_in_state(filters['start'], filters['end'])
+    if error:
+        return None, error
 
-    completed_by_user = dal.get_completed_by_user()
+    completed_by_user = dal.get_completed_by_user(filters['start'], filters['end'])
     slow_connections = dal.get_slow_connections()
 
+    por_estado = time_in_state['por_estado']
     charts_data = {
-        'time_by_state': time_by_state,
+        'time_by_state': {
+            'labels': [row['etiqueta'] for row in por_estado],
+            **{medida: [row[medida] or 0 for row in por_estado]
+               for medida in ('media', *(f'p{p}' for p in analytics_s.PERCENTILES))},
+        },
         'completed_by_user': [{'user': row['nombre_completo'], 'total': row['total']} for row in completed_by_user]
     }
 
-    filters = {
-        'start': (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d'),
-        'end': datetime.now().strftime('%Y-%m-%d')
-    }
-
     return {
         'kpis': kpis,
         'charts_data': charts_data,
+        'time_in_state': time_in_state,
         'slow_connections': slow_connections,
         'filters': filters
     }, None
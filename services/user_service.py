@@ -1,7 +1,8 @@
 from werkzeug.security import generate_password_hash
 from dal.sqlite_dal import SQLiteDAL
-from db import log_action
+from db import get_db, log_action
 from flask import g
+from utils.user_context import invalidate_user_context
 
 
 def get_all_users_with_roles():
@@ -25,6 +26,7 @@ def create_user(form):
             rol = dal.get_role_id_by_name(rol_nombre)
             if rol:
                 dal.assign_role_to_user(user_id, rol['id'])
+        get_db().commit()
 
         log_action('CREAR_USUARIO', g.user['id'], 'usuarios', user_id,
                    f"Usuario '{form.username.data}' creado con roles: {', '.join(form.roles.data)}.")
@@ -68,6 +70,7 @@ def update_user(user_id, form, current_user_id):
                 if rol:
                     dal.assign_role_to_user(user_id, rol['id'])
 
+        invalidate_user_context(user_id)
         # Logging changes
         # ...
         return True, 'Usuario actualizado con éxito.'
@@ -88,6 +91,7 @@ def toggle_user_active_status(user_id, current_user_id):
     new_status = not user['activo']
     try:
         dal.toggle_user_active_status(user_id, new_status)
+        invalidate_user_context(user_id)
         estado_texto = 'activado' if new_status else 'desactivado'
         log_action('TOGGLE_USUARIO_ACTIVO', current_user_id, 'usuarios',
                    user_id, f"Usuario '{user['username']}' ha sido {estado_texto}.")
@@ -125,6 +129,7 @@ def delete_user(user_id, current_user_id):
 
     try:
         dal.delete_user(user_id)
+        invalidate_user_context(user_id)
         log_action('ELIMINAR_USUARIO', current_user_id, 'usuarios',
                    user_id, f"Usuario '{user['username']}' eliminado.")
         return True, f"El usuario '{user['username']}' ha sido eliminado."
@@ -24,10 +24,12 @@ function initializeApp() {
     initThemeToggle();
     initSidebar();
     initNotifications();
+    initRealtime();
     initDeleteModals(); // Lógica para los modales de confirmación.
 
     // Se inicializan los componentes específicos del Dashboard
     initDashboardCustomization(); // NUEVO: Personalización del dashboard
+    initDashboardWidgets(); // Carga en paralelo de los widgets diferidos
     initQuickActions(); // NUEVO: Acciones rápidas en tareas
     initTaskFilters(); // NUEVO: Filtros de tareas en dashboard
 
@@ -130,25 +132,180 @@ function initNotifications() {
     if (!notificationBell) return;
 
     notificationBell.addEventListener('click', function() {
-        const badge = this.querySelector('.notification-badge');
-        if (badge) {
-            const csrfToken = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content');
-            if (!csrfToken) {
-                console.error("Token CSRF no encontrado para marcar notificaciones.");
-                return;
-            }
-            fetch('/api/notificaciones/marcar-leidas', {
+        if (this.querySelector('.notification-badge')) {
+            loadNotifications(null);
+        }
+    });
+}
+
+/**
+ * @function loadNotifications
+ * @description Pide una página de notificaciones no leídas, la añade al menú y la marca como leída.
+ * @param {number|null} cursor - Id de la última notificación mostrada o null para la primera página.
+ */
+function loadNotifications(cursor) {
+    const csrfToken = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content');
+    if (!csrfToken) {
+        console.error("Token CSRF no encontrado para marcar notificaciones.");
+        return;
+    }
+    const url = cursor ? `/api/notificaciones?cursor=${cursor}` : '/api/notificaciones';
+    let page;
+    fetch(url)
+        .then(response => {
+            if (response.ok) return response.json();
+            throw new Error('La respuesta de la red no fue exitosa.');
+        })
+        .then(data => {
+            page = data;
+            renderNotifications(data, cursor === null);
+            if (data.items.length === 0) return { success: true, marcadas: 0 };
+            return fetch('/api/notificaciones/marcar-leidas', {
                 method: 'POST',
-                 headers: { 'X-CSRFToken': csrfToken }
+                headers: { 'X-CSRFToken': csrfToken, 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids: data.items.map(item => item.id) })
             }).then(response => {
                 if (response.ok) return response.json();
                 throw new Error('La respuesta de la red no fue exitosa.');
-            }).then(data => {
-                  if(data.success) {
-                      badge.remove();
-                  }
-              }).catch(error => console.error('Error al marcar notificaciones como leídas:', error));
+            });
+        })
+        .then(data => {
+            if (data.success) {
+                updateNotificationBadge(Math.max(page.unread_count - data.marcadas, 0));
+            }
+        })
+        .catch(error => console.error('Error al cargar las notificaciones:', error));
+}
+
+/**
+ * @function renderNotifications
+ * @description Rellena el menú de notificaciones con una página de la API.
+ * @param {Object} page - Respuesta de la API ({items, next_cursor}).
+ * @param {boolean} reset - Si se debe vaciar la lista antes de añadir la página.
+ */
+function renderNotifications(page, reset) {
+    const list = document.getElementById('notification-list');
+    if (!list) return;
+
+    list.querySelectorAll(reset ? 'li:not(:first-child)' : '.notification-more').forEach(item => item.remove());
+    if (reset && page.items.length === 0) {
+        const empty = document.createElement('li');
+        empty.innerHTML = '<span class="dropdown-item-text">No tienes notificaciones nuevas.</span>';
+        list.appendChild(empty);
+        return;
+    }
+    page.items.forEach(notification => {
+        const item = document.createElement('li');
+        const link = document.createElement('a');
+        link.className = 'dropdown-item';
+        link.href = notification.url || '#';
+        link.textContent = notification.mensaje;
+        if (notification.eventos > 1) {
+            // Eventos agrupados: el resto de mensajes se muestra como ayuda emergente.
+            const count = document.createElement('span');
+            count.className = 'badge bg-secondary ms-2';
+            count.textContent = `+${notification.eventos - 1}`;
+            link.appendChild(count);
+            link.title = notification.detalles.map(detalle => detalle.mensaje).join('\n');
         }
+        item.appendChild(link);
+        list.appendChild(item);
+    });
+    if (page.next_cursor) {
+        const more = document.createElement('li');
+        more.className = 'notification-more';
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'dropdown-item text-center small';
+        button.textContent = 'Ver más';
+        button.addEventListener('click', event => {
+            event.stopPropagation();
+            loadNotifications(page.next_cursor);
+        });
+        more.appendChild(button);
+        list.appendChild(more);
+    }
+}
+
+/**
+ * @function updateNotificationBadge
+ * @description Actualiza o elimina el contador de notificaciones no leídas.
+ * @param {number} count - Número de notificaciones pendientes.
+ */
+function updateNotificationBadge(count) {
+    const bell = document.getElementById('notification-bell');
+    if (!bell) return;
+    let badge = bell.querySelector('.notification-badge');
+    if (count > 0) {
+        if (!badge) {
+            badge = document.createElement('span');
+            badge.className = 'notification-badge';
+            bell.appendChild(badge);
+        }
+        badge.textContent = count;
+    } else if (badge) {
+        badge.remove();
+    }
+}
+
+/**
+ * @function initRealtime
+ * @description Abre el canal Server-Sent Events (/api/stream) y actualiza en el sitio
+ * el contador de notificaciones y el estado de las tareas listadas.
+ * EventSource se reconecta solo y reenvía 'Last-Event-ID' para recuperar los eventos perdidos;
+ * si el servidor rechaza la conexión, se reintenta con una espera creciente.
+ * No se abre si el servidor tiene el canal desactivado (data-realtime="false").
+ */
+function initRealtime() {
+    const bell = document.getElementById('notification-bell');
+    if (!window.EventSource || !bell || bell.dataset.realtime === 'false') return;
+    let delay = 5000;
+
+    function connect() {
+        const source = new EventSource('/api/stream');
+        source.addEventListener('open', () => { delay = 5000; });
+        source.addEventListener('notificacion', event => {
+            const data = JSON.parse(event.data);
+            if (!data.nueva) return;
+            const badge = document.querySelector('#notification-bell .notification-badge');
+            updateNotificationBadge((badge ? parseInt(badge.textContent, 10) || 0 : 0) + 1);
+        });
+        source.addEventListener('conexion', event => {
+            const data = JSON.parse(event.data);
+            if (data.estado) updateTaskRows(data.id, data.estado);
+        });
+        source.addEventListener('resync', () => {
+            // Se perdieron eventos: el contador se vuelve a pedir a la API.
+            fetch('/api/notificaciones?limit=1')
+                .then(response => response.ok ? response.json() : null)
+                .then(data => { if (data) updateNotificationBadge(data.unread_count); });
+        });
+        source.addEventListener('error', () => {
+            if (source.readyState !== EventSource.CLOSED) return;
+            setTimeout(connect, delay);
+            delay = Math.min(delay * 2, 60000);
+        });
+    }
+    connect();
+}
+
+/**
+ * @function updateTaskRows
+ * @description Refleja un cambio de estado en las filas de la lista de tareas.
+ * Las acciones rápidas de la fila dejan de ser válidas y se retiran.
+ * @param {number} conexionId - Id de la conexión.
+ * @param {string} estado - Nuevo estado de la conexión.
+ */
+function updateTaskRows(conexionId, estado) {
+    document.querySelectorAll(`tr[data-task-id="${conexionId}"]`).forEach(row => {
+        if (row.dataset.estado === estado.toLowerCase()) return;
+        row.dataset.estado = estado.toLowerCase();
+        const badge = row.querySelector('span.estado');
+        if (badge) {
+            badge.className = `estado estado-${estado.toLowerCase()}`;
+            badge.textContent = estado.replace('_', ' ');
+        }
+        row.querySelectorAll('.quick-action-btn').forEach(button => button.remove());
     });
 }
 
@@ -570,21 +727,28 @@ function initEficienciaCharts() {
     const timeByStateData = JSON.parse(dataEl.dataset.timeByState);
     const completedByUserData = JSON.parse(dataEl.dataset.completedByUser);
 
+    // timeByStateData: {labels: [...], media: [...], p50: [...], p90: [...], p99: [...]} en horas.
     const ctx1 = document.getElementById('tiempoPorEstadoChart');
-    if (ctx1 && Object.keys(timeByStateData).length > 0) {
+    if (ctx1 && timeByStateData.labels && timeByStateData.labels.length > 0) {
+        const series = [
+            { key: 'media', label: 'Media', color: '54, 162, 235' },
+            { key: 'p50', label: 'p50', color: '75, 192, 192' },
+            { key: 'p90', label: 'p90', color: '255, 159, 64' },
+            { key: 'p99', label: 'p99', color: '255, 99, 132' }
+        ];
         new Chart(ctx1, {
             type: 'bar',
             data: {
-                labels: Object.keys(timeByStateData),
-                datasets: [{
-                    label: 'Horas Promedio',
-                    data: Object.values(timeByStateData),
-                    backgroundColor: ['rgba(255, 159, 64, 0.5)', 'rgba(54, 162, 235, 0.5)', 'rgba(75, 192, 192, 0.5)'],
-                    borderColor: ['rgba(255, 159, 64, 1)', 'rgba(54, 162, 235, 1)', 'rgba(75, 192, 192, 1)'],
+                labels: timeByStateData.labels,
+                datasets: series.map(serie => ({
+                    label: serie.label,
+                    data: timeByStateData[serie.key] || [],
+                    backgroundColor: `rgba(${serie.color}, 0.5)`,
+                    borderColor: `rgba(${serie.color}, 1)`,
                     borderWidth: 1
-                }]
+                }))
             },
-            options: { indexAxis: 'y', responsive: true, maintainAspectRatio: false, plugins: { legend: { display: false } } }
+            options: { indexAxis: 'y', responsive: true, maintainAspectRatio: false, plugins: { legend: { position: 'top' } } }
         });
     }
 
@@ -687,6 +851,7 @@ function initDashboardCustomization() {
 
     if (!customizeModalEl || !dataEl) return;
 
+    // 'user_prefs' es directamente el diccionario {widget_id: visible}.
     const userPreferences = JSON.parse(dataEl.dataset.userPrefs);
     const customizeModal = new bootstrap.Modal(customizeModalEl);
     const savePreferencesBtn = document.getElementById('saveDashboardPreferences');
@@ -704,12 +869,13 @@ function initDashboardCustomization() {
             const panelId = panel.id;
             const isVisible = widgetsConfig.hasOwnProperty(panelId) ? widgetsConfig[panelId] : defaultVisibleWidgets[panelId];
             panel.style.display = isVisible ? '' : 'none';
+            if (isVisible) loadDashboardWidget(panel);
             const toggle = customizeModalEl.querySelector(`[data-widget-id="${panelId}"]`);
             if (toggle) toggle.checked = isVisible;
         });
     }
 
-    applyPreferences(userPreferences);
+    applyPreferences({ widgets_config: userPreferences });
 
     if (customizeBtn) {
         customizeBtn.addEventListener('click', () => {
@@ -757,6 +923,60 @@ function initDashboardCustomization() {
     }
 }
 
+/**
+ * @function initDashboardWidgets
+ * @description Pide en paralelo los widgets visibles del dashboard que no se renderizaron
+ * en el servidor, de modo que cada uno aparece en cuanto llega su respuesta.
+ */
+function initDashboardWidgets() {
+    document.querySelectorAll('[data-widget-url]').forEach(panel => {
+        if (panel.style.display !== 'none') loadDashboardWidget(panel);
+    });
+}
+
+/**
+ * @function loadDashboardWidget
+ * @description Carga un widget desde '/api/dashboard/widgets/<widget_id>', inserta su HTML,
+ * publica los datos de sus gráficos en #dashboard-data e inicializa sus componentes.
+ * @param {HTMLElement} panel - Contenedor del widget con el atributo 'data-widget-url'.
+ */
+function loadDashboardWidget(panel) {
+    if (!panel.dataset.widgetUrl || panel.dataset.widgetLoaded) return;
+    panel.dataset.widgetLoaded = '1';
+
+    fetch(panel.dataset.widgetUrl, { headers: { 'Accept': 'application/json' } })
+        .then(response => {
+            if (!response.ok) throw new Error(`HTTP ${response.status}`);
+            return response.json();
+        })
+        .then(result => {
+            if (!result.html) {
+                // El widget no tiene contenido para este usuario (p. ej. sin proyectos).
+                panel.remove();
+                return;
+            }
+            const dataEl = document.getElementById('dashboard-data');
+            const data = result.data || {};
+            if (dataEl) {
+                Object.keys(data).forEach(key => {
+                    dataEl.dataset[key] = JSON.stringify(data[key]);
+                });
+            }
+            panel.innerHTML = result.html;
+
+            if (panel.querySelector('#myPerformanceChart')) initMyPerformanceChart();
+            if (panel.querySelector('#myProjectsChart')) initMyProjectsChart();
+            if (panel.querySelector('#admin-dashboard-charts')) initDashboardCharts();
+            if (panel.querySelector('#task-filters-form')) initTaskFilters();
+            panel.querySelectorAll('[data-bs-toggle="tooltip"]').forEach(el => new bootstrap.Tooltip(el));
+        })
+        .catch(error => {
+            console.error(`Error al cargar el widget ${panel.id}:`, error);
+            delete panel.dataset.widgetLoaded;
+            panel.innerHTML = '<div class="alert alert-warning">No se pudo cargar este panel. Recarga la página para intentarlo de nuevo.</div>';
+        });
+}
+
 // NUEVA FUNCIÓN: Acciones Rápidas (Tomar, Realizado, Aprobar, Rechazar)
 function initQuickActions() {
     document.addEventListener('click', function(event) {
@@ -4,7 +4,7 @@ import tempfile
 import pytest
 from werkzeug.security import generate_password_hash
 from app import create_app
-from db import get_db, init_db
+from db import get_db, init_db, close_all_connections
 
 # Add project root to the Python path
 sys.path.insert(0, os.path.abspath(
@@ -60,6 +60,7 @@ def app():
 
     yield app
 
+    close_all_connections(app)
     os.close(db_fd)
     os.unlink(db_path)
 
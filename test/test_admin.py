@@ -407,3 +407,58 @@ def test_admin_audit_log_is_accessible_and_does_not_crash(client, auth):
     # because of the NameError. After the fix, it should be 200 OK.
     assert response.status_code == 200
     assert b'Historial de Auditor' in response.data
+
+
+def test_efficiency_time_in_state_uses_history_and_date_range(client, app, auth):
+    """
+    The efficiency page computes dwell time per state from historial_estados
+    (a rejection counts as time in progress) and honours the date filters.
+    """
+    with app.app_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        project_id = db.execute("SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+        historiales = {
+            'TIEMPO-001': [('SOLICITADO', '2024-03-01 08:00:00'), ('EN_PROCESO', '2024-03-01 10:00:00'),
+                           ('REALIZADO', '2024-03-02 10:00:00'), ('RECHAZADO', '2024-03-02 14:00:00'),
+                           ('REALIZADO', '2024-03-02 20:00:00'), ('APROBADO', '2024-03-03 08:00:00')],
+            'TIEMPO-002': [('SOLICITADO', '2024-03-05 08:00:00'), ('EN_PROCESO', '2024-03-05 12:00:00'),
+                           ('REALIZADO', '2024-03-06 00:00:00')],
+            'TIEMPO-003': [('SOLICITADO', '2024-05-01 08:00:00'), ('EN_PROCESO', '2024-05-01 18:00:00')],
+        }
+        for codigo, historial in historiales.items():
+            conexion_id = db.execute(
+                "INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, solicitante_id, estado) VALUES (?, ?, 'T', 'S', 'T', ?, 'SOLICITADO')",
+                (codigo, project_id, admin_id)).lastrowid
+            db.executemany(
+                "INSERT INTO historial_estados (conexion_id, usuario_id, estado, fecha) VALUES (?, ?, ?, ?)",
+                [(conexion_id, admin_id, estado, fecha) for estado, fecha in historial])
+        db.commit()
+
+    with app.test_request_context():
+        from services.analytics_service import get_time_in_state
+        data, error = get_time_in_state('2024-03-01', '2024-03-31')
+        assert error is None
+        por_estado = {row['estado']: row for row in data['por_estado']}
+        # SOLICITADO: 2h y 4h; EN_PROCESO: 24h, 6h (tras el rechazo) y 12h; REALIZADO: 4h y 12h.
+        assert por_estado['SOLICITADO'] == {'estado': 'SOLICITADO', 'etiqueta': 'Solicitado', 'n': 2,
+                                            'media': 3.0, 'p50': 2.0, 'p90': 4.0, 'p99': 4.0}
+        assert (por_estado['EN_PROCESO']['n'], por_estado['EN_PROCESO']['media'],
+                por_estado['EN_PROCESO']['p50']) == (3, 14.0, 12.0)
+        assert (por_estado['REALIZADO']['n'], por_estado['REALIZADO']['p90']) == (2, 12.0)
+        assert {row['proyecto'] for row in data['por_proyecto']} == {'Proyecto Test'}
+        assert {row['usuario'] for row in data['por_usuario']} == {'Admin User'}
+
+        mayo, _ = get_time_in_state('2024-05-01', '2024-05-31')
+        assert [row['n'] for row in mayo['por_estado']] == [1, 0, 0]
+
+    auth.login()
+    response = client.get('/admin/eficiencia?date_start=2024-03-01&date_end=2024-03-31')
+    assert response.status_code == 200
+    assert b'Tiempo por Estado y Proyecto' in response.data
+    assert b'14.0' in response.data
+    # Las fechas sin ceros se normalizan antes de llegar a SQLite.
+    response = client.get('/admin/eficiencia?date_start=2024-3-1&date_end=2024-3-31')
+    assert b'14.0' in response.data
+    response = client.get('/admin/eficiencia?date_start=2024-04-01&date_end=2024-03-01', follow_redirects=True)
+    assert 'La fecha de inicio no puede ser posterior'.encode() in response.data
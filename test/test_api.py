@@ -156,3 +156,198 @@ def test_user_cannot_act_on_connection_in_unassigned_project(client, app, auth):
         conn = cursor.fetchone()
         assert conn['estado'] == 'EN_PROCESO'
         assert conn['realizador_id'] == user_a_id
+
+
+def test_notifications_fan_out_counter_and_cursor_pagination(client, app, auth):
+    """
+    notify_users inserts one row per project member, the trigger-maintained
+    unread counter follows inserts and reads, and /api/notificaciones pages
+    through the inbox with a cursor.
+    """
+    from services.notification_service import notify_users
+    app.config['NOTIFICATION_COALESCE_SECONDS'] = 0
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        solicitante_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'solicitante'").fetchone()['id']
+        proyecto_id = db.execute("SELECT id FROM proyectos").fetchone()['id']
+        db.executemany("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                       [(proyecto_id, admin_id), (proyecto_id, solicitante_id)])
+        conexion_id = db.execute(
+            "INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia) VALUES (?, ?, ?, ?, ?)",
+            ('NOTIF-1', proyecto_id, 'T', 'S', 'TIP')).lastrowid
+        db.commit()
+
+        conexion = {'id': conexion_id, 'proyecto_id': proyecto_id, 'codigo_conexion': 'NOTIF-1'}
+        for i in range(25):
+            assert notify_users(conexion, f"Aviso {i}", "", ['SOLICITANTE'],
+                                exclude_user_id=solicitante_id) == 1
+        db.commit()
+        contador = db.execute(
+            "SELECT notificaciones_no_leidas FROM usuarios WHERE id = ?", (admin_id,)).fetchone()[0]
+        assert contador == 25
+
+    auth.login()
+    first = client.get('/api/notificaciones').get_json()
+    assert len(first['items']) == 20
+    assert first['unread_count'] == 25
+    assert first['items'][0]['mensaje'] == 'Aviso 24'
+
+    second = client.get(f"/api/notificaciones?cursor={first['next_cursor']}").get_json()
+    assert len(second['items']) == 5
+    assert second['next_cursor'] is None
+
+    response = client.post('/api/notificaciones/marcar-leidas',
+                           json={'ids': [item['id'] for item in first['items']]})
+    assert response.get_json()['marcadas'] == 20
+    assert client.get('/api/notificaciones').get_json()['unread_count'] == 5
+
+
+def test_notifications_coalesce_per_user_and_connection(app):
+    """
+    Events for the same user and connection inside the coalescing window are
+    merged into one notification that keeps the earlier messages.
+    """
+    from services.notification_service import notify_users, get_notifications
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        proyecto_id = db.execute("SELECT id FROM proyectos").fetchone()['id']
+        db.execute("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                   (proyecto_id, admin_id))
+        conexiones = [db.execute(
+            "INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia) VALUES (?, ?, ?, ?, ?)",
+            (codigo, proyecto_id, 'T', 'S', 'TIP')).lastrowid for codigo in ('AGR-1', 'AGR-2')]
+        db.commit()
+
+        for i in range(5):
+            notify_users({'id': conexiones[0], 'proyecto_id': proyecto_id, 'codigo_conexion': 'AGR-1'},
+                         f"Evento {i}", "", ['ADMINISTRADOR'])
+        notify_users({'id': conexiones[1], 'proyecto_id': proyecto_id, 'codigo_conexion': 'AGR-2'},
+                     "Otra conexión", "", ['ADMINISTRADOR'])
+        db.commit()
+
+        data, error = get_notifications(admin_id)
+        assert error is None
+        assert data['unread_count'] == 2
+        agrupada = next(item for item in data['items'] if item['conexion_id'] == conexiones[0])
+        assert agrupada['eventos'] == 5
+        assert agrupada['mensaje'] == 'Evento 4'
+        assert [d['mensaje'] for d in agrupada['detalles']] == [f"Evento {i}" for i in range(4)]
+
+
+def test_realtime_events_reach_only_project_members(client, app, auth):
+    """
+    A comment publishes a notification event for each recipient and a
+    connection event for the project; the broker and the SSE replay only
+    deliver them to users that can see them.
+    """
+    from services.comment_service import add_comment
+    from services.event_service import Subscription
+    from dal.sqlite_dal import SQLiteDAL
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        solicitante_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'solicitante'").fetchone()['id']
+        proyecto_id = db.execute("SELECT id FROM proyectos").fetchone()['id']
+        db.execute("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                   (proyecto_id, solicitante_id))
+        conexion_id = db.execute(
+            "INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia) VALUES (?, ?, ?, ?, ?)",
+            ('SSE-1', proyecto_id, 'T', 'S', 'TIP')).lastrowid
+        db.commit()
+
+        assert add_comment(conexion_id, admin_id, 'Admin User', 'Hola')[0]
+        events = SQLiteDAL().get_events_since(0, solicitante_id, [proyecto_id])
+        assert [e['tipo'] for e in events] == ['notificacion', 'conexion']
+        assert SQLiteDAL().get_events_since(0, admin_id, [proyecto_id + 1]) == []
+
+        miembro = Subscription(solicitante_id, [proyecto_id])
+        ajeno = Subscription(admin_id, [proyecto_id + 1])
+        app.extensions['event_broker']._subscribers.update({miembro, ajeno})
+        app.extensions['event_broker'].dispatch(events)
+        app.extensions['event_broker']._subscribers.clear()
+        assert miembro.queue.qsize() == 2
+        assert ajeno.queue.qsize() == 0
+
+    app.config['SSE_MAX_SECONDS'] = 0
+    broker = app.extensions['event_broker']
+    auth.login('solicitante', 'password')
+    response = client.get('/api/stream', headers={'Last-Event-ID': '0'})
+    body = response.get_data(as_text=True)
+    thread = broker._thread
+    broker.stop()
+    if thread:
+        thread.join(2)
+
+    assert response.mimetype == 'text/event-stream'
+    assert body.startswith('retry: 3000')
+    assert 'event: notificacion' in body and 'event: conexion' in body
+    assert broker.active() == 0
+
+
+def test_event_broker_tails_from_start_id_and_caps_streams(app):
+    """
+    The reader thread starts at the id read before subscribing, so an event
+    committed in between is still delivered, and the stream cap is checked
+    atomically by 'subscribe'.
+    """
+    from dal.sqlite_dal import SQLiteDAL
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        start_id = SQLiteDAL().get_last_event_id()
+        SQLiteDAL().publish_events([('notificacion', admin_id, None, '{}')])
+
+    broker = app.extensions['event_broker']
+    subscription = broker.subscribe(admin_id, None, start_id, max_streams=1)
+    try:
+        assert broker.subscribe(admin_id, None, start_id, max_streams=1) is None
+        event = subscription.queue.get(timeout=5)
+        assert event['id'] == start_id + 1
+    finally:
+        thread = broker._thread
+        broker.unsubscribe(subscription)
+        broker.stop()
+        if thread:
+            thread.join(2)
+    assert broker.active() == 0
+
+
+def test_event_stream_can_be_disabled(client, app, auth):
+    app.config['SSE_MAX_STREAMS'] = 0
+    auth.login('solicitante', 'password')
+
+    assert client.get('/api/stream').status_code == 503
+    assert b'data-realtime="false"' in client.get('/dashboard').data
+
+
+def test_profile_search_index_is_rebuilt_only_when_aliases_change(client, app, auth, monkeypatch):
+    import services.profile_search_service as profile_search_s
+
+    builds = []
+    original_build = profile_search_s._build_index
+
+    def counting_build():
+        builds.append(1)
+        return original_build()
+    monkeypatch.setattr(profile_search_s, '_build_index', counting_build)
+
+    auth.login()
+    # Perfiles del catálogo JSON, normalizados y en orden de etiqueta.
+    assert [d['value'] for d in client.get('/api/perfiles/buscar?q=ipe').get_json()] == ['IPE 200', 'IPE 300']
+    assert [d['value'] for d in client.get('/api/perfiles/buscar?q=ipe-3').get_json()] == ['IPE 300']
+    assert client.get('/api/perfiles/buscar?q=HSS8').get_json() == []
+    assert len(builds) == 1
+
+    # Un alias escrito por otra vía sube la versión de 'alias_perfiles'.
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO alias_perfiles (nombre_perfil, alias) VALUES ('HSS 8x8x1/2', 'TUBO8')")
+        db.commit()
+    assert client.get('/api/perfiles/buscar?q=hss8x8').get_json() == [
+        {'label': 'TUBO8 (HSS 8x8x1/2)', 'value': 'HSS 8x8x1/2'}]
+    assert [d['value'] for d in client.get('/api/perfiles/buscar?q=tubo').get_json()] == ['HSS 8x8x1/2']
+    assert len(builds) == 2
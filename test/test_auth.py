@@ -74,3 +74,28 @@ def test_profile_password_change_wrong_current_password(client, auth):
         flashes = session.get('_flashes', [])
         assert not any(
             'La contraseña actual no es correcta.' in msg for cat, msg in flashes)
+
+
+def test_user_context_revalidates_on_version_change(app):
+    """
+    The cached user context is reused while its contexto_version is unchanged
+    and reloaded once a trigger bumps it (here, a new notification).
+    """
+    from utils.user_context import load_user_context
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+
+        first = load_user_context(admin_id)
+        assert 'ADMINISTRADOR' in first.roles
+        assert load_user_context(admin_id) is first
+
+        db.execute(
+            "INSERT INTO notificaciones (usuario_id, mensaje, url) VALUES (?, ?, ?)",
+            (admin_id, 'Nueva', '/'))
+        db.commit()
+
+        second = load_user_context(admin_id)
+        assert second is not first
+        assert second.version > first.version
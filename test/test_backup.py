@@ -0,0 +1,70 @@
+import os
+import gzip
+from datetime import datetime, timedelta
+from db import get_db
+from services import backup_service
+
+
+def test_backup_creates_verified_snapshot(app, tmp_path):
+    """A hot backup produces a compressed snapshot with a matching checksum."""
+    with app.app_context():
+        path, error = backup_service.create_backup(folder=str(tmp_path))
+
+        assert error is None
+        assert os.path.exists(path)
+        assert os.path.exists(f"{path}.sha256")
+        with gzip.open(path, 'rb') as f:
+            assert f.read(16) == b'SQLite format 3\x00'
+
+        ok, error = backup_service.verify_backup(path)
+        assert ok, error
+
+
+def test_backup_verification_detects_corruption(app, tmp_path):
+    with app.app_context():
+        path, _ = backup_service.create_backup(folder=str(tmp_path))
+        with open(path, 'ab') as f:
+            f.write(b'corrupto')
+
+        ok, error = backup_service.verify_backup(path)
+        assert not ok
+        assert 'SHA-256' in error
+
+
+def test_backups_in_the_same_second_do_not_overwrite(app, tmp_path):
+    """Snapshots carry microseconds, and the writer process keeps writing meanwhile."""
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO proyectos (nombre, descripcion) VALUES ('Durante copia', 'Desc')")
+        first, error = backup_service.create_backup(folder=str(tmp_path))
+        assert error is None
+        db.commit()
+        second, error = backup_service.create_backup(folder=str(tmp_path))
+        assert error is None
+
+    assert first != second
+    assert len(backup_service.list_backups(str(tmp_path))) == 2
+
+
+def test_prune_backups_applies_retention(app, tmp_path):
+    """Keeps the newest snapshots plus one per day inside the retention window."""
+    now = datetime(2024, 5, 20, 12, 0, 0)
+    stamps = [now - timedelta(hours=6 * i) for i in range(20)]
+    for stamp in stamps:
+        name = f"heptaconexiones-{stamp.strftime('%Y%m%d-%H%M%S')}.db.gz"
+        (tmp_path / name).write_bytes(b'')
+        (tmp_path / f"{name}.sha256").write_text('x')
+
+    with app.app_context():
+        removed = backup_service.prune_backups(
+            folder=str(tmp_path), keep_last=3, keep_days=2, now=now)
+        remaining = backup_service.list_backups(str(tmp_path))
+
+    kept = {s['fecha'] for s in remaining}
+    assert kept == {
+        datetime(2024, 5, 20, 12), datetime(2024, 5, 20, 6), datetime(2024, 5, 20, 0),
+        datetime(2024, 5, 19, 18), datetime(2024, 5, 18, 18),
+    }
+    assert len(removed) == len(stamps) - len(kept)
+    assert not any(name.endswith('.sha256') and not os.path.exists(name[:-7])
+                   for name in map(str, tmp_path.iterdir()))
@@ -1,3 +1,4 @@
+import time
 import pytest
 from db import get_db, log_action
 from werkzeug.security import generate_password_hash
@@ -195,3 +196,236 @@ def test_audit_log(app):
         assert log_entry['tipo_objeto'] == obj_type
         assert log_entry['objeto_id'] == obj_id
         assert log_entry['detalles'] == details
+
+
+def test_audit_log_batched_flush(app):
+    """
+    Tests that, outside synchronous mode, audit events are buffered and
+    written together when the sink is flushed.
+    """
+    with app.app_context():
+        sink = app.extensions['audit']
+        sink.synchronous = False
+        db = get_db()
+        cursor = db.cursor()
+
+        for i in range(3):
+            log_action("BATCH_ACTION", None, "TEST_OBJ", i, "Batched.")
+
+        cursor.execute(
+            "SELECT COUNT(*) FROM auditoria_acciones WHERE accion = 'BATCH_ACTION'")
+        assert cursor.fetchone()[0] == 0
+        assert sink.pending() == 3
+
+        sink.flush()
+
+        cursor.execute(
+            "SELECT COUNT(*) FROM auditoria_acciones WHERE accion = 'BATCH_ACTION'")
+        assert cursor.fetchone()[0] == 3
+        assert sink.pending() == 0
+
+
+def test_audit_log_inside_open_transaction(app):
+    """
+    Tests that an audit event logged while the request connection holds a
+    write transaction is written in that transaction, without waiting on the
+    dedicated connection, and is discarded if the transaction rolls back.
+    """
+    with app.app_context():
+        sink = app.extensions['audit']
+        sink.synchronous = False
+        db = get_db()
+        db.execute(
+            "INSERT INTO proyectos (nombre, descripcion) VALUES ('TX Auditoría', 'Desc')")
+        assert db.in_transaction
+
+        start = time.monotonic()
+        log_action("TX_ACTION", None, "TEST_OBJ", 1, "En transacción.")
+        assert time.monotonic() - start < 1
+        assert sink.pending() == 0
+        db.rollback()
+
+        log_action("TX_ACTION", None, "TEST_OBJ", 2, "Sin transacción.")
+        sink.flush()
+        cursor = db.cursor()
+        cursor.execute(
+            "SELECT objeto_id FROM auditoria_acciones WHERE accion = 'TX_ACTION'")
+        assert [row['objeto_id'] for row in cursor.fetchall()] == [2]
+
+
+def test_import_audit_beyond_batch_size(app, tmp_path):
+    """
+    Tests that importing more rows than AUDIT_BATCH_SIZE writes one audit
+    event per connection without blocking on the import's own transaction.
+    """
+    import pandas as pd
+    from db import AuditSink
+    from services.import_service import importar_conexiones_from_file
+
+    filas = 12
+    archivo = tmp_path / 'importacion.xlsx'
+    pd.DataFrame({
+        'TIPO': ['MOMENTO'] * filas,
+        'SUBTIPO': ['VIGA-COLUMNA (ALA)'] * filas,
+        'TIPOLOGIA': ['T0'] * filas,
+        'PERFIL1': [f'IPE {100 + i * 20}' for i in range(filas)],
+    }).to_excel(archivo, index=False, engine='openpyxl')
+
+    with app.test_request_context():
+        db = get_db()
+        sink = AuditSink(app.extensions['audit'].manager, app.logger,
+                         batch_size=5, flush_interval=0)
+        app.extensions['audit'] = sink
+        proyecto_id = db.execute(
+            "SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+
+        start = time.monotonic()
+        importadas, errores, error = importar_conexiones_from_file(
+            str(archivo), proyecto_id, 1)
+        assert time.monotonic() - start < 3
+        assert (importadas, errores, error) == (filas, [], None)
+
+        sink.flush()
+        total = db.execute(
+            "SELECT COUNT(*) FROM auditoria_acciones WHERE accion = 'IMPORTAR_CONEXION'").fetchone()[0]
+        assert total == filas
+
+
+def test_dal_transaction_nested_rollback(app):
+    """
+    Tests that a failing nested unit of work rolls back only its savepoint
+    and that the outer block commits everything else once.
+    """
+    from dal.sqlite_dal import SQLiteDAL
+
+    with app.app_context():
+        dal = SQLiteDAL()
+        with dal.transaction() as db:
+            db.execute(
+                "INSERT INTO proyectos (nombre, descripcion) VALUES ('TX Externo', 'Desc')")
+            with pytest.raises(RuntimeError):
+                with dal.transaction():
+                    db.execute(
+                        "INSERT INTO proyectos (nombre, descripcion) VALUES ('TX Interno', 'Desc')")
+                    raise RuntimeError("fallo")
+            assert db.in_transaction
+
+        cursor = get_db().cursor()
+        cursor.execute(
+            "SELECT nombre FROM proyectos WHERE nombre LIKE 'TX %'")
+        assert [row['nombre'] for row in cursor.fetchall()] == ['TX Externo']
+
+
+def test_sql_profile_flags_repeated_statements(app):
+    """
+    Tests that the SQL instrumentation records every statement of a request
+    and flags identical statements repeated in a loop as N+1 candidates.
+    """
+    from flask import g
+    from db import SQLiteConnectionManager, SQLProfiler
+
+    manager = SQLiteConnectionManager(app.config['DATABASE_URL'], profiling=True)
+    profiler = SQLProfiler(n_plus_one_threshold=3)
+    try:
+        with app.test_request_context('/proyectos/'):
+            g.sql_profile = profiler.start('GET', '/proyectos/')
+            conn = manager.acquire()
+            conn.execute("SELECT COUNT(*) FROM proyectos").fetchone()
+            for proyecto_id in range(4):
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT nombre FROM proyectos WHERE id = ?", (proyecto_id,))
+                cursor.fetchall()
+            summary = g.sql_profile.summary('proyectos.listar_proyectos', 200)
+    finally:
+        manager.close_all()
+
+    assert summary['queries'] == 5
+    assert summary['rows'] == 2
+    assert len(summary['n_plus_one']) == 1
+    assert summary['n_plus_one'][0]['count'] == 4
+    assert summary['n_plus_one'][0]['sql'] == "SELECT nombre FROM proyectos WHERE id = ?"
+
+
+def test_slow_query_log_captures_plan(app):
+    """
+    Tests that statements over the threshold are stored in the
+    consultas_lentas ring buffer with their parameter shape and query plan,
+    highlighting full table scans.
+    """
+    from db import SQLiteConnectionManager, SlowQueryLog
+
+    manager = SQLiteConnectionManager(app.config['DATABASE_URL'])
+    slow_log = SlowQueryLog(manager, app.logger, threshold_ms=0, keep=2)
+    manager.set_slow_log(slow_log)
+    try:
+        conn = manager.acquire()
+        for _ in range(3):
+            conn.execute(
+                "SELECT * FROM proyectos WHERE descripcion = ?", ('Desc',)).fetchall()
+        slow_log.flush()
+    finally:
+        manager.close_all()
+
+    with app.app_context():
+        cursor = get_db().cursor()
+        cursor.execute("SELECT * FROM consultas_lentas ORDER BY id")
+        rows = cursor.fetchall()
+
+    assert len(rows) == 2
+    assert rows[0]['parametros'] == '(str)'
+    assert rows[0]['full_scan'] == 1
+    assert 'SCAN proyectos' in rows[0]['plan']
+
+
+def test_scheduler_starts_in_a_single_process(app, tmp_path):
+    """
+    Tests that the scheduler only starts in the process holding the
+    instance lock, so scheduled jobs run once per deployment.
+    """
+    from app import start_scheduler
+    from utils.instance_lock import InstanceLock
+
+    app.extensions['scheduler_lock'] = InstanceLock(str(tmp_path / 'scheduler.lock'))
+    otro_proceso = InstanceLock(str(tmp_path / 'scheduler.lock'))
+    assert otro_proceso.acquire()
+    try:
+        assert not start_scheduler(app)
+        assert not app.scheduler.running
+    finally:
+        otro_proceso.release()
+
+    try:
+        assert start_scheduler(app)
+        assert app.scheduler.running
+        assert not otro_proceso.acquire()
+    finally:
+        app.scheduler.shutdown(wait=False)
+        app.extensions['scheduler_lock'].release()
+
+
+def test_database_maintenance_records_run(app):
+    """
+    Tests that a maintenance pass analyzes the database, reclaims free pages
+    incrementally and records its sizes in mantenimiento_bd.
+    """
+    from services.maintenance_service import run_maintenance
+
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        db.executemany("INSERT INTO auditoria_acciones (accion, detalles) VALUES (?, ?)",
+                       [('RELLENO', 'x' * 2000)] * 200)
+        db.commit()
+        db.execute("DELETE FROM auditoria_acciones WHERE accion = 'RELLENO'")
+        db.commit()
+
+        registro = run_maintenance()
+
+        assert registro['error'] is None
+        assert registro['paginas_libres_despues'] < registro['paginas_libres_antes']
+        assert db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is not None
+        row = db.execute(
+            "SELECT * FROM mantenimiento_bd ORDER BY id DESC LIMIT 1").fetchone()
+        assert row['tamano_antes'] == registro['tamano_antes']
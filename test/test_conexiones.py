@@ -3,6 +3,7 @@ from werkzeug.security import generate_password_hash
 import io
 import json
 import os
+from datetime import datetime
 
 
 def test_current_realizador_can_delete_files(client, app, auth):
@@ -443,3 +444,45 @@ def test_conexion_report_does_not_crash(client, app, auth):
     assert response.mimetype == 'text/html'
     assert b'Reporte de Conexi' in response.data  # "Reporte de Conexión"
     assert b'CONN-REPORT-TEST' in response.data
+
+
+def test_conexion_ciclo_follows_transitions_and_rebuild(app, runner):
+    """
+    conexion_ciclo is kept up to date by each state transition (including a
+    rejection) and the CLI rebuild from historial_estados yields the same row.
+    """
+    from dal.sqlite_dal import SQLiteDAL
+    from services.connection_service import process_connection_state_transition
+
+    roles = ['ADMINISTRADOR']
+    with app.test_request_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        project_id = db.execute("SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+        conexion_id = db.execute(
+            "INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, solicitante_id, estado) VALUES ('CICLO-001', ?, 'T', 'S', 'T', ?, 'SOLICITADO')",
+            (project_id, admin_id)).lastrowid
+        db.commit()
+
+        for estado, detalles in [('EN_PROCESO', None), ('REALIZADO', None), ('RECHAZADO', 'Falta detalle'),
+                                 ('REALIZADO', None), ('APROBADO', None)]:
+            ok, message, _ = process_connection_state_transition(
+                conexion_id, estado, admin_id, 'Admin', roles, detalles)
+            assert ok, message
+
+        campos = "realizador_id, aprobador_id, num_rechazos, fecha_en_proceso IS NOT NULL AS en_proceso, dias_ciclo >= 0 AS ciclo_ok, dias_ejecucion >= 0 AS ejecucion_ok"
+        incremental = dict(db.execute(
+            f"SELECT {campos} FROM conexion_ciclo WHERE conexion_id = ?", (conexion_id,)).fetchone())
+        assert incremental == {'realizador_id': admin_id, 'aprobador_id': admin_id, 'num_rechazos': 1,
+                               'en_proceso': 1, 'ciclo_ok': 1, 'ejecucion_ok': 1}
+        hoy = datetime.now().strftime('%Y-%m-%d')
+        kpis = SQLiteDAL().get_efficiency_kpis(hoy, hoy)
+        assert kpis['rejection_rate'] == '50.0%' and kpis['processed_in_range'] == 1
+
+    result = runner.invoke(args=['ciclo-conexiones'])
+    assert 'Ciclo de vida reconstruido' in result.output
+
+    with app.app_context():
+        rebuilt = dict(get_db().execute(
+            f"SELECT {campos} FROM conexion_ciclo WHERE conexion_id = ?", (conexion_id,)).fetchone())
+        assert rebuilt == incremental
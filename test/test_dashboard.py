@@ -4,6 +4,21 @@ from werkzeug.security import generate_password_hash
 from datetime import datetime
 
 
+def get_full_dashboard(client):
+    """Devuelve el HTML de '/dashboard' junto con el de todos sus widgets diferidos."""
+    import re
+    import html
+    response = client.get('/dashboard')
+    assert response.status_code == 200
+    page = response.data.decode('utf-8')
+    parts = [page]
+    for url in re.findall(r'data-widget-url="([^"]+)"', page):
+        widget = client.get(html.unescape(url))
+        assert widget.status_code == 200
+        parts.append(widget.get_json()['html'])
+    return '\n'.join(parts)
+
+
 def test_dashboard_approver_isolation(client, app, auth):
     """
     Tests that an approver only sees connections from their assigned projects on the dashboard.
@@ -67,11 +82,10 @@ def test_dashboard_approver_isolation(client, app, auth):
 
     # Log in as Approver A
     auth.login('approver_a', 'password')
-    response = client.get('/dashboard')
+    response_data = get_full_dashboard(client)
 
     # Approver A should only see 1 connection pending approval (from Project A)
     # The bug would cause this to show 2
-    response_data = response.data.decode('utf-8')
     assert '<h6 class="text-muted mb-1">Pendientes de mi Aprobación</h6>' in response_data
     assert '<h4 class="mb-0">1</h4>' in response_data
     assert '<h4 class="mb-0">2</h4>' not in response_data
@@ -82,10 +96,9 @@ def test_dashboard_approver_isolation(client, app, auth):
 
     # Log in as Approver B
     auth.login('approver_b', 'password')
-    response = client.get('/dashboard')
+    response_data = get_full_dashboard(client)
 
     # Approver B should only see 1 connection pending approval (from Project B)
-    response_data = response.data.decode('utf-8')
     assert '<h4 class="mb-0">1</h4>' in response_data
     assert '<h4 class="mb-0">2</h4>' not in response_data
     assert 'PROJ-A-001' not in response_data
@@ -207,8 +220,7 @@ def test_dashboard_admin_kpis(client, app, auth):
         db.commit()
 
     auth.login('admin', 'password')
-    response = client.get('/dashboard')
-    response_data = response.data.decode('utf-8')
+    response_data = get_full_dashboard(client)
 
     assert '<h3 class="mb-3">Panel de Administrador</h3>' in response_data
     import re
@@ -234,3 +246,228 @@ def test_dashboard_admin_kpis(client, app, auth):
     assert '<h5>Top 5 Solicitantes</h5>' in response_data
     assert '<h5>Top 5 Realizadores</h5>' in response_data
     auth.logout()
+
+
+def test_dashboard_counters_follow_connection_changes(app, multi_role_user):
+    """
+    The trigger-maintained dashboard_counters table matches a recount after
+    state changes, reassignments, deletions and project membership changes.
+    """
+    recount_sql = """
+        SELECT metrica, COUNT(*) AS valor FROM (
+          SELECT 'creadas' AS metrica FROM conexiones WHERE solicitante_id = :u
+          UNION ALL SELECT 'solicitadas_en_proceso' FROM conexiones WHERE solicitante_id = :u AND estado = 'EN_PROCESO'
+          UNION ALL SELECT 'solicitadas_aprobadas' FROM conexiones WHERE solicitante_id = :u AND estado = 'APROBADO'
+          UNION ALL SELECT 'tareas_en_proceso' FROM conexiones WHERE realizador_id = :u AND estado = 'EN_PROCESO'
+          UNION ALL SELECT 'pendientes_aprobacion' FROM conexiones c JOIN proyecto_usuarios pu
+            ON pu.proyecto_id = c.proyecto_id WHERE c.estado = 'REALIZADO' AND pu.usuario_id = :u
+        ) GROUP BY metrica
+    """
+
+    def assert_consistent(db):
+        expected = {row['metrica']: row['valor']
+                    for row in db.execute(recount_sql, {'u': multi_role_user})}
+        stored = {row['metrica']: row['valor'] for row in db.execute(
+            "SELECT metrica, valor FROM dashboard_counters WHERE usuario_id = ? AND valor != 0",
+            (multi_role_user,))}
+        assert stored == expected
+
+    with app.app_context():
+        db = get_db()
+        assert_consistent(db)
+        proyecto_id = db.execute(
+            "SELECT proyecto_id FROM proyecto_usuarios WHERE usuario_id = ?",
+            (multi_role_user,)).fetchone()[0]
+
+        db.execute("UPDATE conexiones SET estado = 'EN_PROCESO', realizador_id = ? WHERE codigo_conexion = 'MULTI-001'",
+                   (multi_role_user,))
+        db.execute("UPDATE conexiones SET estado = 'REALIZADO' WHERE codigo_conexion = 'MULTI-002'")
+        db.execute("UPDATE conexiones SET realizador_id = 1 WHERE codigo_conexion = 'MULTI-001'")
+        db.execute("DELETE FROM conexiones WHERE codigo_conexion = 'MULTI-003'")
+        db.commit()
+        assert_consistent(db)
+
+        db.execute("DELETE FROM proyecto_usuarios WHERE usuario_id = ?", (multi_role_user,))
+        db.commit()
+        assert_consistent(db)
+        db.execute("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                   (proyecto_id, multi_role_user))
+        db.commit()
+        assert_consistent(db)
+
+
+def test_lru_cache_single_flight_and_eviction():
+    """Concurrent misses compute once; the least recently used entry is evicted."""
+    import threading
+    import time
+    from utils.lru_cache import LRUCache
+
+    cache = LRUCache(max_entries=2, ttl=60)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.05)
+        return 'valor'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute(('a',), compute)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == ['valor'] * 8
+    assert len(calls) == 1
+
+    cache.get_or_compute(('b',), lambda: 'b')
+    cache.get_or_compute(('a',), compute)
+    cache.get_or_compute(('c',), lambda: 'c')
+    stats = cache.stats()
+    assert stats['entradas'] == 2 and stats['desalojos'] == 1
+    assert cache.invalidate('a') == 1
+    assert cache.get_or_compute(('b',), lambda: 'nuevo') == 'nuevo'
+
+
+def test_dashboard_cache_invalidated_by_state_transition(app, multi_role_user):
+    """A user's own action is visible on the next dashboard load."""
+    from services.dashboard_service import get_dashboard_data
+    from services.connection_service import process_connection_state_transition
+    roles = ['SOLICITANTE', 'REALIZADOR', 'APROBADOR']
+    with app.test_request_context():
+        antes = get_dashboard_data(multi_role_user, roles)
+        assert antes['my_summary']['mis_tareas_en_proceso'] == 1
+        conexion_id = get_db().execute(
+            "SELECT id FROM conexiones WHERE codigo_conexion = 'MULTI-001'").fetchone()['id']
+
+        ok, _, _ = process_connection_state_transition(
+            conexion_id, 'EN_PROCESO', multi_role_user, 'Multi Role User', roles)
+        assert ok
+        despues = get_dashboard_data(multi_role_user, roles)
+        assert despues['my_summary']['mis_tareas_en_proceso'] == 2
+        assert conexion_id in [t['id'] for t in despues['tareas']['mis_asignadas']]
+
+
+def test_dashboard_cache_sees_writes_from_other_workers(app, multi_role_user):
+    """
+    A write made by another process, which cannot evict this process's
+    cache, still changes the user's dashboard version and is visible on the
+    next load; other users keep their cached sections.
+    """
+    from services.dashboard_service import get_dashboard_data
+    roles = ['SOLICITANTE', 'REALIZADOR', 'APROBADOR']
+    with app.test_request_context():
+        antes = get_dashboard_data(multi_role_user, roles)
+        admin_antes = get_dashboard_data(1, ['SOLICITANTE'])
+        assert 'OTRO-WORKER' not in [t['codigo_conexion'] for t in antes['tareas']['mis_solicitudes']]
+
+    # Escritura directa, sin pasar por 'invalidate_for_connection'.
+    with app.app_context():
+        db = get_db()
+        proyecto_id = db.execute(
+            "SELECT id FROM proyectos WHERE nombre = 'Proyecto Multi'").fetchone()['id']
+        db.execute("INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, solicitante_id, estado) "
+                   "VALUES ('OTRO-WORKER', ?, 'T', 'S', 'TIP', ?, 'SOLICITADO')", (proyecto_id, multi_role_user))
+        db.commit()
+
+    with app.test_request_context():
+        despues = get_dashboard_data(multi_role_user, roles)
+        assert 'OTRO-WORKER' in [t['codigo_conexion'] for t in despues['tareas']['mis_solicitudes']]
+        assert despues['my_summary']['total_conexiones_creadas'] == antes['my_summary']['total_conexiones_creadas'] + 1
+        admin_despues = get_dashboard_data(1, ['SOLICITANTE'])
+        assert admin_despues['my_projects_summary'] is admin_antes['my_projects_summary']
+
+
+def test_dashboard_hidden_widgets_are_not_computed(client, app, auth, multi_role_user, monkeypatch):
+    """
+    Hidden widgets run no queries and are not rendered; the page only computes
+    the inline widgets and each widget has its own JSON endpoint.
+    """
+    import json
+    import services.dashboard_service as dashboard_s
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO user_dashboard_preferences (usuario_id, widgets_config) VALUES (?, ?)",
+                   (multi_role_user, json.dumps({'recent-activity-panel': False, 'my-summary-panel': False})))
+        db.commit()
+
+    computed = []
+    for widget_id, widget in dashboard_s.WIDGETS.items():
+        if widget['compute']:
+            monkeypatch.setitem(widget, 'compute', lambda u, r, filters, f=widget['compute'], w=widget_id: (
+                computed.append(w), f(u, r, filters))[1])
+
+    auth.login('multi_role', 'password')
+    page = client.get('/dashboard').data.decode('utf-8')
+    assert computed == []
+    assert 'Solicitudes Creadas' not in page
+    assert 'id="recent-activity-panel"' in page and 'id="admin-panel"' not in page
+    assert '/api/dashboard/widgets/tasks-panel' in page
+
+    response = client.get('/api/dashboard/widgets/tasks-panel')
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['widget'] == 'tasks-panel' and 'MULTI-002' in body['html']
+    assert computed == ['tasks-panel']
+
+    response = client.get('/api/dashboard/widgets/my-performance-panel')
+    assert 'performanceChart' in response.get_json()['data']
+    assert client.get('/api/dashboard/widgets/admin-panel').status_code == 404
+    assert client.get('/api/dashboard/widgets/no-existe').status_code == 404
+    auth.logout()
+
+
+def test_metricas_diarias_rollup_and_admin_charts(client, app, auth, multi_role_user):
+    """
+    metricas_diarias is topped up by every state change, matches a rebuild
+    from the history and feeds the admin charts for the requested range.
+    """
+    from services.connection_service import process_connection_state_transition
+    from services.analytics_service import rebuild_daily_metrics
+    roles = ['SOLICITANTE', 'REALIZADOR', 'APROBADOR']
+
+    with app.test_request_context():
+        db = get_db()
+        conexion_id = db.execute(
+            "SELECT id FROM conexiones WHERE codigo_conexion = 'MULTI-001'").fetchone()['id']
+        db.execute("INSERT INTO historial_estados (conexion_id, usuario_id, estado, fecha) VALUES (?, ?, 'SOLICITADO', '2024-01-15 09:00:00')",
+                   (conexion_id, multi_role_user))
+        db.commit()
+        for estado in ('EN_PROCESO', 'REALIZADO'):
+            ok, message, _ = process_connection_state_transition(
+                conexion_id, estado, multi_role_user, 'Multi Role User', roles)
+            assert ok, message
+
+        def snapshot():
+            return [tuple(row) for row in db.execute(
+                "SELECT dia, proyecto_id, usuario_id, estado, total FROM metricas_diarias ORDER BY 1, 2, 3, 4")]
+
+        incremental = snapshot()
+        assert ('2024-01-15', ) == incremental[0][:1] and incremental[0][3:] == ('SOLICITADO', 1)
+        hoy = db.execute("SELECT date('now')").fetchone()[0]
+        assert {(row[3], row[4]) for row in incremental if row[0] == hoy} == {('EN_PROCESO', 1), ('REALIZADO', 1)}
+
+        count, error = rebuild_daily_metrics(0)
+        assert error is None and count == len(incremental)
+        assert snapshot() == incremental
+
+    auth.login()
+    response = client.get('/api/dashboard/widgets/admin-panel?date_start=2024-01-01&date_end=2024-01-31')
+    data = response.get_json()['data']
+    assert data['estados'] == {'SOLICITADO': 1}
+    assert data['meses'] == [{'mes': '2024-01', 'total': 1}]
+    assert 'Multi Role User' in response.get_json()['html']
+    auth.logout()
+
+
+def test_dashboard_filters_normalize_dates():
+    from services.dashboard_service import get_dashboard_filters
+
+    assert get_dashboard_filters({'date_start': '2024-1-5', 'date_end': '2024-2-1'}) == \
+        {'start': '2024-01-05', 'end': '2024-02-01'}
+    assert get_dashboard_filters({'date_start': '2024-03-01', 'date_end': '2024-01-01'}) == \
+        {'start': '2024-01-01', 'end': '2024-03-01'}
+    filters = get_dashboard_filters({'date_start': "2024-01-01' OR 1=1", 'date_end': ''})
+    assert filters['end'] == datetime.now().strftime('%Y-%m-%d')
+    assert datetime.strptime(filters['start'], '%Y-%m-%d') < datetime.now()
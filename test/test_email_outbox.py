@@ -0,0 +1,106 @@
+import smtplib
+import flask_mail
+from db import get_db
+from extensions import mail
+from services import email_outbox_service
+
+
+def _enqueue(app, recipients):
+    app.config.update(MAIL_USERNAME='noreply@test.com', EMAIL_COALESCE_SECONDS=0)
+    app.extensions['mail'].default_sender = 'noreply@test.com'
+    with app.test_request_context():
+        for i, email in enumerate(recipients):
+            email_outbox_service.enqueue_emails(
+                [(email, 'Usuario', False)], f"Asunto {i}", f"Mensaje {i}", 'http://localhost/x')
+        get_db().commit()
+
+
+def test_outbox_coalesces_per_recipient_over_one_session(app):
+    _enqueue(app, ['a@test.com', 'a@test.com', 'b@test.com'])
+
+    with app.app_context():
+        with mail.record_messages() as outbox:
+            assert email_outbox_service.drain_outbox() == 3
+
+        assert sorted(msg.recipients[0] for msg in outbox) == ['a@test.com', 'b@test.com']
+        digest = next(msg for msg in outbox if msg.recipients == ['a@test.com'])
+        assert '2 notificaciones' in digest.subject
+        estados = get_db().execute("SELECT DISTINCT estado FROM email_outbox").fetchall()
+        assert [row['estado'] for row in estados] == ['ENVIADO']
+
+
+def test_outbox_retries_with_backoff_and_gives_up(app, monkeypatch):
+    _enqueue(app, ['rechazado@test.com'])
+    app.config.update(EMAIL_OUTBOX_MAX_ATTEMPTS=2)
+
+    def refuse(self, message, envelope_from=None):
+        raise smtplib.SMTPRecipientsRefused({message.recipients[0]: (550, b'No such user')})
+    monkeypatch.setattr(flask_mail.Connection, 'send', refuse)
+
+    with app.app_context():
+        db = get_db()
+        assert email_outbox_service.drain_outbox() == 0
+        row = db.execute("SELECT * FROM email_outbox").fetchone()
+        assert row['estado'] == 'PENDIENTE'
+        assert row['intentos'] == 1
+        assert row['proximo_intento'] > row['fecha_creacion']
+
+        # No se reintenta antes de tiempo.
+        assert email_outbox_service.drain_outbox() == 0
+        assert db.execute("SELECT intentos FROM email_outbox").fetchone()[0] == 1
+
+        db.execute("UPDATE email_outbox SET proximo_intento = datetime('now', '-1 seconds')")
+        db.commit()
+        email_outbox_service.drain_outbox()
+        row = db.execute("SELECT estado, intentos FROM email_outbox").fetchone()
+        assert (row['estado'], row['intentos']) == ('ERROR', 2)
+
+
+def test_digest_recipients_are_held_until_released(app):
+    app.config.update(MAIL_USERNAME='noreply@test.com', EMAIL_COALESCE_SECONDS=0)
+    app.extensions['mail'].default_sender = 'noreply@test.com'
+    with app.test_request_context():
+        for i in range(3):
+            email_outbox_service.enqueue_emails(
+                [('resumen@test.com', 'Usuario', True)], f"Asunto {i}", f"Mensaje {i}", 'http://localhost/x')
+        get_db().commit()
+
+    with app.app_context():
+        with mail.record_messages() as outbox:
+            assert email_outbox_service.drain_outbox() == 0
+            assert email_outbox_service.release_digests() == 3
+            assert email_outbox_service.drain_outbox() == 3
+        assert len(outbox) == 1
+        assert '3 notificaciones' in outbox[0].subject
+
+
+def test_cli_releases_digests_for_cron(app, runner):
+    app.config.update(MAIL_USERNAME='noreply@test.com', EMAIL_COALESCE_SECONDS=0)
+    app.extensions['mail'].default_sender = 'noreply@test.com'
+    with app.test_request_context():
+        email_outbox_service.enqueue_emails(
+            [('resumen@test.com', 'Usuario', True)], "Asunto", "Mensaje", 'http://localhost/x')
+        get_db().commit()
+
+    with mail.record_messages() as outbox:
+        result = runner.invoke(args=['email-outbox'])
+        assert 'Correos enviados en esta pasada: 0.' in result.output
+        result = runner.invoke(args=['email-outbox', '--release-digests'])
+    assert 'Correos de resumen liberados: 1.' in result.output
+    assert 'Correos enviados en esta pasada: 1.' in result.output
+    assert len(outbox) == 1
+
+
+def test_sender_starts_once_per_process(app, monkeypatch):
+    monkeypatch.setattr(email_outbox_service, '_sender', None)
+    monkeypatch.setattr(email_outbox_service, '_sender_pid', None)
+    monkeypatch.setattr(email_outbox_service.OutboxSender, 'start', lambda self: None)
+    app.config.update(MAIL_USERNAME='noreply@test.com')
+
+    sender = email_outbox_service.start_sender(app)
+    assert sender is not None
+    assert email_outbox_service.start_sender(app) is sender
+
+    # Un proceso hijo (otro pid) arranca el suyo.
+    monkeypatch.setattr(email_outbox_service, '_sender_pid', -1)
+    assert email_outbox_service.start_sender(app) is not sender
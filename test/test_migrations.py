@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import tempfile
+from db import get_db
+from migrations import MigrationRunner, discover_migrations, split_statements
+
+
+def test_fresh_database_is_at_head(app):
+    """A freshly initialised database is stamped with the latest migration."""
+    head = discover_migrations()[-1].version
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA user_version").fetchone()[0] == head
+        pending = db.execute(
+            "SELECT COUNT(*) FROM migraciones_indices WHERE fecha_creacion IS NULL").fetchone()[0]
+        assert pending == 0
+        index = db.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name = 'idx_historial_conexion_fecha'").fetchone()
+        assert index is not None
+
+
+def test_upgrade_from_baseline_schema(app):
+    """
+    A database created from schema.sql alone (version 0) is brought to the
+    latest version, with online indexes built in a separate step.
+    """
+    db_fd, db_path = tempfile.mkstemp()
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    try:
+        with app.open_resource('schema.sql') as f:
+            conn.executescript(f.read().decode('utf8'))
+
+        runner = MigrationRunner(conn)
+        assert runner.current_version() == 0
+        assert [m.version for m in runner.upgrade(dry_run=True)] == \
+            [m.version for m in runner.migrations]
+        assert runner.current_version() == 0
+
+        applied = runner.upgrade()
+        assert runner.current_version() == runner.head()
+        assert len(applied) == len(runner.migrations)
+        assert runner.upgrade() == []
+
+        assert len(runner.pending_online()) > 0
+        built = runner.build_online_indexes(pause=0)
+        assert built > 0
+        assert runner.pending_online() == []
+    finally:
+        conn.close()
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def test_cli_dry_run_does_not_upgrade_an_old_database(app):
+    """
+    Loading the application for a 'flask' command does not apply pending
+    migrations: 'db-upgrade --dry-run' leaves 'user_version' untouched and
+    the schema is only upgraded before the first request a server handles.
+    """
+    from app import create_app
+    from db import close_all_connections
+
+    db_fd, db_path = tempfile.mkstemp()
+    conn = sqlite3.connect(db_path)
+    with app.open_resource('schema.sql') as f:
+        conn.executescript(f.read().decode('utf8'))
+    conn.close()
+
+    def user_version():
+        conn = sqlite3.connect(db_path)
+        try:
+            return conn.execute("PRAGMA user_version").fetchone()[0]
+        finally:
+            conn.close()
+
+    old_app = create_app({"TESTING": True, "DATABASE_URL": f"sqlite:///{db_path}",
+                          "WTF_CSRF_ENABLED": False})
+    try:
+        result = old_app.test_cli_runner().invoke(args=['db-upgrade', '--dry-run'])
+        assert 'Versión actual del esquema: 0' in result.output
+        assert 'no se aplicó ningún cambio' in result.output
+        assert user_version() == 0
+
+        old_app.test_client().get('/health')
+        assert user_version() == discover_migrations()[-1].version
+    finally:
+        close_all_connections(old_app)
+        os.close(db_fd)
+        os.unlink(db_path)
+
+
+def test_split_statements_keeps_trigger_bodies():
+    script = """
+        -- comentario
+        CREATE TABLE t (id INTEGER);
+        CREATE TRIGGER tr AFTER INSERT ON t BEGIN
+          UPDATE t SET id = id;
+        END;
+    """
+    statements = split_statements(script)
+    assert len(statements) == 2
+    assert statements[1].endswith('END;')
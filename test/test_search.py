@@ -1,13 +1,11 @@
-import pytest
 from db import get_db
+from services.main_service import route_search_query
 
 
-@pytest.mark.xfail(reason="La búsqueda FTS5 actual no maneja bien el orden de las palabras.")
 def test_search_word_order_independent(client, app, auth):
     """
-    Tests that search works regardless of word order.
-    The current implementation '"acero viga"*' will fail because it expects
-    the exact phrase, but the description is "viga de acero".
+    Tests that search works regardless of word order: each word is matched
+    on its own, so "acero viga" finds the description "viga de acero".
     """
     with app.app_context():
         db = get_db()
@@ -34,17 +32,14 @@ def test_search_word_order_independent(client, app, auth):
         db.commit()
 
     auth.login()
-    # Search for "acero viga". The current implementation will fail this.
     response = client.get('/buscar?q=acero+viga')
     assert response.status_code == 200
     assert b'ORD-TEST-01' in response.data, "Search should find results regardless of word order."
 
 
-@pytest.mark.xfail(reason="La búsqueda FTS5 actual no maneja bien los prefijos con desorden.")
 def test_search_prefix_and_word_order(client, app, auth):
     """
     Tests that search works with both prefixes and any word order.
-    The current implementation '"acer vig"*' will fail.
     """
     with app.app_context():
         db = get_db()
@@ -72,7 +67,6 @@ def test_search_prefix_and_word_order(client, app, auth):
         db.commit()
 
     auth.login()
-    # Search for "acer vig". The current implementation will fail this.
     response = client.get('/buscar?q=acer+vig')
     assert response.status_code == 200
     assert b'ORD-PREFIX-TEST-01' in response.data, "Search should work with prefixes and any word order."
@@ -87,7 +81,6 @@ def test_search_with_quote_fails_gracefully(client, auth):
     response = client.get('/buscar?q=viga+"')
     # The app should handle the error and not crash (i.e., not return a 500).
     # It should return a 200 OK with likely no results.
-    # This assertion will fail with the current buggy code.
     assert response.status_code == 200
 
 
@@ -112,3 +105,199 @@ def test_search_with_apostrophe_fails_gracefully(client, auth):
     # The app should handle the FTS5 syntax error from the apostrophe
     # and return a 200 OK, not a 500 crash.
     assert response.status_code == 200
+
+
+def _insert_conexiones(app, filas):
+    """Inserta conexiones (codigo, tipo, descripcion, estado) en 'Proyecto Test'."""
+    with app.app_context():
+        db = get_db()
+        solicitante_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'solicitante'").fetchone()['id']
+        project_id = db.execute(
+            "SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+        db.executemany(
+            """
+            INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, descripcion, solicitante_id, estado)
+            VALUES (?, ?, ?, 'Subtipo Test', 'Tipologia Test', ?, ?, ?)
+            """,
+            [(codigo, project_id, tipo, descripcion, solicitante_id, estado)
+             for codigo, tipo, descripcion, estado in filas])
+        db.commit()
+
+
+def test_search_api_ranks_paginates_and_counts_facets(client, app, auth):
+    filas = [(f'PLACA-{i:02d}', 'MOMENTO' if i % 2 else 'CORTANTE',
+              f'placa base numero {i}', 'APROBADO' if i < 3 else 'SOLICITADO')
+             for i in range(7)]
+    # El código pesa más que la descripción: esta conexión va la primera.
+    filas.append(('ANCLAJE-01', 'CORTANTE', 'anclaje de placa', 'SOLICITADO'))
+    filas.append(('CODO-01', 'CORTANTE', 'anclaje con anclaje doble', 'SOLICITADO'))
+    _insert_conexiones(app, filas)
+    auth.login()
+
+    primera = client.get('/api/conexiones/buscar?q=anclaje').get_json()
+    assert [r['codigo_conexion'] for r in primera['resultados']][0] == 'ANCLAJE-01'
+    assert '<mark>ANCLAJE</mark>' in primera['resultados'][0]['codigo_resaltado']
+
+    primera = client.get('/api/conexiones/buscar?q=placa&limit=5').get_json()
+    assert primera['total'] == 8
+    assert len(primera['resultados']) == 5
+    facetas = primera['facetas']
+    assert {f['valor']: f['total'] for f in facetas['estado']} == {'APROBADO': 3, 'SOLICITADO': 5}
+    assert {f['valor']: f['total'] for f in facetas['tipo']} == {'CORTANTE': 5, 'MOMENTO': 3}
+    assert facetas['proyecto'][0]['nombre'] == 'Proyecto Test'
+    assert primera['next_cursor']
+
+    segunda = client.get('/api/conexiones/buscar', query_string={
+        'q': 'placa', 'limit': 5, 'cursor': primera['next_cursor']}).get_json()
+    assert segunda['facetas'] is None
+    assert segunda['next_cursor'] is None
+    codigos = [r['codigo_conexion'] for r in primera['resultados'] + segunda['resultados']]
+    assert len(codigos) == len(set(codigos)) == 8
+
+    filtrada = client.get('/api/conexiones/buscar?q=placa&estado=APROBADO').get_json()
+    assert filtrada['total'] == 3
+    assert all(r['estado'] == 'APROBADO' for r in filtrada['resultados'])
+
+
+def test_search_page_escapes_and_highlights_snippets(client, app, auth):
+    _insert_conexiones(app, [
+        ('XSS-01', 'MOMENTO', '<script>alert(1)</script> soldadura de prueba', 'SOLICITADO')])
+    auth.login()
+    response = client.get('/buscar?q=soldadura')
+    assert response.status_code == 200
+    assert b'<mark>soldadura</mark>' in response.data
+    assert b'<script>alert(1)</script>' not in response.data
+    assert b'&lt;script&gt;' in response.data
+
+
+def test_search_router_picks_index_by_query_shape():
+    assert [i for i, _ in route_search_query('acero viga')] == ['palabras', 'trigramas']
+    assert [i for i, _ in route_search_query('MVW14X22')] == ['trigramas', 'palabras']
+    assert [i for i, _ in route_search_query('viga-col')] == ['trigramas', 'palabras']
+    # Los términos de menos de tres caracteres no caben en el índice de trigramas.
+    assert [i for i, _ in route_search_query('T0')] == ['palabras']
+    assert route_search_query('"(') == []
+
+
+def test_search_trigram_index_matches_substrings_and_follows_updates(client, app, auth):
+    with app.app_context():
+        db = get_db()
+        solicitante_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'solicitante'").fetchone()['id']
+        project_id = db.execute(
+            "SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+        conexion_id = db.execute(
+            """
+            INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, descripcion, detalles_json, solicitante_id)
+            VALUES ('MVW14X22CFT0', ?, 'MOMENTO', 'VIGA-COLUMNA (ALA)', 'T0', 'nudo de portico', '{"Perfil 1": "W14X22"}', ?)
+            """, (project_id, solicitante_id)).lastrowid
+        db.commit()
+    auth.login()
+
+    def buscar(q):
+        data = client.get('/api/conexiones/buscar', query_string={'q': q}).get_json()
+        return data['indice'], [r['codigo_conexion'] for r in data['resultados']]
+
+    assert buscar('14x22cf') == ('trigramas', ['MVW14X22CFT0'])
+    assert buscar('columna (ala)') == ('trigramas', ['MVW14X22CFT0'])
+    # 'momento' no está en el código ni en la descripción: el índice de
+    # palabras no encuentra nada y el router prueba con el de trigramas.
+    assert buscar('momento') == ('trigramas', ['MVW14X22CFT0'])
+    assert buscar('portico') == ('palabras', ['MVW14X22CFT0'])
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE conexiones SET detalles_json = '{\"Perfil 1\": \"HSS6X6\"}' WHERE id = ?",
+                   (conexion_id,))
+        db.commit()
+    assert buscar('HSS6')[1] == ['MVW14X22CFT0']
+    assert buscar('W14X22')[1] == ['MVW14X22CFT0']  # sigue en el código
+    assert buscar('X22 HSS6')[1] == ['MVW14X22CFT0']
+
+    with app.app_context():
+        db = get_db()
+        db.execute("DELETE FROM conexiones WHERE id = ?", (conexion_id,))
+        db.commit()
+    assert buscar('HSS6')[1] == []
+
+
+def test_search_is_scoped_to_user_projects_and_membership_version(client, app, auth):
+    with app.app_context():
+        db = get_db()
+        admin_id = db.execute("SELECT id FROM usuarios WHERE username = 'admin'").fetchone()['id']
+        solicitante_id = db.execute(
+            "SELECT id FROM usuarios WHERE username = 'solicitante'").fetchone()['id']
+        propio_id = db.execute(
+            "SELECT id FROM proyectos WHERE nombre = 'Proyecto Test'").fetchone()['id']
+        ajeno_id = db.execute(
+            "INSERT INTO proyectos (nombre, descripcion, creador_id) VALUES ('Proyecto Ajeno', 'Desc', ?)",
+            (admin_id,)).lastrowid
+        db.executemany(
+            """
+            INSERT INTO conexiones (codigo_conexion, proyecto_id, tipo, subtipo, tipologia, descripcion, solicitante_id)
+            VALUES (?, ?, 'MOMENTO', 'Subtipo Test', 'Tipologia Test', 'placa de union', ?)
+            """, [('PROPIO-01', propio_id, solicitante_id), ('AJENO-01', ajeno_id, admin_id)])
+        db.execute("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                   (propio_id, solicitante_id))
+        db.commit()
+
+    def buscar():
+        data = client.get('/api/conexiones/buscar?q=placa').get_json()
+        return sorted(r['codigo_conexion'] for r in data['resultados']), data['facetas']['proyecto']
+
+    auth.login('solicitante', 'password')
+    codigos, proyectos = buscar()
+    assert codigos == ['PROPIO-01']
+    assert [p['nombre'] for p in proyectos] == ['Proyecto Test']
+    assert b'AJENO-01' not in client.get('/buscar?q=placa').data
+    auth.logout()
+
+    auth.login()
+    assert buscar()[0] == ['AJENO-01', 'PROPIO-01']
+    auth.logout()
+
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO proyecto_usuarios (proyecto_id, usuario_id) VALUES (?, ?)",
+                   (ajeno_id, solicitante_id))
+        db.commit()
+    auth.login('solicitante', 'password')
+    assert buscar()[0] == ['AJENO-01', 'PROPIO-01']
+
+
+def test_search_cache_skips_fts_until_connections_change(client, app, auth, monkeypatch):
+    from dal.sqlite_dal import SQLiteDAL
+
+    _insert_conexiones(app, [('CACHE-01', 'MOMENTO', 'rigidizador de alma', 'SOLICITADO')])
+    calls = []
+    original = SQLiteDAL.search_conexiones_fts
+
+    def counting_search(self, *args, **kwargs):
+        calls.append(args[0])
+        return original(self, *args, **kwargs)
+    monkeypatch.setattr(SQLiteDAL, 'search_conexiones_fts', counting_search)
+
+    auth.login()
+
+    def buscar(q):
+        data = client.get('/api/conexiones/buscar', query_string={'q': q}).get_json()
+        return [r['codigo_conexion'] for r in data['resultados']]
+
+    assert buscar('rigidizador') == ['CACHE-01']
+    # Mismo texto normalizado: se sirve desde la caché sin consultar FTS.
+    assert buscar('  RIGIDIZADOR ') == ['CACHE-01']
+    assert len(calls) == 1
+
+    # Cualquier escritura en 'conexiones' sube la versión de datos.
+    _insert_conexiones(app, [('CACHE-02', 'MOMENTO', 'otro rigidizador', 'SOLICITADO')])
+    assert sorted(buscar('rigidizador')) == ['CACHE-01', 'CACHE-02']
+    assert len(calls) == 2
+
+    with app.app_context():
+        db = get_db()
+        db.execute("UPDATE conexiones SET estado = 'EN_PROCESO' WHERE codigo_conexion = 'CACHE-01'")
+        db.commit()
+    data = client.get('/api/conexiones/buscar?q=rigidizador').get_json()
+    assert {f['valor']: f['total'] for f in data['facetas']['estado']} == {'EN_PROCESO': 1, 'SOLICITADO': 1}
+    assert len(calls) == 3
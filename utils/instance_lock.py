@@ -0,0 +1,63 @@
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows (waitress detrás de IIS)
+    fcntl = None
+    import msvcrt
+
+
+class InstanceLock:
+    """
+    Cerrojo de archivo no bloqueante compartido por todos los procesos que
+    usan la misma carpeta 'instance'. Solo el proceso que lo obtiene ejecuta
+    las tareas que deben correr una vez por despliegue; el sistema operativo
+    lo libera si ese proceso muere, y otro puede tomarlo en su lugar.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._lock = threading.Lock()
+
+    @property
+    def held(self):
+        return self._file is not None
+
+    def acquire(self):
+        """Intenta tomar el cerrojo sin esperar. Devuelve True si este proceso lo tiene."""
+        with self._lock:
+            if self._file is not None:
+                return True
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            f = open(self.path, 'a+')
+            try:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            except OSError:
+                f.close()
+                return False
+            f.seek(0)
+            f.truncate()
+            f.write(str(os.getpid()))
+            f.flush()
+            self._file = f
+            return True
+
+    def release(self):
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                if fcntl is not None:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                else:
+                    self._file.seek(0)
+                    msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            finally:
+                self._file.close()
+                self._file = None
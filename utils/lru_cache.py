@@ -0,0 +1,113 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class _Flight:
+    """Un cálculo en curso de una clave; los demás hilos esperan su resultado."""
+
+    __slots__ = ('event', 'value', 'failed', 'stale')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.failed = False
+        self.stale = False
+
+
+class LRUCache:
+    """
+    Caché en proceso con tamaño máximo, caducidad y cálculo único por clave.
+
+    Al superar 'max_entries' se descarta la entrada usada hace más tiempo. Si
+    varios hilos piden a la vez una clave ausente, solo uno ejecuta 'compute'
+    y el resto espera su resultado. Una invalidación que llega mientras se
+    calcula una clave impide guardar ese resultado, que podría estar obsoleto.
+    Las claves son tuplas; 'invalidate' acepta un prefijo de la tupla.
+    """
+
+    def __init__(self, max_entries=1024, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key, compute):
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and time.monotonic() - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.misses += 1
+                else:
+                    self.waits += 1
+
+            if not leader:
+                flight.event.wait()
+                if flight.failed:
+                    # El cálculo falló en el otro hilo: se reintenta aquí.
+                    continue
+                return flight.value
+
+            try:
+                value = compute()
+            except BaseException:
+                with self._lock:
+                    self._flights.pop(key, None)
+                flight.failed = True
+                flight.event.set()
+                raise
+
+            with self._lock:
+                self._flights.pop(key, None)
+                if not flight.stale:
+                    self._entries[key] = (value, time.monotonic())
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            flight.value = value
+            flight.event.set()
+            return value
+
+    def invalidate(self, *prefix):
+        """Descarta las claves que empiezan por 'prefix' (todas si está vacío)."""
+        n = len(prefix)
+        with self._lock:
+            keys = [key for key in self._entries if key[:n] == prefix]
+            for key in keys:
+                del self._entries[key]
+            for key, flight in self._flights.items():
+                if key[:n] == prefix:
+                    flight.stale = True
+            self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self.invalidate()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.waits
+            return {
+                'entradas': len(self._entries),
+                'max_entradas': self.max_entries,
+                'aciertos': self.hits,
+                'fallos': self.misses,
+                'esperas': self.waits,
+                'desalojos': self.evictions,
+                'invalidaciones': self.invalidations,
+                'tasa_aciertos': round((self.hits + self.waits) / lookups * 100, 1) if lookups else None,
+            }
@@ -0,0 +1,121 @@
+import time
+import threading
+from flask import current_app, g
+from db import get_read_db
+
+
+class UserContext:
+    """Datos del usuario, sus roles y su número de notificaciones no leídas."""
+
+    __slots__ = ('user', 'roles', 'version', 'checked_at')
+
+    def __init__(self, user, roles, version):
+        self.user = user
+        self.roles = roles
+        self.version = version
+        self.checked_at = time.monotonic()
+
+
+class UserContextCache:
+    """
+    Caché en proceso del contexto de cada usuario autenticado.
+
+    Durante 'ttl' segundos una entrada se usa sin consultar la base de datos.
+    Pasado ese tiempo se revalida leyendo solo 'usuarios.contexto_version',
+    que los triggers incrementan con cada cambio del usuario, de sus roles o
+    de sus notificaciones; la entrada completa se recarga solo si cambió.
+    """
+
+    def __init__(self, ttl=5.0, max_entries=2048):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return self._entries.get(user_id)
+
+    def put(self, user_id, context):
+        with self._lock:
+            if user_id not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[user_id] = context
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+def init_app(app):
+    app.extensions['user_context'] = UserContextCache(
+        ttl=app.config.get('USER_CONTEXT_TTL', 0 if app.testing else 5.0),
+        max_entries=app.config.get('USER_CONTEXT_MAX_ENTRIES', 2048))
+
+
+def load_user_context(user_id):
+    """
+    Devuelve el UserContext del usuario o None si ya no existe. En una
+    solicitud con la entrada vigente no se ejecuta ninguna consulta.
+    """
+    cache = current_app.extensions['user_context']
+    context = cache.get(user_id)
+    now = time.monotonic()
+    if context is not None and now - context.checked_at < cache.ttl:
+        return context
+
+    cursor = get_read_db().cursor()
+    try:
+        if context is not None:
+            cursor.execute(
+                "SELECT contexto_version FROM usuarios WHERE id = ?", (user_id,))
+            row = cursor.fetchone()
+            if row is None:
+                cache.invalidate(user_id)
+                return None
+            if row['contexto_version'] == context.version:
+                context.checked_at = now
+                return context
+
+        cursor.execute("SELECT * FROM usuarios WHERE id = ?", (user_id,))
+        user_data = cursor.fetchone()
+        if user_data is None:
+            cache.invalidate(user_id)
+            return None
+
+        cursor.execute("""
+            SELECT r.nombre FROM roles r
+            JOIN usuario_roles ur ON r.id = ur.rol_id
+            WHERE ur.usuario_id = ?
+        """, (user_id,))
+        roles = [row['nombre'] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+    context = UserContext(dict(user_data), roles,
+                          user_data['contexto_version'])
+    cache.put(user_id, context)
+    return context
+
+
+def invalidate_user_context(user_id=None):
+    """
+    Descarta la entrada local del usuario (o todas). Los demás procesos lo
+    detectan por 'contexto_version' al revalidar.
+    """
+    current_app.extensions['user_context'].invalidate(user_id)
+
+
+def get_unread_notification_count():
+    """
+    Número de notificaciones no leídas del usuario actual. Es la columna
+    'notificaciones_no_leidas' que mantienen los triggers, cargada con la fila
+    del usuario, así que no ejecuta ninguna consulta.
+    """
+    context = g.get('user_context')
+    if context is None:
+        return 0
+    return context.user['notificaciones_no_leidas']
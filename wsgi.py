@@ -21,4 +21,7 @@ if __name__ == "__main__":
     from waitress import serve
     # Aquí la aplicación escuchará en el puerto 5000 (o el que elijas)
     # Esto es el puerto INTERNO para Waitress, no el que IIS expondrá al público
-    serve(app, host="127.0.0.1", port=5000)
+    # Cada conexión de /api/stream ocupa un hilo mientras está abierta, así que
+    # se reservan hilos de más respecto a SSE_MAX_STREAMS.
+    serve(app, host="127.0.0.1", port=5000,
+          threads=int(os.environ.get('WAITRESS_THREADS', 16)))